@@ -0,0 +1,300 @@
+
+import sys
+import os
+import json
+import time
+import uuid
+import shutil
+import asyncio
+import argparse
+import platform
+import statistics
+import subprocess
+
+# Add python-core to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Reproducible by default: deterministic local AI stages without simulated network latency.
+# Set before importing main, which builds its providers at import time.
+os.environ.setdefault("AI_PROVIDER", "local")
+os.environ.setdefault("LOCAL_AI_LATENCY_MS", "0")
+
+BENCH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks")
+INPUTS_DIR = os.path.join(BENCH_DIR, "inputs")
+HISTORY_PATH = os.path.join(BENCH_DIR, "history.json")
+BASELINE_PATH = os.path.join(BENCH_DIR, "baseline.json")
+
+DEFAULT_DURATIONS = "10,60"
+DEFAULT_RESOLUTIONS = "1280x720,1920x1080"
+SOURCE_FPS = 30
+
+# Allowed relative increase over the baseline before a metric counts as a regression
+DEFAULT_THRESHOLDS = {"wall_s": 0.15, "cpu_s": 0.15, "peak_rss_mb": 0.25, "bytes_written_mb": 0.10}
+# Below these baseline values the relative change is mostly noise
+NOISE_FLOORS = {"wall_s": 0.25, "cpu_s": 0.25, "peak_rss_mb": 50.0, "bytes_written_mb": 1.0}
+# Knobs that change what the pipeline does; recorded with every run so histories stay comparable
+CONFIG_PREFIXES = ("AI_", "STT_", "TRANSLATION_", "TTS_", "RENDER_", "CHUNK", "ARTIFACT_", "AUDIO_CACHE",
+                   "PREVIEW_", "SUBTITLE_", "HLS_", "LOCAL_AI_")
+
+def _read_proc(path, keys):
+    values = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in keys:
+                    values[name] = int(value.split()[0])
+    except OSError:
+        pass
+    return values
+
+class ResourceProbe:
+    """
+    Per-stage resource deltas, hooked into services.metrics.timed(). Linux-only counters degrade
+    to None elsewhere. Bytes written is /proc/self/io wchar, which includes reaped children (ffmpeg).
+    """
+    def __init__(self):
+        self.stages = {}
+        self._open = {}
+
+    def snapshot(self):
+        import resource
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        io = _read_proc("/proc/self/io", ("wchar",))
+        return {
+            "wall": time.perf_counter(),
+            "cpu": own.ru_utime + own.ru_stime,
+            "children_cpu": children.ru_utime + children.ru_stime,
+            "children_maxrss_kb": children.ru_maxrss,
+            "wchar": io.get("wchar"),
+        }
+
+    def reset_peak_rss(self):
+        # Linux >= 4.0: "5" resets VmHWM, so the next read is this stage's own peak
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+        except OSError:
+            pass
+
+    def __call__(self, stage, started):
+        if started:
+            self.reset_peak_rss()
+            self._open[stage] = self.snapshot()
+            return
+        before = self._open.pop(stage, None)
+        if before is None:
+            return
+        after = self.snapshot()
+        hwm = _read_proc("/proc/self/status", ("VmHWM",)).get("VmHWM")
+        grew = after["children_maxrss_kb"] > before["children_maxrss_kb"]
+        sample = {
+            "wall_s": after["wall"] - before["wall"],
+            "cpu_s": (after["cpu"] - before["cpu"]) + (after["children_cpu"] - before["children_cpu"]),
+            "children_cpu_s": after["children_cpu"] - before["children_cpu"],
+            "peak_rss_mb": hwm / 1024 if hwm else None,
+            # ru_maxrss of children is a high-water mark: only visible when this stage raised it
+            "child_peak_rss_mb": after["children_maxrss_kb"] / 1024 if grew else None,
+            "bytes_written_mb": ((after["wchar"] - before["wchar"]) / 1024 ** 2
+                                 if after["wchar"] is not None and before["wchar"] is not None else None),
+        }
+        totals = self.stages.setdefault(stage, {})
+        for key, value in sample.items():
+            if value is None:
+                totals.setdefault(key, None)
+            elif key.startswith("peak") or key.startswith("child_peak"):
+                totals[key] = max(value, totals.get(key) or 0)
+            else:
+                totals[key] = (totals.get(key) or 0) + value
+
+def make_input(ffmpeg_path, resolution, duration):
+    """Synthetic source (testsrc2 + sine), generated once per case and cached in benchmarks/inputs/."""
+    os.makedirs(INPUTS_DIR, exist_ok=True)
+    path = os.path.join(INPUTS_DIR, f"testsrc2_{resolution}_{duration}s.mp4")
+    if os.path.exists(path):
+        return path
+    tmp_path = path + ".part.mp4"
+    subprocess.run([
+        ffmpeg_path, '-y', '-v', 'error',
+        '-f', 'lavfi', '-i', f"testsrc2=size={resolution}:rate={SOURCE_FPS}:duration={duration}",
+        '-f', 'lavfi', '-i', f"sine=frequency=220:beep_factor=4:sample_rate=48000:duration={duration}",
+        # Single-threaded x264 so the same arguments always produce the same bytes
+        '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-threads', '1', '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac', '-b:a', '128k', '-shortest', tmp_path
+    ], check=True)
+    os.replace(tmp_path, path)
+    return path
+
+def run_case(main, source_path, formats, probe):
+    """One full _process_video_task run on a copy of source_path; returns (stages, total)."""
+    from services.media_store import media_store
+
+    task_id = f"bench-{uuid.uuid4().hex[:8]}"
+    file_path = os.path.join(main.UPLOAD_DIR, f"{task_id}.mp4")
+    # Same upload path as /api/process-video
+    digest = media_store.put_file(source_path, owner=os.path.abspath(file_path))
+    media_store.materialize(digest, file_path)
+    main.artifacts.register(task_id, file_path, "upload", consumers=["stt", "sync", "final"])
+    main.update_task(task_id, "queued", 0, "Queued for processing...")
+
+    probe.stages.clear()
+    probe.reset_peak_rss()
+    before = probe.snapshot()
+    asyncio.run(main._process_video_task(task_id, file_path, "ja", formats=formats, preview="off"))
+    after = probe.snapshot()
+
+    task = main.task_store.pop(task_id, {})
+    main.artifacts.discard(task_id)
+    if task.get("status") != "completed":
+        raise RuntimeError(f"Pipeline {task.get('status')}: {task.get('message')}")
+
+    total = {
+        "wall_s": after["wall"] - before["wall"],
+        "cpu_s": (after["cpu"] - before["cpu"]) + (after["children_cpu"] - before["children_cpu"]),
+        "children_cpu_s": after["children_cpu"] - before["children_cpu"],
+        # Stages reset VmHWM, so the run's peak is the largest of theirs and what came after
+        "peak_rss_mb": max([v["peak_rss_mb"] for v in probe.stages.values() if v.get("peak_rss_mb")]
+                           + [(_read_proc("/proc/self/status", ("VmHWM",)).get("VmHWM") or 0) / 1024]) or None,
+        # Largest ffmpeg child so far in this benchmark process (getrusage can't be reset)
+        "child_peak_rss_mb": after["children_maxrss_kb"] / 1024,
+        "bytes_written_mb": ((after["wchar"] - before["wchar"]) / 1024 ** 2
+                             if after["wchar"] is not None and before["wchar"] is not None else None),
+    }
+    return {stage: dict(values) for stage, values in probe.stages.items()}, total
+
+def _median(samples):
+    """Per-metric median across repeats (None when a metric wasn't measurable)."""
+    merged = {}
+    for key in {k for s in samples for k in s}:
+        values = [s[key] for s in samples if s.get(key) is not None]
+        merged[key] = round(statistics.median(values), 3) if values else None
+    return dict(sorted(merged.items()))
+
+def environment(ffmpeg_path):
+    def run(cmd):
+        try:
+            return subprocess.run(cmd, capture_output=True, text=True).stdout.splitlines()[0].strip()
+        except (OSError, IndexError):
+            return None
+    return {
+        "commit": run(["git", "-C", os.path.dirname(os.path.abspath(__file__)), "rev-parse", "--short", "HEAD"]),
+        "host": platform.node(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "ffmpeg": run([ffmpeg_path, "-version"]),
+        "config": {k: v for k, v in sorted(os.environ.items()) if k.startswith(CONFIG_PREFIXES)},
+    }
+
+def compare(run, baseline, thresholds):
+    """Metrics that grew beyond their threshold vs. the baseline: [(case, stage, metric, base, now, change)]."""
+    regressions = []
+    for case_id, case in run["cases"].items():
+        base_case = baseline["cases"].get(case_id)
+        if not base_case:
+            continue
+        rows = [("total", case["total"], base_case["total"])]
+        rows += [(stage, values, base_case["stages"].get(stage)) for stage, values in case["stages"].items()]
+        for stage, values, base_values in rows:
+            if not base_values:
+                continue
+            for metric, limit in thresholds.items():
+                base, now = base_values.get(metric), values.get(metric)
+                if base is None or now is None or base < NOISE_FLOORS[metric]:
+                    continue
+                change = (now - base) / base
+                if change > limit:
+                    regressions.append((case_id, stage, metric, base, now, change))
+    return regressions
+
+def _load_json(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark on synthetic media (AI stages local)")
+    parser.add_argument("--durations", default=DEFAULT_DURATIONS, help="Source lengths in seconds")
+    parser.add_argument("--resolutions", default=DEFAULT_RESOLUTIONS)
+    parser.add_argument("--formats", default="source", help="Output variants, as for /api/process-video")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per case; the median is recorded")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--history", default=HISTORY_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="Make this run the new baseline")
+    parser.add_argument("--label", default=None, help="Free-form note stored with the run")
+    for metric, limit in DEFAULT_THRESHOLDS.items():
+        parser.add_argument(f"--max-{metric.replace('_', '-')}", dest=metric, type=float, default=limit,
+                            help=f"Allowed relative increase of {metric} (default {int(limit * 100)}%%)")
+    args = parser.parse_args()
+
+    import main
+    from services.metrics import STAGE_LISTENERS
+
+    main.ensure_work_dirs()
+
+    ffmpeg_path = main.ffmpeg_handler.ffmpeg_path
+    if not shutil.which(ffmpeg_path) and not os.path.exists(ffmpeg_path):
+        print(f"[!] ffmpeg not found ({ffmpeg_path})")
+        sys.exit(1)
+    probe = ResourceProbe()
+    STAGE_LISTENERS.append(probe)
+    formats = [f.strip() for f in args.formats.split(",") if f.strip()]
+
+    run = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "label": args.label, "repeat": args.repeat,
+           "formats": formats, "environment": environment(ffmpeg_path), "cases": {}}
+    print(f"[-] Benchmarking the pipeline ({args.repeat}x per case, formats {', '.join(formats)})...")
+    for resolution in args.resolutions.split(","):
+        for duration in (int(d) for d in args.durations.split(",")):
+            case_id = f"{resolution}_{duration}s"
+            source = make_input(ffmpeg_path, resolution, duration)
+            stage_runs, totals = {}, []
+            for i in range(args.repeat):
+                try:
+                    stages, total = run_case(main, source, formats, probe)
+                except Exception as e:
+                    print(f"[!] {case_id}: {e}")
+                    sys.exit(1)
+                for stage, values in stages.items():
+                    stage_runs.setdefault(stage, []).append(values)
+                totals.append(total)
+                print(f"    {case_id} run {i + 1}: {total['wall_s']:.1f}s wall, {total['cpu_s']:.1f}s cpu")
+            case = {"stages": {s: _median(v) for s, v in stage_runs.items()}, "total": _median(totals)}
+            run["cases"][case_id] = case
+            t = case["total"]
+            print(f"[+] {case_id:<16} {t['wall_s']:7.2f}s wall {t['cpu_s']:7.2f}s cpu "
+                  f"{t['peak_rss_mb'] or 0:7.1f} MB rss {t['bytes_written_mb'] or 0:8.1f} MB written")
+            for stage, values in case["stages"].items():
+                print(f"      {stage:<14} {values['wall_s']:7.2f}s wall {values['cpu_s']:7.2f}s cpu")
+
+    history = _load_json(args.history, [])
+    history.append(run)
+    _write_json(args.history, history)
+    print(f"[+] Appended to {args.history} ({len(history)} runs)")
+
+    baseline = _load_json(args.baseline, None)
+    if args.save_baseline:
+        _write_json(args.baseline, run)
+        print(f"[+] Saved as baseline: {args.baseline}")
+    elif baseline is None:
+        print(f"[-] No baseline yet; run with --save-baseline to create {args.baseline}")
+    else:
+        if baseline["environment"].get("host") != run["environment"]["host"]:
+            print(f"[!] Baseline was recorded on {baseline['environment'].get('host')}; numbers may not compare")
+        thresholds = {metric: getattr(args, metric) for metric in DEFAULT_THRESHOLDS}
+        regressions = compare(run, baseline, thresholds)
+        print(f"[-] Compared with baseline {baseline['timestamp']} ({baseline['environment'].get('commit')})")
+        for case_id, stage, metric, base, now, change in regressions:
+            print(f"[!] {case_id} {stage} {metric}: {base:.2f} -> {now:.2f} (+{change:.0%}, "
+                  f"limit {thresholds[metric]:.0%})")
+        if regressions:
+            sys.exit(1)
+        print("[+] No regressions")
@@ -0,0 +1,66 @@
+
+import sys
+import os
+import re
+import time
+import argparse
+import subprocess
+
+# Add python-core to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.ffmpeg_handler import FFmpegHandler
+from services.resizer import resizer, BLUR_MODES
+
+# Synthetic 1080p source: moving test pattern with a hard cut every 5 s (exercises "scene" mode)
+SOURCE_FPS = 30
+
+def _source_args(duration):
+    return ['-f', 'lavfi', '-i',
+            f"testsrc2=size=1920x1080:rate={SOURCE_FPS}:duration={duration},"
+            f"hue=h='360*floor(t/5)/4'"]
+
+def bench_mode(ffmpeg_path, mode, duration):
+    """Encodes the 9:16 Shorts variant of the synthetic clip to the null muxer; returns fps."""
+    filter_complex, labels = resizer.split_graph(["9:16"], blur_mode=mode, fps=SOURCE_FPS)
+    cmd = ([ffmpeg_path, '-hide_banner', '-y', '-benchmark'] + _source_args(duration)
+           + ['-filter_complex', filter_complex]
+           + resizer.output_args("9:16", labels["9:16"], audio_map=None,
+                                 profile={"preset": "ultrafast", "c:a": None})
+           + ['-f', 'null', '-'])
+    start = time.monotonic()
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    wall = time.monotonic() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"{mode}: ffmpeg failed\n{result.stderr[-2000:]}")
+    frames = SOURCE_FPS * duration
+    counts = re.findall(r"frame=\s*(\d+)", result.stderr)
+    if counts:
+        frames = int(counts[-1])
+    utime = re.search(r"utime=([\d.]+)s", result.stderr)
+    return {"mode": mode, "frames": frames, "wall_s": wall, "fps": frames / wall,
+            "cpu_s": float(utime.group(1)) if utime else None}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare Shorts background blur modes (fps)")
+    parser.add_argument("--duration", type=int, default=10, help="Synthetic clip length in seconds")
+    parser.add_argument("--modes", default=",".join(BLUR_MODES))
+    args = parser.parse_args()
+
+    ffmpeg_path = FFmpegHandler().ffmpeg_path
+    print(f"[-] Benchmarking 9:16 blur modes on {args.duration}s of 1080p{SOURCE_FPS} testsrc2...")
+    results = []
+    for mode in args.modes.split(","):
+        try:
+            r = bench_mode(ffmpeg_path, mode, args.duration)
+        except (RuntimeError, FileNotFoundError) as e:
+            print(f"[!] {e}")
+            sys.exit(1)
+        results.append(r)
+        cpu = f", cpu {r['cpu_s']:.1f}s" if r["cpu_s"] is not None else ""
+        print(f"[+] {mode:<9} {r['fps']:7.1f} fps ({r['frames']} frames in {r['wall_s']:.1f}s{cpu})")
+
+    baseline = next((r for r in results if r["mode"] == "full"), None)
+    if baseline:
+        for r in results:
+            print(f"    {r['mode']:<9} x{r['fps'] / baseline['fps']:.2f} vs full")
@@ -1,14 +1,15 @@
 
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Form, Header
+from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Form, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import StreamingResponse, FileResponse, PlainTextResponse
 from pydantic import BaseModel
-import uvicorn
 import os
-import shutil
 import uuid
 import json
-from typing import Optional, Dict
+import asyncio
+from typing import Optional, Dict, List
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
 import sys
@@ -23,7 +24,23 @@ from services.ffmpeg_handler import ffmpeg_handler
 from services.ai_handler import ai_handler
 from services.filters import filters
 from services.sync_logic import sync_logic
-from services.resizer import resizer
+from services.resizer import resizer, VARIANTS
+from services.media_store import media_store
+from services.excel_parser import iter_storyboard, CSV_EXTENSIONS
+from services.storyboard_diff import storyboard_diff
+from services.transcription import chunked_transcriber
+from services.chunked_encoder import chunked_encoder
+from services.render_jobs import render_queue, RENDER_LOCAL_WORKERS, RENDER_WORKER_TOKEN
+from services.artifacts import ArtifactManager, ARTIFACT_KEEP_FAILED
+from services import delivery
+from services.preview import preview_command, PREVIEW_MODE, PREVIEW_MODES
+from services.derivatives import video_derivatives, image_derivatives, derivatives_dir_for
+from services.storyboard_dag import storyboard_executor
+from services import subtitles
+from services.subtitles import SUBTITLE_MODE, SUBTITLE_MODES, SUBTITLE_LANGS
+from services.tts_analysis import analyze_and_trim
+from services.metrics import metrics, timed, cache_result, FALLBACKS
+from services.profiler import task_profiler, ProfilingExecutor
 
 # Load environment variables
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', '.env.local'))
@@ -51,11 +68,18 @@ app.add_middleware(
 # Upload directory
 UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "uploads")
 OUTPUT_DIR = os.path.join(os.path.dirname(__file__), "outputs")
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-# Mount outputs for static serving
-app.mount("/outputs", StaticFiles(directory=OUTPUT_DIR), name="outputs")
+def ensure_work_dirs():
+    """Created at startup rather than on import, so importing main (tests, tools) has no side effects."""
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+# "none": stream extracted audio straight to STT; "wav": also keep {task_id}.wav in UPLOAD_DIR
+AUDIO_CACHE_POLICY = os.getenv("AUDIO_CACHE_POLICY", "none")
+
+# Tracks per-task work files and enforces the disk quota over UPLOAD_DIR/OUTPUT_DIR
+artifacts = ArtifactManager(UPLOAD_DIR, OUTPUT_DIR)
+
 
 # Global Task Store (In-memory for prototype)
 # Structure: {task_id: {"status": "processing", "progress": 0, "message": "...", "result_url": ""}}
@@ -72,6 +96,16 @@ class TaskStatusResponse(BaseModel):
     progress: int
     message: str
     result_url: Optional[str] = None
+    variants: Optional[Dict[str, str]] = None
+    streams: Optional[Dict[str, str]] = None
+    preview_url: Optional[str] = None
+    thumbnails: Optional[Dict[str, str]] = None
+    subtitles: Optional[Dict[str, str]] = None
+    speech: Optional[dict] = None
+    expired: Optional[bool] = None
+    nodes: Optional[Dict[str, int]] = None
+    stages: Optional[Dict[str, float]] = None
+    profile_url: Optional[str] = None
 
 @app.get("/")
 def health_check():
@@ -82,6 +116,47 @@ def health_check():
         "ffmpeg": ffmpeg_handler.ffmpeg_path
     }
 
+@app.get("/api/media-store/stats")
+def get_media_store_stats():
+    return media_store.stats()
+
+@app.post("/api/media-store/gc")
+def run_media_store_gc():
+    return {"freed_bytes": media_store.gc()}
+
+metrics.gauge("gvva_tasks", "Tasks in the in-memory task store by status", ("status",), callback=lambda: {
+    (status,): sum(1 for t in list(task_store.values()) if t.get("status") == status)
+    for status in {t.get("status") for t in list(task_store.values())}
+})
+metrics.gauge("gvva_pending_approvals", "Previewed tasks waiting for approval", callback=lambda: {(): len(pending_renders)})
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Prometheus text exposition: stage histograms, cache/fallback counters and queue gauges."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.on_event("startup")
+async def install_profiling_executor():
+    # Lets profiled tasks follow their asyncio.to_thread calls into the default executor
+    asyncio.get_running_loop().set_default_executor(ProfilingExecutor())
+
+@app.get("/api/profiles/{profile_id}")
+def get_profile(profile_id: str, format: str = "json"):
+    """
+    A task's sampling profile. format=folded returns collapsed stacks for flamegraph.pl or
+    speedscope; the default is the timing summary plus the hottest frames.
+    """
+    try:
+        meta = task_profiler.load(profile_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if meta is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "folded":
+        return FileResponse(task_profiler.folded(profile_id), media_type="text/plain; charset=utf-8",
+                            filename=f"{profile_id}.folded")
+    return dict(meta, top=task_profiler.top(profile_id))
+
 @app.get("/api/task-status/{task_id}", response_model=TaskStatusResponse)
 def get_task_status(task_id: str):
     task = task_store.get(task_id)
@@ -89,16 +164,46 @@ def get_task_status(task_id: str):
         raise HTTPException(status_code=404, detail="Task not found")
     return task
 
-def update_task(task_id: str, status: str, progress: int, message: str, result_url: str = None):
+# Fields that survive later status updates once set
+STICKY_TASK_FIELDS = ("preview_url", "speech", "stages", "profile_url")
+
+# Tasks whose preview waits for approval: {task_id: render context for _render_final}
+pending_renders: Dict[str, dict] = {}
+# Unanswered previews are rejected after this long, releasing their intermediates
+PREVIEW_APPROVAL_TTL = float(os.getenv("PREVIEW_APPROVAL_TTL", "86400"))
+
+def update_task(task_id: str, status: str, progress: int, message: str, result_url: str = None, **extra):
+    previous = task_store.get(task_id, {})
+    sticky = {k: previous[k] for k in STICKY_TASK_FIELDS if previous.get(k) is not None}
     task_store[task_id] = {
         "task_id": task_id,
         "status": status,
         "progress": progress,
         "message": message,
-        "result_url": result_url
+        "result_url": result_url,
+        **sticky,
+        **extra
     }
 
-async def _process_video_task(task_id: str, file_path: str, target_lang: str, openai_key: str = None, eleven_key: str = None):
+def _stages(task_id: str) -> dict:
+    """The task's per-stage wall times in seconds; sticky, so the same dict follows every update."""
+    task = task_store.setdefault(task_id, {"task_id": task_id})
+    if task.get("stages") is None:
+        task["stages"] = {}
+    return task["stages"]
+
+def _task_runner(fn, profile: bool):
+    """fn, or fn run inside a sampling-profiler session keyed by its task id (the first argument)."""
+    if not profile:
+        return fn
+    async def run(task_id, *args):
+        with task_profiler.session(task_id, label=fn.__name__):
+            await fn(task_id, *args)
+    return run
+
+async def _process_video_task(task_id: str, file_path: str, target_lang: str, openai_key: str = None, eleven_key: str = None, formats: list = None,
+                              hls: bool = False, base_url: str = None, preview: str = "off",
+                              subtitle_mode: str = "off", subtitle_lang: str = "target"):
     """
     Background Task: Encapsulates the entire GVVA pipeline.
     """
@@ -106,99 +211,380 @@ async def _process_video_task(task_id: str, file_path: str, target_lang: str, op
         update_task(task_id, "processing", 0, "Starting pipeline...")
         print(f"[{task_id}] === Starting GVVA Pipeline ({target_lang}) ===")
         
-        # 1. Video Analysis & Audio Extraction
-        update_task(task_id, "processing", 10, "Extracting audio...")
-        audio_path = os.path.join(UPLOAD_DIR, f"{task_id}.wav")
-        ffmpeg_handler.extract_audio(file_path, audio_path)
-        print(f"[{task_id}] [1/6] Audio extracted: {audio_path}")
-
-        # 2. STT (Whisper) -> Translate (GPT) -> TTS (ElevenLabs)
-        # Pass keys dynamically
-        update_task(task_id, "processing", 20, "Transcribing audio (Whisper)...")
-        transcript = ai_handler.transcribe(audio_path, api_key=openai_key)
+        # 1. Audio Extraction -> 2. STT (Whisper), fused:
+        # ffmpeg's PCM stdout is piped straight into the silence-aware chunker/uploader.
+        # The WAV is only written when AUDIO_CACHE_POLICY=wav asks for it.
+        update_task(task_id, "processing", 10, "Extracting & transcribing audio (Whisper)...")
+        audio_path = os.path.join(UPLOAD_DIR, f"{task_id}.wav") if AUDIO_CACHE_POLICY == "wav" else None
+        if audio_path:
+            artifacts.register(task_id, audio_path, "cache")
+        with timed("extract_stt", _stages(task_id)):
+            transcript = await asyncio.to_thread(
+                chunked_transcriber.transcribe_stream,
+                ffmpeg_handler.stream_audio(file_path),
+                api_key=openai_key,
+                cache_wav_path=audio_path
+            )
+        artifacts.consume(task_id, "stt")
         original_text = transcript.text
+        print(f"[{task_id}] [1/6] Audio streamed ({transcript.duration:.1f}s, cached: {audio_path})")
         print(f"[{task_id}] [2/6] STT Complete: {original_text[:50]}...")
+
+        # 3. Translate (GPT) -> TTS (ElevenLabs), keys passed dynamically
         
         update_task(task_id, "processing", 40, "Translating text (GPT-4o)...")
-        translated_text = ai_handler.translate(original_text, target_lang, api_key=openai_key)
+        with timed("translate", _stages(task_id)):
+            translated_text = await ai_handler.atranslate(original_text, target_lang, api_key=openai_key)
         print(f"[{task_id}] [3/6] Translation Complete (Trendy Vibe): {translated_text[:50]}...")
         
         update_task(task_id, "processing", 60, "Generating voice (ElevenLabs)...")
-        tts_audio_data = ai_handler.generate_voice(translated_text, api_key=eleven_key)
-        tts_audio_path = os.path.join(UPLOAD_DIR, f"{task_id}_tts.mp3")
+        with timed("tts", _stages(task_id)):
+            tts_audio_data = await ai_handler.agenerate_voice(translated_text, api_key=eleven_key)
+        # Intermediates may live on tmpfs, unless remote render workers need to read them
+        local_render = render_queue.backend == "inline" or RENDER_LOCAL_WORKERS > 0
+        tts_audio_path = artifacts.intermediate_path(f"{task_id}_tts.mp3", len(tts_audio_data), allow_tmp=local_render)
         with open(tts_audio_path, "wb") as f:
             f.write(tts_audio_data)
+        artifacts.register(task_id, tts_audio_path, "intermediate", consumers=["sync"])
         print(f"[{task_id}] [4/6] TTS Audio Generated: {tts_audio_path}")
+        with timed("tts_analysis", _stages(task_id)):
+            speech = await asyncio.to_thread(_trim_tts, task_id, tts_audio_path, translated_text, file_path)
+        if speech:
+            update_task(task_id, "processing", 62, "Voice analysed", speech=speech)
         
-        # 3. Audio-Video Sync (Module B)
-        update_task(task_id, "processing", 80, "Synchronizing audio and video...")
-        synced_video_path = os.path.join(UPLOAD_DIR, f"{task_id}_synced.mp4")
-        sync_cmd = sync_logic.generate_sync_command(
-            video_path=file_path,
-            audio_path=tts_audio_path,
-            output_path=synced_video_path,
-            ffmpeg_path=ffmpeg_handler.ffmpeg_path
-        )
-        if sync_cmd:
-            import subprocess
-            subprocess.run(sync_cmd, check=True)
-            print(f"[{task_id}] [5/6] AV Sync Completed")
-        else:
-            print(f"[{task_id}] [5/6] AV Sync Skipped (No cmd generated)")
-            synced_video_path = file_path # Fallback
+        ctx = {
+            "file_path": file_path,
+            "tts_audio_path": tts_audio_path,
+            "duration": transcript.duration,
+            "formats": formats or ["source"],
+            "hls": hls,
+            "base_url": base_url,
+            "local_render": local_render,
+            # Same grain/grade parameters for the preview and the final render
+            "filter_data": filters.get_filter_chain(),
+            "subtitle_mode": subtitle_mode,
+            "subtitle_lang": subtitle_lang,
+            "captions": {"text": translated_text, "words": transcript.words},
+        }
+        if preview != "off":
+            with timed("preview", _stages(task_id)):
+                await _render_preview(task_id, ctx)
+            if preview == "approval":
+                pending_renders[task_id] = ctx
+                asyncio.get_running_loop().call_later(PREVIEW_APPROVAL_TTL, _expire_pending_render, task_id, ctx)
+                update_task(task_id, "awaiting_approval", 70, "Preview ready. Approve to start the full render.")
+                print(f"[{task_id}] Waiting for approval before the full render")
+                return
+        await _render_final(task_id, ctx)
 
-        # 4. Anti-Fingerprinting (Module C) & Resizing (Module D) - Merged for efficiency
-        update_task(task_id, "processing", 90, "Applying anti-fingerprinting filters...")
-        final_output_path = os.path.join(OUTPUT_DIR, f"gvva_final_{task_id}.mp4")
-        
-        filter_data = filters.get_filter_chain()
-        
+    except Exception as e:
+        _fail_task(task_id, e)
+
+def _trim_tts(task_id: str, tts_audio_path: str, text: str, video_path: str):
+    """Trims TTS silence that would push sync off the plain-mux path; the analysis is best-effort."""
+    try:
+        t_video = sync_logic.get_duration(video_path, ffmpeg_handler.ffmpeg_path)
+        report = analyze_and_trim(tts_audio_path, text, t_video=t_video)
+    except Exception as e:
+        print(f"[{task_id}] TTS analysis skipped: {e}")
+        return None
+    print(f"[{task_id}] TTS {report['duration_before']:.2f}s -> {report['duration_after']:.2f}s "
+          f"({report['rate']} {report['rate_unit']}/s, {report['rate_to_fit_video']} needed to fit the video), "
+          f"sync: {report.get('sync_before')} -> {report.get('sync_after')}")
+    return report
+
+def _fail_task(task_id: str, e: Exception):
+    # Keep the progress of the stage that failed instead of resetting to 0
+    last = task_store.get(task_id, {})
+    print(f"[{task_id}] CRITICAL ERROR during '{last.get('message')}': {str(e)}")
+    update_task(task_id, "failed", last.get("progress", 0), f"Error: {str(e)}")
+    artifacts.finish(task_id, success=False)
+
+async def _render_preview(task_id: str, ctx: dict):
+    """Low-res proxy (PREVIEW_HEIGHT, ultrafast) straight from the upload + TTS, published as preview_url."""
+    update_task(task_id, "processing", 65, "Rendering preview...")
+    preview_name = f"gvva_preview_{task_id}.mp4"
+    preview_path = os.path.join(OUTPUT_DIR, preview_name)
+    artifacts.register(task_id, preview_path, "output")
+    preview_cmd = await asyncio.to_thread(
+        preview_command, ctx["file_path"], ctx["tts_audio_path"], preview_path,
+        ctx["formats"][0], ctx["filter_data"], ffmpeg_handler.ffmpeg_path
+    )
+    await render_queue.run(
+        task_id, preview_cmd,
+        inputs={"video": ctx["file_path"], "audio": ctx["tts_audio_path"]},
+        outputs={"preview": preview_path},
+        duration=ctx["duration"], label="preview"
+    )
+    update_task(task_id, "processing", 70, "Preview ready",
+                preview_url=delivery.public_url(f"outputs/{preview_name}", ctx["base_url"]))
+    print(f"[{task_id}] Preview rendered: {preview_path}")
+
+def _subtitle_cues(ctx: dict):
+    """Caption cues on the output timeline: translated text over the TTS track, or the source words."""
+    t_video = sync_logic.get_duration(ctx["file_path"], ffmpeg_handler.ffmpeg_path)
+    t_audio = sync_logic.get_duration(ctx["tts_audio_path"], ffmpeg_handler.ffmpeg_path)
+    if ctx["subtitle_lang"] == "source":
+        # Only the speed-up branch of the sync step moves video timestamps
+        mode, value = sync_logic.plan(t_video, t_audio)
+        return subtitles.cues_from_words(ctx["captions"]["words"], time_scale=value if mode == "speed" else 1.0)
+    return subtitles.cues_from_text(ctx["captions"]["text"], 0.0, t_audio)
+
+def _burn_subtitles(task_id: str, labels: dict, cues: list, source_path: str, chunked: bool, allow_tmp: bool):
+    """ASS per output geometry, burned in at the end of each variant's chain. Returns (fragment, labels)."""
+    parts, burned = [], {}
+    for i, (fmt, label) in enumerate(labels.items()):
+        spec = VARIANTS[fmt]
+        width, height = ((spec["width"], spec["height"]) if spec["width"]
+                         else subtitles.probe_size(source_path, ffmpeg_handler.ffmpeg_path))
+        ass_path = artifacts.intermediate_path(f"{task_id}_{fmt.replace(':', 'x')}.ass", allow_tmp=allow_tmp)
+        subtitles.write_ass(cues, ass_path, width, height)
+        artifacts.register(task_id, ass_path, "intermediate", consumers=["final"])
+        burned[fmt] = f"sub_{i}"
+        parts.append(subtitles.burn_chain(label, burned[fmt], ass_path, chunked=chunked))
+    return ";".join(parts), burned
+
+async def _render_final(task_id: str, ctx: dict):
+    """Full-quality half of the pipeline: AV sync, then the fingerprint/variant render."""
+    file_path, tts_audio_path, duration = ctx["file_path"], ctx["tts_audio_path"], ctx["duration"]
+    formats, hls, base_url = ctx["formats"], ctx["hls"], ctx["base_url"]
+    local_render, filter_data = ctx["local_render"], ctx["filter_data"]
+    subtitle_mode = ctx.get("subtitle_mode", "off")
+    stages = _stages(task_id)
+
+    # Cues need the TTS duration, and the TTS file is gone once sync has consumed it
+    cues = None
+    if subtitle_mode != "off":
+        with timed("subtitles", stages):
+            cues = await asyncio.to_thread(_subtitle_cues, ctx)
+
+    # 3. Audio-Video Sync (Module B)
+    update_task(task_id, "processing", 80, "Synchronizing audio and video...")
+    source_size = os.path.getsize(file_path)
+    await asyncio.to_thread(artifacts.ensure_space, source_size * 2)
+    synced_video_path = artifacts.intermediate_path(f"{task_id}_synced.mp4", source_size * 2, allow_tmp=local_render)
+    artifacts.register(task_id, synced_video_path, "intermediate", consumers=["final"])
+    sync_cmd = sync_logic.generate_sync_command(
+        video_path=file_path,
+        audio_path=tts_audio_path,
+        output_path=synced_video_path,
+        ffmpeg_path=ffmpeg_handler.ffmpeg_path
+    )
+    if sync_cmd:
+        with timed("sync", stages):
+            await render_queue.run(
+                task_id, sync_cmd,
+                inputs={"video": file_path, "audio": tts_audio_path},
+                outputs={"synced": synced_video_path},
+                duration=duration, label="sync",
+                on_progress=lambda f: update_task(task_id, "processing", 80 + int(f * 10), "Synchronizing audio and video...")
+            )
+        print(f"[{task_id}] [5/6] AV Sync Completed")
+    else:
+        print(f"[{task_id}] [5/6] AV Sync Skipped (No cmd generated)")
+        synced_video_path = file_path # Fallback
+    artifacts.consume(task_id, "sync")
+
+    # 4. Anti-Fingerprinting (Module C) & Resizing (Module D) - Merged for efficiency
+    update_task(task_id, "processing", 90, "Applying anti-fingerprinting filters...")
+    # First format keeps the historical file name; extra variants get a suffix
+    output_names = {
+        fmt: f"gvva_final_{task_id}.mp4" if i == 0 else f"gvva_final_{task_id}_{fmt.replace(':', 'x')}.mp4"
+        for i, fmt in enumerate(formats)
+    }
+    final_output_path = os.path.join(OUTPUT_DIR, output_names[formats[0]])
+    
+    # Noise/grade once, then split the filtered stream into every requested format (one decode)
+    source_fps = await asyncio.to_thread(resizer.probe_fps, synced_video_path, ffmpeg_handler.ffmpeg_path)
+    variant_graph, variant_labels = resizer.split_graph(formats, in_label="outv", fps=source_fps)
+    
+    final_graph = f"{filter_data['noise_filter_complex']};{variant_graph}"
+    await asyncio.to_thread(artifacts.ensure_space, os.path.getsize(synced_video_path) * len(formats))
+    # Poster + scrubbing sprites of the primary output, tapped off the same decode when possible
+    thumbs_dir = derivatives_dir_for(final_output_path)
+    render_duration = await asyncio.to_thread(sync_logic.get_duration, synced_video_path, ffmpeg_handler.ffmpeg_path)
+    thumb_plan = video_derivatives.plan(render_duration or duration)
+    artifacts.register(task_id, thumbs_dir, "output")
+    for fmt in formats:
+        artifacts.register(task_id, os.path.join(OUTPUT_DIR, output_names[fmt]), "output")
+        if hls:
+            artifacts.register(task_id, delivery.hls_dir_for(os.path.join(OUTPUT_DIR, output_names[fmt])), "output")
+    # Sidecars (every subtitle mode): WebVTT for web players, ASS of the primary format for editors
+    subtitle_stem = os.path.splitext(final_output_path)[0]
+    if cues is not None:
+        primary = VARIANTS[formats[0]]
+        size = ((primary["width"], primary["height"]) if primary["width"]
+                else await asyncio.to_thread(subtitles.probe_size, synced_video_path, ffmpeg_handler.ffmpeg_path))
+        subtitles.write_vtt(cues, subtitle_stem + ".vtt")
+        subtitles.write_ass(cues, subtitle_stem + ".ass", *size)
+        artifacts.register(task_id, subtitle_stem + ".vtt", "output")
+        artifacts.register(task_id, subtitle_stem + ".ass", "output")
+    burn = subtitle_mode == "burn"
+
+    chunked = render_queue.backend == "inline" and await asyncio.to_thread(chunked_encoder.should_chunk, synced_video_path)
+    if chunked:
+        # Long input: keyframe-aligned segments encoded in parallel, audio muxed once at the end
+        if burn:
+            burn_graph, variant_labels = await asyncio.to_thread(
+                _burn_subtitles, task_id, variant_labels, cues, synced_video_path, True, local_render)
+            final_graph = f"{final_graph};{burn_graph}"
+        with timed("render", stages):
+            await asyncio.to_thread(chunked_encoder.render, synced_video_path, final_graph, {
+                fmt: (resizer.output_args(fmt, variant_labels[fmt], audio_map=None, profile={"c:a": None, "movflags": None}),
+                      os.path.join(OUTPUT_DIR, output_names[fmt]))
+                for fmt in formats
+            })
+        if hls:
+            with timed("hls", stages):
+                for fmt in formats:
+                    await asyncio.to_thread(delivery.package_hls, os.path.join(OUTPUT_DIR, output_names[fmt]),
+                                            ffmpeg_handler.ffmpeg_path)
+        # Segments are encoded in separate processes, so thumbnails need their own (small) pass
+        with timed("thumbnails", stages):
+            await asyncio.to_thread(subprocess.run, video_derivatives.extract_command(
+                final_output_path, thumbs_dir, thumb_plan, ffmpeg_handler.ffmpeg_path), check=True)
+    else:
+        # The tee muxer writes HLS next to the MP4 by API-host path, which only shared-storage workers can reach
+        host_paths = render_queue.shared_storage_available()
+        # Burned subtitles read the ASS file (and fonts dir) by path from inside the filter graph;
+        # with no worker able to reach them the render falls back to the API host
+        render_here = burn and not host_paths
+        host_paths = host_paths or render_here
+        tee_hls = hls and host_paths
+        # Same for the sprite pattern; the poster is a declared output and is always tapped
+        thumb_kinds = ("poster", "sprite") if host_paths else ("poster",)
+        thumb_graph, primary_label, thumb_labels = video_derivatives.graph(variant_labels[formats[0]], thumb_plan,
+                                                                           kinds=thumb_kinds)
+        encode_labels = dict(variant_labels, **{formats[0]: primary_label})
+        render_graph = f"{final_graph};{thumb_graph}"
+        if burn:
+            # Burned after the thumbnail tap: posters and sprites stay caption-free
+            burn_graph, encode_labels = await asyncio.to_thread(
+                _burn_subtitles, task_id, encode_labels, cues, synced_video_path, False, local_render or render_here)
+            render_graph = f"{render_graph};{burn_graph}"
         fp_cmd = [
             ffmpeg_handler.ffmpeg_path, '-y',
             '-i', synced_video_path,
-            '-filter_complex', filter_data['noise_filter_complex'],
-            '-map', '[outv]', # output from filters.py
-            '-map', '0:a',    # keep audio from synced video
-            '-c:v', 'libx264',
-            '-preset', 'fast',
-            '-c:a', 'copy',
-            final_output_path
+            '-filter_complex', render_graph,
         ]
-        
-        subprocess.run(fp_cmd, check=True)
-        print(f"[{task_id}] [6/6] Final Render & Fingerprint Evasion: {final_output_path}")
-        print(f"[{task_id}] === Pipeline Success ===")
-        
-        # Generate result URL
-        result_url = f"http://localhost:8000/outputs/gvva_final_{task_id}.mp4"
-        update_task(task_id, "completed", 100, "Processing complete!", result_url)
+        for fmt in formats:
+            # keep audio from synced video; with HLS the tee muxer sets the MP4 flags itself
+            fp_cmd.extend(resizer.output_args(fmt, encode_labels[fmt], audio_map='0:a',
+                                              profile={"movflags": None} if tee_hls else None))
+            fp_cmd.extend(delivery.output_target(os.path.join(OUTPUT_DIR, output_names[fmt]), hls=tee_hls))
+        fp_cmd.extend(video_derivatives.output_args(thumb_labels, thumbs_dir))
 
+        with timed("render", stages):
+            await render_queue.run(
+                task_id, fp_cmd,
+                inputs={"synced": synced_video_path},
+                outputs={
+                    **{fmt.replace(':', 'x'): os.path.join(OUTPUT_DIR, output_names[fmt]) for fmt in formats},
+                    "poster": os.path.join(thumbs_dir, "poster.jpg"),
+                },
+                duration=duration, label="final",
+                on_progress=lambda f: update_task(task_id, "processing", 90 + int(f * 9), "Applying anti-fingerprinting filters..."),
+                shared_only=host_paths, local=render_here
+            )
+        if not host_paths:
+            with timed("thumbnails", stages):
+                await asyncio.to_thread(subprocess.run, video_derivatives.extract_command(
+                    final_output_path, thumbs_dir, thumb_plan, ffmpeg_handler.ffmpeg_path, kinds=("sprite",)), check=True)
+        if hls and not tee_hls:
+            # Remote workers only return the MP4s: HLS is a stream-copy remux on the API host
+            with timed("hls", stages):
+                for fmt in formats:
+                    await asyncio.to_thread(delivery.package_hls, os.path.join(OUTPUT_DIR, output_names[fmt]),
+                                            ffmpeg_handler.ffmpeg_path)
+    if subtitle_mode == "soft":
+        # mov_text track added by remuxing: every other stream is copied, nothing re-encoded
+        with timed("subtitles", stages):
+            for fmt in formats:
+                out_path = os.path.join(OUTPUT_DIR, output_names[fmt])
+                muxed_path = out_path + ".subs.mp4"
+                await asyncio.to_thread(subprocess.run, subtitles.mux_command(
+                    out_path, subtitle_stem + ".vtt", muxed_path, ffmpeg_handler.ffmpeg_path), check=True)
+                os.replace(muxed_path, out_path)
+    video_derivatives.write_vtt(thumbs_dir, thumb_plan, render_duration or duration)
+    artifacts.consume(task_id, "final")
+    artifacts.finish(task_id, success=True)
+    print(f"[{task_id}] [6/6] Final Render & Fingerprint Evasion: {final_output_path} ({', '.join(formats)})")
+    print(f"[{task_id}] === Pipeline Success === stages: "
+          + ", ".join(f"{name} {seconds:.1f}s" for name, seconds in stages.items()))
+    
+    # Generate result URL
+    result_url = delivery.public_url(f"outputs/{output_names[formats[0]]}", base_url)
+    variants = {fmt: delivery.public_url(f"outputs/{name}", base_url) for fmt, name in output_names.items()}
+    streams = {
+        fmt: delivery.public_url(f"outputs/{os.path.basename(delivery.hls_dir_for(name))}/index.m3u8", base_url)
+        for fmt, name in output_names.items()
+    } if hls else None
+    thumbs_rel = f"outputs/{os.path.basename(thumbs_dir)}"
+    thumbnails = {
+        "poster": delivery.public_url(f"{thumbs_rel}/poster.jpg", base_url),
+        "sprites": delivery.public_url(f"{thumbs_rel}/sprites.vtt", base_url),
+    }
+    subtitle_urls = {
+        "vtt": delivery.public_url(f"outputs/{os.path.basename(subtitle_stem)}.vtt", base_url),
+        "ass": delivery.public_url(f"outputs/{os.path.basename(subtitle_stem)}.ass", base_url),
+    } if cues is not None else None
+    update_task(task_id, "completed", 100, "Processing complete!", result_url,
+                variants=variants, streams=streams, thumbnails=thumbnails, subtitles=subtitle_urls)
+
+async def _run_final_render(task_id: str, ctx: dict):
+    try:
+        await _render_final(task_id, ctx)
     except Exception as e:
-        print(f"[{task_id}] CRITICAL ERROR: {str(e)}")
-        update_task(task_id, "failed", 0, f"Error: {str(e)}")
+        _fail_task(task_id, e)
 
 @app.post("/api/process-video", response_model=ProcessResponse)
 async def process_video(
+    request: Request,
     background_tasks: BackgroundTasks,
     file: UploadFile = File(...), 
     target_lang: str = Form("ja"),
+    formats: str = Form("source"),
+    hls: Optional[bool] = Form(None),
+    preview: Optional[str] = Form(None),
+    subtitles: Optional[str] = Form(None),
+    subtitle_lang: str = Form("target"),
+    profile: bool = Form(False),
     openai_key: Optional[str] = Header(None, alias="x-openai-key"),
     eleven_key: Optional[str] = Header(None, alias="x-eleven-key")
 ):
+    # e.g. "16:9,9:16,1:1" -> all rendered from a single decode of the final render
+    format_list = [f.strip() for f in formats.split(",") if f.strip()]
+    unknown = [f for f in format_list if f not in VARIANTS]
+    if unknown or not format_list:
+        raise HTTPException(status_code=400, detail=f"Unknown formats {unknown}. Choose from {list(VARIANTS)}")
+    preview = preview or PREVIEW_MODE
+    if preview not in PREVIEW_MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown preview mode '{preview}'. Choose from {list(PREVIEW_MODES)}")
+    subtitles = subtitles or SUBTITLE_MODE
+    if subtitles not in SUBTITLE_MODES or subtitle_lang not in SUBTITLE_LANGS:
+        raise HTTPException(status_code=400, detail=f"Subtitles must be one of {list(SUBTITLE_MODES)}, "
+                                                    f"subtitle_lang one of {list(SUBTITLE_LANGS)}")
+
     try:
         task_id = str(uuid.uuid4())
         file_ext = os.path.splitext(file.filename)[1]
         file_path = os.path.join(UPLOAD_DIR, f"{task_id}{file_ext}")
         
-        # Save uploaded file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Save uploaded file (content-addressed: re-uploads of the same video share one blob)
+        # Owned by the upload path from the start, so no gc can take the blob before it is linked
+        digest = media_store.put_stream(file.file, ext=file_ext.lower(), owner=os.path.abspath(file_path))
+        media_store.materialize(digest, file_path)
+        # The upload is read by STT and sync (and by the final render when sync is skipped)
+        artifacts.register(task_id, file_path, "upload", consumers=["stt", "sync", "final"])
             
         # Initialize task status
-        update_task(task_id, "queued", 0, "Queued for processing...")
+        update_task(task_id, "queued", 0, "Queued for processing...",
+                    profile_url=f"/api/profiles/{task_id}" if profile else None)
 
         # Start background processing with injected keys
-        background_tasks.add_task(_process_video_task, task_id, file_path, target_lang, openai_key, eleven_key)
+        background_tasks.add_task(_task_runner(_process_video_task, profile), task_id, file_path, target_lang, openai_key, eleven_key, format_list,
+                                  delivery.HLS_PACKAGING if hls is None else hls, str(request.base_url), preview,
+                                  subtitles, subtitle_lang)
         
         return {
             "task_id": task_id,
@@ -208,11 +594,53 @@ async def process_video(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/tasks/{task_id}/approve")
+async def approve_task(task_id: str, background_tasks: BackgroundTasks):
+    """Starts the full-quality render of a task whose preview was approved."""
+    ctx = pending_renders.pop(task_id, None)
+    if ctx is None:
+        raise HTTPException(status_code=404, detail="No preview awaiting approval for this task")
+    update_task(task_id, "queued", 70, "Approved. Queued for full render...")
+    # A task profiled up to its preview keeps profiling through the final render (same profile id)
+    profiled = bool(task_store.get(task_id, {}).get("profile_url"))
+    background_tasks.add_task(_task_runner(_run_final_render, profiled), task_id, ctx)
+    return {"task_id": task_id, "status": "queued"}
+
+def _reject_pending_render(task_id: str, message: str):
+    artifacts.finish(task_id, success=True)
+    update_task(task_id, "rejected", 70, message)
+
+def _expire_pending_render(task_id: str, ctx: dict):
+    # Only the wait that scheduled this timer: the task may since have been approved/rejected
+    if pending_renders.get(task_id) is not ctx:
+        return
+    del pending_renders[task_id]
+    print(f"[{task_id}] Preview not approved within {PREVIEW_APPROVAL_TTL:.0f}s, rejecting")
+    _reject_pending_render(task_id, "Preview approval expired. Full render skipped.")
+
+@app.post("/api/tasks/{task_id}/reject")
+async def reject_task(task_id: str):
+    """Drops a previewed task without rendering it; the preview itself stays available."""
+    if pending_renders.pop(task_id, None) is None:
+        raise HTTPException(status_code=404, detail="No preview awaiting approval for this task")
+    _reject_pending_render(task_id, "Preview rejected. Full render skipped.")
+    return {"task_id": task_id, "status": "rejected"}
+
 import subprocess
-import asyncio
 
 # Whisk Generation Lock (Ensure 1 browser instance at a time)
 whisk_lock = asyncio.Lock()
+WHISK_WAITING = metrics.gauge("gvva_whisk_queue_waiting", "Image requests waiting for the Whisk lock")
+
+@asynccontextmanager
+async def _whisk_slot():
+    """whisk_lock, with the wait for it counted in gvva_whisk_queue_waiting and timed as whisk_queue."""
+    with WHISK_WAITING.track_inprogress(), timed("whisk_queue"):
+        await whisk_lock.acquire()
+    try:
+        yield
+    finally:
+        whisk_lock.release()
 
 # ... imports ...
 
@@ -283,18 +711,57 @@ class GenerateRequest(BaseModel):
     subject_path: Optional[str] = None
     style_path: Optional[str] = None
     composition_path: Optional[str] = None
+    profile: bool = False  # sample this request's stacks; the result gets profile_id/profile_url
+
+async def _with_thumbnail(result: dict, image_path: str):
+    """Adds thumbnail_url (a small WebP made in the derivatives process pool) to a generation result."""
+    try:
+        thumb_path = await asyncio.wait_for(asyncio.wrap_future(image_derivatives.submit(image_path)), timeout=15)
+        result["thumbnail_url"] = f"{os.path.dirname(result['image_url']).rstrip('/')}/{os.path.basename(thumb_path)}"
+    except Exception as e:
+        print(f"[Derivatives] Thumbnail failed for {image_path}: {e}")
+    return result
+
+@app.post("/api/derivatives/images/backfill")
+def backfill_image_thumbnails(directory: str):
+    """Queues WebP thumbnails for every image in directory that doesn't have one yet."""
+    if not os.path.isdir(directory):
+        raise HTTPException(status_code=404, detail="Directory not found")
+    futures = image_derivatives.backfill(directory)
+    return {"queued": len(futures)}
+
+@app.on_event("shutdown")
+async def stop_derivative_workers():
+    image_derivatives.shutdown()
 
 @app.post("/api/generate-image-queued")
 async def generate_image_queued(req: GenerateRequest):
+    if not req.profile:
+        return await _generate_image(req)
+    profile_id = f"image_{uuid.uuid4().hex[:12]}"
+    with task_profiler.session(profile_id, label="generate_image"):
+        result = await _generate_image(req)
+    return dict(result, profile_id=profile_id, profile_url=f"/api/profiles/{profile_id}")
+
+async def _generate_image(req: GenerateRequest):
+    """Whisk generation, then the thumbnail once the Whisk slot is free for the next request."""
+    thumbnail = {}
+    result = await _generate_image_in_slot(req, thumbnail)
+    if thumbnail:
+        result = await _with_thumbnail(result, thumbnail["image_path"])
+    return result
+
+async def _generate_image_in_slot(req: GenerateRequest, thumbnail: dict):
     """
     Serialized Whisk Generation with Auto Token Refresh.
     - API mode: Fast, uses cached credentials
     - If credentials expired: Auto-runs DOM to refresh, then retries API
+    On success, thumbnail["image_path"] names the file to thumbnail after the slot is released.
     """
     if whisk_lock.locked():
         print(f"[Whisk Queue] Warning: System busy. Waiting for lock... (Prompt: {req.prompt[:20]}...)")
     
-    async with whisk_lock:
+    async with _whisk_slot():
         print(f"[Whisk Queue] Processing ({req.mode}): {req.prompt[:50]}...")
         
         run_dom = False
@@ -332,7 +799,8 @@ async def generate_image_queued(req: GenerateRequest):
         # 1. API Mode Execution
         if req.mode == "api":
             try:
-                result = run_api_script()
+                with timed("whisk_api"):
+                    result = run_api_script()
                 
                 # Check for success
                 try:
@@ -341,6 +809,7 @@ async def generate_image_queued(req: GenerateRequest):
                         # image_path is like "c:\autokim\public\uploads\whisk_api_xxx.jpg"
                         # We need to return "/uploads/filename.jpg"
                         img_filename = os.path.basename(data['image_path'])
+                        thumbnail["image_path"] = data['image_path']
                         return {
                             "success": True, 
                             "image_url": f"/uploads/{img_filename}",
@@ -352,6 +821,7 @@ async def generate_image_queued(req: GenerateRequest):
                     err_msg = str(data.get("error", ""))
                     if "CREDENTIALS_EXPIRED" in err_msg or "LOGIN_REQUIRED" in err_msg:
                         print(f"[Whisk Queue] Token Expired. Running DOM to auto-refresh credentials...")
+                        FALLBACKS.inc(component="whisk", reason="credentials_expired")
                         run_dom = True
                         retry_api_after_refresh = True  # Will retry API after DOM succeeds
                     else:
@@ -360,11 +830,13 @@ async def generate_image_queued(req: GenerateRequest):
                 except:
                      if result.returncode != 0:
                          print(f"[Whisk Queue] API Crash (RC: {result.returncode}). Falling back to DOM...")
+                         FALLBACKS.inc(component="whisk", reason="api_crash")
                          run_dom = True
                          retry_api_after_refresh = True
 
             except Exception as e:
                 print(f"[Whisk Queue] API Exception: {e}. Falling back to DOM...")
+                FALLBACKS.inc(component="whisk", reason="api_exception")
                 run_dom = True
                 retry_api_after_refresh = True
 
@@ -403,7 +875,8 @@ async def generate_image_queued(req: GenerateRequest):
                 env = os.environ.copy()
                 env["PYTHONUNBUFFERED"] = "1"
                 env["PYTHONIOENCODING"] = "utf-8"
-                result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='replace', env=env)
+                with timed("whisk_dom"):
+                    result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='replace', env=env)
                 
                 stdout = result.stdout
                 stderr = result.stderr
@@ -454,6 +927,10 @@ async def generate_image_queued(req: GenerateRequest):
                         print(f"[Whisk Queue] JSON parse error: {parse_err}")
                 
                 # DOM succeeded and we should retry API (for token refresh scenarios)
+                if dom_success:
+                    # files[0] is a web path; the file itself lives in the requested output dir
+                    thumbnail["image_path"] = os.path.join(req.output_dir, os.path.basename(files[0]))
+
                 if dom_success and retry_api_after_refresh:
                     print(f"[Whisk Queue] DOM succeeded! New API token should be captured. Retrying API for NEXT requests...")
                     # Return DOM result for current request (already generated)
@@ -470,6 +947,390 @@ async def generate_image_queued(req: GenerateRequest):
                 print(f"[Whisk Queue] DOM Exception: {e}")
                 return {"success": False, "error": str(e), "mode_used": "DOM"}
 
+def _mark_output_expired(task_id, path):
+    task = task_store.get(task_id)
+    if task is not None:
+        task["expired"] = True
+
+artifacts.on_evict = _mark_output_expired
+# Node cache blobs live in the media store, which counts toward the artifact quota
+artifacts.cache_evictors.append(storyboard_executor.evict_cache)
+
+@app.on_event("startup")
+async def prepare_artifacts():
+    ensure_work_dirs()
+    artifacts.adopt_outputs()
+    await asyncio.to_thread(artifacts.sweep_orphans)
+    await asyncio.to_thread(storyboard_executor.prune_cache)
+    # Releases collect blobs as they happen; this catches refs left by files deleted while we were down
+    await asyncio.to_thread(media_store.gc)
+
+@app.middleware("http")
+async def track_output_access(request: Request, call_next):
+    # Served outputs count as "used" for LRU eviction
+    if request.url.path.startswith("/outputs/"):
+        # First path component: the MP4 itself or its HLS directory
+        top = request.url.path[len("/outputs/"):].split("/")[0]
+        artifacts.touch(os.path.join(OUTPUT_DIR, top))
+    return await call_next(request)
+
+@app.api_route("/outputs/{path:path}", methods=["GET", "HEAD"])
+def serve_output(path: str, request: Request):
+    # Range/ETag/immutable-cache aware replacement for the old StaticFiles mount
+    return delivery.file_response(request, OUTPUT_DIR, path)
+
+@app.get("/api/artifacts/usage")
+def get_artifact_usage():
+    return artifacts.usage()
+
+@app.post("/api/artifacts/sweep")
+def sweep_artifacts(max_age_hours: Optional[float] = None):
+    freed = artifacts.sweep_orphans(max_age_hours) if max_age_hours is not None else artifacts.sweep_orphans()
+    return {"freed_bytes": freed}
+
+# --- Render worker protocol (see services/render_jobs.py, services/render_worker.py) ---
+
+class WorkerRegistration(BaseModel):
+    host: str = ""
+    slots: int = 1
+    shared_storage: bool = True
+
+class WorkerReport(BaseModel):
+    worker_id: str
+    out_time_s: float = 0.0
+    error: Optional[str] = None
+
+def _check_worker_token(token):
+    if RENDER_WORKER_TOKEN and token != RENDER_WORKER_TOKEN:
+        raise HTTPException(status_code=401, detail="Invalid render worker token")
+
+def _worker_job(job_id, worker_id):
+    try:
+        return render_queue.get_job(job_id, worker_id)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@app.on_event("startup")
+async def start_local_render_workers():
+    if render_queue.backend == "workers":
+        render_queue.start_sweeper()
+    if RENDER_LOCAL_WORKERS > 0:
+        render_queue.start_local_workers(os.getenv("RENDER_API_URL", "http://127.0.0.1:8000"))
+
+@app.on_event("shutdown")
+async def stop_local_render_workers():
+    await render_queue.stop_sweeper()
+    render_queue.stop_local_workers()
+
+@app.get("/api/render-workers")
+def get_render_workers():
+    return render_queue.stats()
+
+@app.post("/api/render-workers/register")
+async def register_render_worker(req: WorkerRegistration, token: Optional[str] = Header(None, alias="x-render-token")):
+    _check_worker_token(token)
+    return {"worker_id": render_queue.register(req.host, req.slots, req.shared_storage)}
+
+@app.post("/api/render-workers/{worker_id}/claim")
+async def claim_render_job(worker_id: str, wait: float = 25.0, token: Optional[str] = Header(None, alias="x-render-token")):
+    _check_worker_token(token)
+    try:
+        return {"job": await render_queue.claim(worker_id, wait_s=min(wait, 60.0))}
+    except KeyError as e:
+        # Unknown after an API restart: the worker re-registers
+        raise HTTPException(status_code=404, detail=str(e))
+
+@app.post("/api/render-jobs/{job_id}/progress")
+async def report_render_progress(job_id: str, req: WorkerReport, token: Optional[str] = Header(None, alias="x-render-token")):
+    _check_worker_token(token)
+    _worker_job(job_id, req.worker_id)
+    render_queue.progress(job_id, req.worker_id, req.out_time_s)
+    return {"ok": True}
+
+@app.get("/api/render-jobs/{job_id}/inputs/{name}")
+def download_render_input(job_id: str, name: str, worker_id: str, token: Optional[str] = Header(None, alias="x-render-token")):
+    _check_worker_token(token)
+    job = _worker_job(job_id, worker_id)
+    if name not in job.inputs:
+        raise HTTPException(status_code=404, detail=f"No input '{name}'")
+    return FileResponse(job.inputs[name])
+
+@app.put("/api/render-jobs/{job_id}/outputs/{name}")
+async def upload_render_output(job_id: str, name: str, worker_id: str, request: Request,
+                               token: Optional[str] = Header(None, alias="x-render-token")):
+    _check_worker_token(token)
+    job = _worker_job(job_id, worker_id)
+    if name not in job.outputs:
+        raise HTTPException(status_code=404, detail=f"No output '{name}'")
+    # Stream to a temp name so a half-uploaded file never looks complete
+    tmp_path = job.outputs[name] + ".part"
+    with open(tmp_path, "wb") as f:
+        async for chunk in request.stream():
+            f.write(chunk)
+    os.replace(tmp_path, job.outputs[name])
+    return {"ok": True}
+
+@app.post("/api/render-jobs/{job_id}/complete")
+async def complete_render_job(job_id: str, req: WorkerReport, token: Optional[str] = Header(None, alias="x-render-token")):
+    _check_worker_token(token)
+    _worker_job(job_id, req.worker_id)
+    try:
+        render_queue.complete(job_id, req.worker_id)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"ok": True}
+
+@app.post("/api/render-jobs/{job_id}/fail")
+async def fail_render_job(job_id: str, req: WorkerReport, token: Optional[str] = Header(None, alias="x-render-token")):
+    _check_worker_token(token)
+    _worker_job(job_id, req.worker_id)
+    render_queue.fail(job_id, req.worker_id, req.error or "unknown error")
+    return {"ok": True}
+
+# Storyboard parse cache: {sha256 of uploaded file + sheets: [scenes]} (LRU, in-memory)
+STORYBOARD_CACHE_SIZE = int(os.getenv("STORYBOARD_CACHE_SIZE", "32"))
+storyboard_cache: "OrderedDict[str, list]" = OrderedDict()
+
+def _ndjson(obj):
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+@app.post("/api/storyboard/parse")
+async def parse_storyboard_endpoint(
+    file: UploadFile = File(...),
+    sheets: Optional[str] = Form(None),
+    storyboard_id: Optional[str] = Form(None)
+):
+    """
+    In-process storyboard parsing (replaces spawning excel_parser.py per upload).
+    Streams scenes as NDJSON while a worker thread reads rows; results are cached by file hash.
+    With storyboard_id, scenes are diffed against the previous import (see storyboard_diff).
+    """
+    loop = asyncio.get_running_loop()
+    file_ext = os.path.splitext(file.filename or "")[1].lower()
+    fmt = "csv" if file_ext in CSV_EXTENSIONS else "xlsx"
+    sheet_list = [s.strip() for s in sheets.split(",") if s.strip()] if sheets else None
+
+    # The parse reads a materialized copy that owns the blob, so a concurrent gc can't delete it.
+    # A path owner also goes stale by itself if the copy is ever left behind (orphan sweep).
+    parse_path = os.path.join(UPLOAD_DIR, f"storyboard_{uuid.uuid4().hex}{file_ext}")
+    digest = await loop.run_in_executor(None, lambda: media_store.put_stream(file.file, ext=file_ext, owner=parse_path))
+    cache_key = f"{digest}:{','.join(sheet_list or [])}"
+
+    def finish(scenes):
+        if not storyboard_id:
+            return []
+        result = storyboard_diff.reimport(storyboard_id, scenes)
+        return [{"summary": result["summary"], "deleted": result["deleted"], "requeue": result["requeue"]}]
+
+    async def stream_cached(scenes):
+        if storyboard_id:
+            scenes = [dict(s) for s in scenes]
+            tail = await asyncio.to_thread(finish, scenes)
+        else:
+            tail = []
+        for scene in scenes:
+            yield _ndjson(scene)
+        for line in tail:
+            yield _ndjson(line)
+
+    async def stream_fresh():
+        # Unbounded: scenes are small, and the worker must never block on a disconnected client
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+
+        def worker():
+            try:
+                media_store.materialize(digest, parse_path)
+                for scene in iter_storyboard(parse_path, sheets=sheet_list, fmt=fmt):
+                    loop.call_soon_threadsafe(queue.put_nowait, scene)
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            finally:
+                media_store.release_path(parse_path)
+
+        parse_future = loop.run_in_executor(None, worker)
+        scenes = []
+        try:
+            while True:
+                item = await queue.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    print(f"[Storyboard] Parse error: {item}")
+                    yield _ndjson({"error": str(item)})
+                    return
+                scenes.append(item)
+                # Incremental mode needs the whole sheet before ids can be assigned
+                if not storyboard_id:
+                    yield _ndjson(item)
+        finally:
+            # Also on client disconnect: the worker finishes the sheet and drops its blob reference
+            await parse_future
+
+        storyboard_cache[cache_key] = [dict(s) for s in scenes]
+        while len(storyboard_cache) > STORYBOARD_CACHE_SIZE:
+            storyboard_cache.popitem(last=False)
+
+        if storyboard_id:
+            tail = await asyncio.to_thread(finish, scenes)
+            for scene in scenes:
+                yield _ndjson(scene)
+            for line in tail:
+                yield _ndjson(line)
+
+    cached = storyboard_cache.get(cache_key)
+    cache_result("storyboard_parse", cached is not None)
+    if cached is not None:
+        storyboard_cache.move_to_end(cache_key)
+        await asyncio.to_thread(media_store.release, digest, parse_path)
+        body = stream_cached(cached)
+    else:
+        body = stream_fresh()
+
+    return StreamingResponse(
+        body,
+        media_type="application/x-ndjson",
+        headers={"X-Storyboard-Hash": digest, "X-Cache": "HIT" if cached is not None else "MISS"}
+    )
+
+# --- Storyboard -> video DAG (see services/storyboard_dag.py) ---
+
+class StoryboardRenderRequest(BaseModel):
+    scenes: List[dict]
+    storyboard_id: Optional[str] = None
+    image_mode: str = "api"  # 'api', 'dom' or 'placeholder'
+    voice_id: Optional[str] = None
+    cookies_path: Optional[str] = None
+
+async def _storyboard_image(node, deps, out_stem, job):
+    """DAG image node: the same serialized Whisk generation (and API -> DOM fallback) as the queued endpoint."""
+    options = job["options"]
+    if options.get("image_mode") == "placeholder":
+        return await storyboard_executor.placeholder_image(node, deps, out_stem, job)
+    out_dir = os.path.dirname(out_stem)
+    result = await generate_image_queued(GenerateRequest(
+        prompt=node.params["prompt"], output_dir=out_dir, filename=os.path.basename(out_stem),
+        mode=options.get("image_mode") or "api", cookies_path=options.get("cookies_path")
+    ))
+    if not result.get("success"):
+        raise RuntimeError(result.get("error") or "No image returned")
+    # API results carry an absolute path, DOM results a web path; both files live in out_dir
+    return os.path.join(out_dir, os.path.basename(result["full_path"]))
+
+storyboard_executor.handlers["image"] = _storyboard_image
+
+def _storyboard_progress(state):
+    counts = storyboard_executor.summary(state)
+    finished = counts.get("done", 0) + counts.get("cached", 0)
+    total = len(state["nodes"])
+    update_task(state["run_id"], "processing", int(finished * 99 / total),
+                f"{finished}/{total} storyboard nodes finished", nodes=counts)
+
+async def _run_storyboard(run_id: str, eleven_key: str = None, base_url: str = None):
+    update_task(run_id, "processing", 0, "Starting storyboard render...")
+    success = False
+    try:
+        state = await storyboard_executor.run(run_id, secrets={"eleven_key": eleven_key}, on_progress=_storyboard_progress)
+        counts = storyboard_executor.summary(state)
+        if state["status"] != "completed":
+            update_task(run_id, "failed", task_store.get(run_id, {}).get("progress", 0),
+                        f"Error: {state['error']}", nodes=counts)
+            return
+        result_url = delivery.public_url(f"outputs/{os.path.basename(state['output'])}", base_url)
+        update_task(run_id, "completed", 100, "Storyboard render complete!", result_url, nodes=counts)
+        success = True
+    except Exception as e:
+        print(f"[Storyboard] Run {run_id} crashed: {e}")
+        update_task(run_id, "failed", 0, f"Error: {str(e)}")
+    finally:
+        # Node files are cached in the media store; the run dir keeps only state.json
+        if success or not ARTIFACT_KEEP_FAILED:
+            await asyncio.to_thread(storyboard_executor.release_work_files, run_id)
+        artifacts.finish(run_id, success=success)
+
+@app.post("/api/storyboard/render", response_model=ProcessResponse)
+async def render_storyboard(
+    req: StoryboardRenderRequest,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    eleven_key: Optional[str] = Header(None, alias="x-eleven-key")
+):
+    """
+    Renders a whole storyboard server-side: images, narration, per-scene clips and the final
+    concat run as a DAG. Unchanged scenes are served from the node cache on every later render.
+    """
+    if req.image_mode not in ("api", "dom", "placeholder"):
+        raise HTTPException(status_code=400, detail=f"Unknown image mode '{req.image_mode}'")
+    run_id = str(uuid.uuid4())
+    options = {
+        "image_mode": req.image_mode, "voice_id": req.voice_id, "cookies_path": req.cookies_path,
+        "output_path": os.path.join(OUTPUT_DIR, f"gvva_storyboard_{run_id}.mp4"),
+    }
+    try:
+        state = await asyncio.to_thread(storyboard_executor.create_run, req.scenes, options, req.storyboard_id, run_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    artifacts.register(run_id, options["output_path"], "output")
+    update_task(run_id, "queued", 0, f"Queued {len(state['nodes'])} storyboard nodes...")
+    background_tasks.add_task(_run_storyboard, run_id, eleven_key, str(request.base_url))
+    return {"task_id": run_id, "status": "queued", "message": "Storyboard accepted. Check status endpoint."}
+
+@app.get("/api/storyboard/runs/{run_id}")
+def get_storyboard_run(run_id: str):
+    """Per-node state (status, cache hit, attempts, seconds, error) of a storyboard render."""
+    try:
+        state = storyboard_executor.load_run(run_id)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return {**state, "summary": storyboard_executor.summary(state)}
+
+@app.get("/api/storyboard/manifests/{storyboard_id}")
+def get_storyboard_manifest(storyboard_id: str):
+    """Per-scene clip keys of the storyboard's last completed render (what the next render can reuse)."""
+    manifest = storyboard_executor.load_manifest(storyboard_id)
+    if manifest is None:
+        raise HTTPException(status_code=404, detail="No completed render for this storyboard")
+    return manifest
+
+@app.post("/api/storyboard/runs/{run_id}/resume", response_model=ProcessResponse)
+async def resume_storyboard_run(
+    run_id: str,
+    request: Request,
+    background_tasks: BackgroundTasks,
+    eleven_key: Optional[str] = Header(None, alias="x-eleven-key")
+):
+    """Re-runs a failed or interrupted render; finished nodes are kept, failed ones retried."""
+    try:
+        state = storyboard_executor.load_run(run_id)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    if task_store.get(run_id, {}).get("status") in ("queued", "processing"):
+        raise HTTPException(status_code=409, detail="Storyboard run is already in progress")
+    update_task(run_id, "queued", 0, "Resuming storyboard render...", nodes=storyboard_executor.summary(state))
+    background_tasks.add_task(_run_storyboard, run_id, eleven_key, str(request.base_url))
+    return {"task_id": run_id, "status": "queued", "message": "Storyboard run resumed."}
+
+@app.on_event("startup")
+async def recover_storyboard_runs():
+    # Runs still marked running on disk were cut off by a restart; STORYBOARD_AUTO_RESUME picks them up
+    auto_resume = os.getenv("STORYBOARD_AUTO_RESUME", "0") == "1"
+    for state in await asyncio.to_thread(storyboard_executor.interrupted_runs):
+        counts = storyboard_executor.summary(state)
+        if auto_resume:
+            update_task(state["run_id"], "queued", 0, "Resuming interrupted storyboard render...", nodes=counts)
+            asyncio.create_task(_run_storyboard(state["run_id"]))
+        else:
+            update_task(state["run_id"], "interrupted", 0, "Interrupted by a restart. POST .../resume to continue.",
+                        nodes=counts)
+
 if __name__ == "__main__":
+    if "--profile-startup" in sys.argv:
+        # Report per-module import cost of this server (run in a fresh interpreter)
+        from services.startup_profiler import profile_imports, format_report
+        print(format_report(profile_imports("main")))
+        sys.exit(0)
+
+    import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
 
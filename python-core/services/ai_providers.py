@@ -0,0 +1,400 @@
+
+import os
+import io
+import time
+import asyncio
+import wave
+import hashlib
+import subprocess
+from contextlib import nullcontext
+
+from services.client_pool import ClientPool
+from services.resilience import call_with_resilience, acall_with_resilience
+
+CLIENT_POOL_SIZE = int(os.getenv("AI_CLIENT_POOL_SIZE", "32"))
+CLIENT_IDLE_TTL = float(os.getenv("AI_CLIENT_IDLE_TTL", "600"))
+
+# Per-call deadlines (seconds, including retries) and optional hedging for short calls
+STT_DEADLINE = float(os.getenv("AI_STT_DEADLINE", "300"))
+TRANSLATE_DEADLINE = float(os.getenv("AI_TRANSLATE_DEADLINE", "90"))
+TTS_DEADLINE = float(os.getenv("AI_TTS_DEADLINE", "180"))
+TRANSLATE_HEDGE_AFTER = float(os.getenv("AI_TRANSLATE_HEDGE_AFTER", "0"))
+
+# --- Interfaces ---
+# Async variants default to running the sync call in a worker thread;
+# network-backed providers override them with native async clients.
+
+class STTProvider:
+    name = "base"
+
+    def transcribe(self, audio, api_key=None):
+        """audio: file path or (filename, bytes). Returns a verbose_json-like object/dict."""
+        raise NotImplementedError
+
+    async def atranscribe(self, audio, api_key=None):
+        return await asyncio.to_thread(self.transcribe, audio, api_key)
+
+class TranslationProvider:
+    name = "base"
+
+    def translate(self, text, target_lang="ja", tone="casual", api_key=None):
+        raise NotImplementedError
+
+    async def atranslate(self, text, target_lang="ja", tone="casual", api_key=None):
+        return await asyncio.to_thread(self.translate, text, target_lang, tone, api_key)
+
+class TTSProvider:
+    name = "base"
+
+    def generate_voice(self, text, voice_id=None, api_key=None):
+        """Returns encoded audio bytes."""
+        raise NotImplementedError
+
+    async def agenerate_voice(self, text, voice_id=None, api_key=None):
+        return await asyncio.to_thread(self.generate_voice, text, voice_id, api_key)
+
+# --- Default (live) providers ---
+
+def _openai_client(api_key):
+    # SDK imported on first use (see startup budget)
+    from openai import OpenAI
+    # Retries are owned by services.resilience (rate-limit aware), not the SDK
+    return OpenAI(api_key=api_key, max_retries=0)
+
+def _async_openai_client(api_key):
+    from openai import AsyncOpenAI
+    return AsyncOpenAI(api_key=api_key, max_retries=0)
+
+def _eleven_client(api_key):
+    from elevenlabs.client import ElevenLabs
+    return ElevenLabs(api_key=api_key)
+
+def _async_eleven_client(api_key):
+    from elevenlabs.client import AsyncElevenLabs
+    return AsyncElevenLabs(api_key=api_key)
+
+# One pool per SDK/flavor, shared by every stage that uses it (STT + translation share OpenAI clients)
+client_pools = {
+    "openai": ClientPool(_openai_client, CLIENT_POOL_SIZE, CLIENT_IDLE_TTL, name="openai"),
+    "openai_async": ClientPool(_async_openai_client, CLIENT_POOL_SIZE, CLIENT_IDLE_TTL, name="openai_async"),
+    "elevenlabs": ClientPool(_eleven_client, CLIENT_POOL_SIZE, CLIENT_IDLE_TTL, name="elevenlabs"),
+    "elevenlabs_async": ClientPool(_async_eleven_client, CLIENT_POOL_SIZE, CLIENT_IDLE_TTL, name="elevenlabs_async"),
+}
+
+class _EnvClientMixin:
+    """Resolves the request key (header) or env key and leases a pooled client for it."""
+    env_key = None
+    pool_name = None
+
+    def _resolve_key(self, api_key):
+        if api_key:
+            return api_key
+        env_value = os.getenv(self.env_key)
+        if not env_value:
+            print(f"Warning: {self.env_key} not found.")
+        return env_value
+
+    def _client(self, api_key=None):
+        """Context manager leasing the pooled client for one request; yields None without a key."""
+        key = self._resolve_key(api_key)
+        return client_pools[self.pool_name].lease(key) if key else nullcontext()
+
+    def _async_client(self, api_key=None):
+        key = self._resolve_key(api_key)
+        return client_pools[f"{self.pool_name}_async"].lease(key) if key else nullcontext()
+
+def _read_audio(audio):
+    # Upload payload as (filename, bytes) so every retry/hedge attempt can resend it
+    if isinstance(audio, tuple):
+        return audio
+    with open(audio, "rb") as f:
+        return (os.path.basename(audio), f.read())
+
+class OpenAIWhisperSTT(_EnvClientMixin, STTProvider):
+    name = "openai"
+    env_key = "OPENAI_API_KEY"
+    pool_name = "openai"
+    model = "whisper-1"
+
+    def _request(self, audio, timeout):
+        return dict(
+            model=self.model,
+            file=audio,
+            response_format="verbose_json",
+            timestamp_granularities=["word"],
+            timeout=timeout
+        )
+
+    def transcribe(self, audio, api_key=None):
+        with self._client(api_key) as client:
+            if not client:
+                raise ValueError("OpenAI API Key not provided (env or header)")
+
+            audio = _read_audio(audio)
+            return call_with_resilience(
+                lambda timeout: client.audio.transcriptions.create(**self._request(audio, timeout)),
+                api_key=self._resolve_key(api_key), model=self.model, deadline_s=STT_DEADLINE, label="Whisper"
+            )
+
+    async def atranscribe(self, audio, api_key=None):
+        with self._async_client(api_key) as client:
+            if not client:
+                raise ValueError("OpenAI API Key not provided (env or header)")
+
+            audio = _read_audio(audio)
+            return await acall_with_resilience(
+                lambda timeout: client.audio.transcriptions.create(**self._request(audio, timeout)),
+                api_key=self._resolve_key(api_key), model=self.model, deadline_s=STT_DEADLINE, label="Whisper"
+            )
+
+class OpenAIChatTranslator(_EnvClientMixin, TranslationProvider):
+    name = "openai"
+    env_key = "OPENAI_API_KEY"
+    pool_name = "openai"
+    model = "gpt-4o"
+
+    def system_prompt(self, target_lang):
+        # Specialized Persona for Japanese Localization
+        if target_lang == "ja":
+            return (
+                "You are a top-tier Japanese YouTuber (20s, energetic, trendsetter). "
+                "Your task is to RE-WRITE the following Korean text into natural, viral Japanese. "
+                "CRITICAL RULES:\n"
+                "1. DO NOT translate literally. Adapt the underlying MEANING to Japanese internet culture.\n"
+                "2. Use natural sentence endings (～だよ, ～じゃん, ～でしょ) matching a high-energy vibe.\n"
+                "3. Use Japanese slang/memes (e.g., 草, 尊い, エモい, ww) where appropriate for emotion.\n"
+                "4. Maintain the original emotional peaks but express them in a Japanese way.\n"
+                "5. Optimize for 'Audio Flow' - strictly avoid stiff written-style Japanese.\n"
+                "6. If the source is boring, make it exciting."
+            )
+        return f"You are a trendy YouTuber in {target_lang}. Translate naturally using local memes and casual tone."
+
+    def _request(self, text, target_lang, timeout):
+        return dict(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": self.system_prompt(target_lang)},
+                {"role": "user", "content": text}
+            ],
+            timeout=timeout
+        )
+
+    def translate(self, text, target_lang="ja", tone="casual", api_key=None):
+        with self._client(api_key) as client:
+            if not client:
+                raise ValueError("OpenAI API Key not provided (env or header)")
+
+            response = call_with_resilience(
+                lambda timeout: client.chat.completions.create(**self._request(text, target_lang, timeout)),
+                api_key=self._resolve_key(api_key), model=self.model, deadline_s=TRANSLATE_DEADLINE, label="GPT"
+            )
+            return response.choices[0].message.content
+
+    async def atranslate(self, text, target_lang="ja", tone="casual", api_key=None):
+        with self._async_client(api_key) as client:
+            if not client:
+                raise ValueError("OpenAI API Key not provided (env or header)")
+
+            response = await acall_with_resilience(
+                lambda timeout: client.chat.completions.create(**self._request(text, target_lang, timeout)),
+                api_key=self._resolve_key(api_key), model=self.model, deadline_s=TRANSLATE_DEADLINE,
+                hedge_after_s=TRANSLATE_HEDGE_AFTER or None, label="GPT"
+            )
+            return response.choices[0].message.content
+
+class ElevenLabsTTS(_EnvClientMixin, TTSProvider):
+    name = "elevenlabs"
+    env_key = "ELEVENLABS_API_KEY"
+    pool_name = "elevenlabs"
+    model = "eleven_multilingual_v2"
+    default_voice_id = "JBFqnCBsd6RMkjVDRZzb" # Default Adam voice
+
+    def generate_voice(self, text, voice_id=None, api_key=None):
+        with self._client(api_key) as client:
+            if not client:
+                raise ValueError("ElevenLabs API Key not provided (env or header)")
+
+            def attempt(timeout):
+                audio_generator = client.text_to_speech.convert(
+                    text=text,
+                    voice_id=voice_id or self.default_voice_id,
+                    model_id=self.model,
+                    request_options={"timeout_in_seconds": int(timeout) or 1}
+                )
+                # Collect all chunks into a single byte array
+                return b"".join(chunk for chunk in audio_generator)
+
+            try:
+                return call_with_resilience(
+                    attempt, api_key=self._resolve_key(api_key), model=self.model,
+                    deadline_s=TTS_DEADLINE, label="ElevenLabs"
+                )
+            except Exception as e:
+                print(f"ElevenLabs TTS Error: {e}")
+                raise e
+
+    async def agenerate_voice(self, text, voice_id=None, api_key=None):
+        with self._async_client(api_key) as client:
+            if not client:
+                raise ValueError("ElevenLabs API Key not provided (env or header)")
+
+            async def attempt(timeout):
+                chunks = []
+                async for chunk in client.text_to_speech.convert(
+                    text=text,
+                    voice_id=voice_id or self.default_voice_id,
+                    model_id=self.model,
+                    request_options={"timeout_in_seconds": int(timeout) or 1}
+                ):
+                    chunks.append(chunk)
+                return b"".join(chunks)
+
+            try:
+                return await acall_with_resilience(
+                    attempt, api_key=self._resolve_key(api_key), model=self.model,
+                    deadline_s=TTS_DEADLINE, label="ElevenLabs"
+                )
+            except Exception as e:
+                print(f"ElevenLabs TTS Error: {e}")
+                raise e
+
+# --- Local offline stand-ins (benchmarks / CI, no keys or network) ---
+
+LOCAL_LATENCY_MS = float(os.getenv("LOCAL_AI_LATENCY_MS", "300"))
+LOCAL_WORDS = ("lorem ipsum dolor sit amet video viral short clip music scene "
+               "camera light story moment today really great look here next").split()
+
+def _simulate_latency(payload_bytes=0):
+    # Fixed round trip plus a rough upload/processing cost per MB
+    if LOCAL_LATENCY_MS > 0:
+        time.sleep((LOCAL_LATENCY_MS + payload_bytes / (1024 * 1024) * 100) / 1000)
+
+def _estimate_duration(audio):
+    """Audio length without decoding: WAV header if present, else Opus-at-24kbps size estimate."""
+    if isinstance(audio, tuple):
+        data = audio[1]
+    else:
+        with open(audio, "rb") as f:
+            data = f.read()
+    if data[:4] == b"RIFF":
+        with wave.open(io.BytesIO(data)) as w:
+            return w.getnframes() / w.getframerate(), data
+    return len(data) * 8 / 24000, data
+
+class LocalSTT(STTProvider):
+    """Deterministic synthetic transcript (~2.5 words/s) with word timings, seeded by the audio bytes."""
+    name = "local"
+
+    def transcribe(self, audio, api_key=None):
+        duration, data = _estimate_duration(audio)
+        _simulate_latency(len(data))
+        seed = int(hashlib.sha1(data).hexdigest(), 16)
+
+        words = []
+        t = 0.2
+        step = 0.4
+        i = 0
+        while t + step <= duration:
+            word = LOCAL_WORDS[(seed + i * 2654435761) % len(LOCAL_WORDS)]
+            words.append({"word": word, "start": round(t, 3), "end": round(t + step * 0.8, 3)})
+            t += step
+            i += 1
+
+        segments = []
+        for n in range(0, len(words), 12):
+            group = words[n:n + 12]
+            segments.append({
+                "id": len(segments),
+                "text": " ".join(w["word"] for w in group),
+                "start": group[0]["start"],
+                "end": group[-1]["end"]
+            })
+        return {
+            "text": " ".join(w["word"] for w in words),
+            "words": words,
+            "segments": segments,
+            "language": "ko",
+            "duration": duration
+        }
+
+class EchoTranslator(TranslationProvider):
+    name = "local"
+
+    def translate(self, text, target_lang="ja", tone="casual", api_key=None):
+        _simulate_latency(len(text.encode("utf-8")))
+        return f"[{target_lang}] {text}"
+
+class ToneTTS(TTSProvider):
+    """
+    Generates speech-shaped audio: a short tone burst per word with gaps, plus leading/trailing
+    silence like real TTS output. Encoded to 128 kbps MP3 through ffmpeg (same size class as
+    ElevenLabs output); falls back to WAV bytes when ffmpeg is unavailable.
+    """
+    name = "local"
+    sample_rate = 22050
+    words_per_second = 2.5
+
+    def __init__(self, ffmpeg_path=None):
+        if ffmpeg_path is None:
+            from services.ffmpeg_handler import ffmpeg_handler
+            ffmpeg_path = ffmpeg_handler.ffmpeg_path
+        self.ffmpeg_path = ffmpeg_path
+
+    def render_pcm(self, text):
+        import numpy as np
+
+        # Space-separated languages count words; CJK text roughly 3 characters per "word"
+        n_words = max(1, len(text.split()) if " " in text.strip() else len(text) // 3)
+        word_s = 1.0 / self.words_per_second
+        rate = self.sample_rate
+
+        tone_n = int(rate * word_s * 0.75)
+        n = np.arange(tone_n)
+        envelope = np.sin(np.pi * n / tone_n)
+        parts = [np.zeros(int(rate * 0.35))]
+        gap = np.zeros(int(rate * word_s * 0.25))
+        for i in range(n_words):
+            freq = 180 + (i * 37) % 120
+            parts.append(9000 * envelope * np.sin(2 * np.pi * freq * n / rate))
+            parts.append(gap)
+        parts.append(np.zeros(int(rate * 0.5)))
+        return np.concatenate(parts).astype("<i2").tobytes()
+
+    def generate_voice(self, text, voice_id=None, api_key=None):
+        pcm = self.render_pcm(text)
+        _simulate_latency(len(pcm) // 10)
+        try:
+            result = subprocess.run(
+                [self.ffmpeg_path, '-v', 'error', '-f', 's16le', '-ar', str(self.sample_rate), '-ac', '1',
+                 '-i', 'pipe:0', '-c:a', 'libmp3lame', '-b:a', '128k', '-f', 'mp3', 'pipe:1'],
+                input=pcm, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True
+            )
+            return result.stdout
+        except (OSError, subprocess.CalledProcessError):
+            buf = io.BytesIO()
+            with wave.open(buf, "wb") as w:
+                w.setnchannels(1)
+                w.setsampwidth(2)
+                w.setframerate(self.sample_rate)
+                w.writeframes(pcm)
+            return buf.getvalue()
+
+# --- Registry ---
+
+STT_PROVIDERS = {"openai": OpenAIWhisperSTT, "local": LocalSTT}
+TRANSLATION_PROVIDERS = {"openai": OpenAIChatTranslator, "local": EchoTranslator}
+TTS_PROVIDERS = {"elevenlabs": ElevenLabsTTS, "local": ToneTTS}
+
+def _select(registry, env_name, default):
+    # AI_PROVIDER=local switches every stage at once; per-stage vars override it
+    name = os.getenv(env_name) or ("local" if os.getenv("AI_PROVIDER") == "local" else default)
+    if name not in registry:
+        raise ValueError(f"Unknown {env_name}={name!r} (choose from {', '.join(registry)})")
+    return registry[name]()
+
+def create_providers():
+    return {
+        "stt": _select(STT_PROVIDERS, "STT_PROVIDER", "openai"),
+        "translation": _select(TRANSLATION_PROVIDERS, "TRANSLATION_PROVIDER", "openai"),
+        "tts": _select(TTS_PROVIDERS, "TTS_PROVIDER", "elevenlabs"),
+    }
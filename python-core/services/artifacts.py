@@ -0,0 +1,288 @@
+
+import os
+import time
+import shutil
+import threading
+
+from services.media_store import media_store
+
+# Hard cap for UPLOAD_DIR + OUTPUT_DIR + the media store (+ ARTIFACT_TMP_DIR); 0 disables the quota
+ARTIFACT_QUOTA_BYTES = int(float(os.getenv("ARTIFACT_QUOTA_GB", "0")) * 1024 ** 3)
+# Keep at least this much free on the volume regardless of the quota
+ARTIFACT_MIN_FREE_BYTES = int(float(os.getenv("ARTIFACT_MIN_FREE_GB", "2")) * 1024 ** 3)
+# Optional tmpfs (e.g. /dev/shm/gvva) for short-lived intermediates (TTS audio, synced video)
+ARTIFACT_TMP_DIR = os.getenv("ARTIFACT_TMP_DIR", "")
+ARTIFACT_KEEP_FAILED = os.getenv("ARTIFACT_KEEP_FAILED", "0") == "1"
+# Unregistered files older than this in the work dirs are leftovers of earlier runs
+ARTIFACT_ORPHAN_HOURS = float(os.getenv("ARTIFACT_ORPHAN_HOURS", "24"))
+
+# upload/intermediate: deleted once every consumer stage is done (or the task ends)
+# cache: kept after the task, evicted under quota pressure
+# output: kept, evicted least-recently-served first under quota pressure
+KINDS = ("upload", "intermediate", "cache", "output")
+EVICTION_ORDER = ("cache", "output")
+
+class QuotaExceeded(OSError):
+    pass
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def _disk_bytes(roots):
+    """Bytes under roots with every inode counted once (outputs are often hardlinks to store blobs)."""
+    seen, total = set(), 0
+    for top in roots:
+        for root, _, files in os.walk(top):
+            for name in files:
+                try:
+                    st = os.lstat(os.path.join(root, name))
+                except OSError:
+                    continue
+                if (st.st_dev, st.st_ino) not in seen:
+                    seen.add((st.st_dev, st.st_ino))
+                    total += st.st_size
+    return total
+
+def _size(path):
+    # Directories (HLS renditions) count as the sum of their files
+    if os.path.isdir(path):
+        return _dir_size(path)
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+class ArtifactManager:
+    """
+    Tracks every file a task creates: who produces it, which stages consume it and when it was
+    last used. Intermediates are deleted as soon as their last consumer finishes; cached WAVs,
+    other caches (cache_evictors) and finished outputs are evicted LRU whenever a new stage
+    needs room under the quota. Files may be links into the media store: deleting one releases
+    its ref, and only the space actually returned (re-measured) counts as freed.
+    """
+    def __init__(self, upload_dir, output_dir, quota_bytes=ARTIFACT_QUOTA_BYTES, tmp_dir=ARTIFACT_TMP_DIR,
+                 store_dir=None):
+        self.upload_dir = upload_dir
+        self.output_dir = output_dir
+        self.store_dir = store_dir or media_store.root
+        self.quota_bytes = quota_bytes
+        self.tmp_dir = tmp_dir
+        if tmp_dir:
+            os.makedirs(tmp_dir, exist_ok=True)
+        self.artifacts = {}      # abs path -> record
+        self.active_tasks = set()
+        self.on_evict = None     # callback(task_id, path) for outputs removed under pressure
+        # evict(keep_going) callables for caches kept outside the artifact records (e.g. the
+        # storyboard node cache): drop least recently used entries while keep_going() is true
+        self.cache_evictors = []
+        self._lock = threading.RLock()
+        self.evicted_bytes = 0
+        self.deleted_bytes = 0
+
+    # --- registration ---
+
+    def register(self, task_id, path, kind="intermediate", consumers=()):
+        if kind not in KINDS:
+            raise ValueError(f"Unknown artifact kind '{kind}'")
+        path = os.path.abspath(path)
+        now = time.time()
+        with self._lock:
+            self.active_tasks.add(task_id)
+            self.artifacts[path] = {
+                "task_id": task_id, "path": path, "kind": kind,
+                "consumers": set(consumers), "size": _size(path),
+                "created": now, "last_used": now,
+            }
+        return path
+
+    def intermediate_path(self, filename, expected_bytes=0, allow_tmp=True):
+        """Work path for a short-lived file: on tmpfs when configured and it fits, else UPLOAD_DIR."""
+        if self.tmp_dir and allow_tmp:
+            free = shutil.disk_usage(self.tmp_dir).free
+            if expected_bytes < free - 64 * 1024 * 1024:
+                return os.path.join(self.tmp_dir, filename)
+        return os.path.join(self.upload_dir, filename)
+
+    def consume(self, task_id, stage):
+        """A stage finished: drop it from its inputs' consumers and delete what nobody needs anymore."""
+        with self._lock:
+            done = []
+            for record in self.artifacts.values():
+                if record["task_id"] != task_id or stage not in record["consumers"]:
+                    continue
+                record["consumers"].discard(stage)
+                if not record["consumers"] and record["kind"] in ("upload", "intermediate"):
+                    done.append(record["path"])
+            for path in done:
+                self._delete(path)
+
+    def finish(self, task_id, success=True):
+        """Task ended: remove its remaining uploads/intermediates (kept on failure with ARTIFACT_KEEP_FAILED=1)."""
+        with self._lock:
+            self.active_tasks.discard(task_id)
+            if not success and ARTIFACT_KEEP_FAILED:
+                return
+            for path in [p for p, r in self.artifacts.items()
+                         if r["task_id"] == task_id and r["kind"] in ("upload", "intermediate")]:
+                self._delete(path)
+            # Outputs/caches: record their final size for quota accounting
+            for record in self.artifacts.values():
+                if record["task_id"] == task_id:
+                    record["size"] = _size(record["path"])
+
+    def discard(self, task_id):
+        """Deletes everything a task registered, outputs included (benchmark and test runs). Returns bytes freed."""
+        with self._lock:
+            self.active_tasks.discard(task_id)
+            return sum(self._delete(path) for path in [p for p, r in self.artifacts.items() if r["task_id"] == task_id])
+
+    def touch(self, path):
+        record = self.artifacts.get(os.path.abspath(path))
+        if record:
+            record["last_used"] = time.time()
+
+    def _delete(self, path):
+        record = self.artifacts.pop(path, None)
+        size = _size(path)
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            elif os.path.lexists(path):
+                # Uploads, outputs and storyboard finals may be materialized blobs: releasing the
+                # path's ref lets the store delete the blob with its last reference
+                media_store.release_path(path)
+        except OSError as e:
+            print(f"[Artifacts] Could not delete {path}: {e}")
+            return 0
+        self.deleted_bytes += size
+        return size
+
+    # --- quota ---
+
+    def _roots(self):
+        return [d for d in (self.upload_dir, self.output_dir, self.tmp_dir, self.store_dir) if d]
+
+    def usage(self):
+        with self._lock:
+            by_kind = {kind: 0 for kind in KINDS}
+            for record in self.artifacts.values():
+                record["size"] = _size(record["path"])
+                by_kind[record["kind"]] += record["size"]
+            dirs = {d: _dir_size(d) for d in self._roots()}
+            disk = shutil.disk_usage(self.output_dir)
+            return {
+                "total_bytes": _disk_bytes(self._roots()),
+                "quota_bytes": self.quota_bytes,
+                "dirs": dirs,
+                "by_kind": by_kind,
+                "tracked_files": len(self.artifacts),
+                "active_tasks": len(self.active_tasks),
+                "disk_free_bytes": disk.free,
+                "min_free_bytes": ARTIFACT_MIN_FREE_BYTES,
+                "deleted_bytes": self.deleted_bytes,
+                "evicted_bytes": self.evicted_bytes,
+            }
+
+    def ensure_space(self, needed_bytes):
+        """
+        Makes room for needed_bytes before a stage writes, evicting caches then outputs
+        (least recently used first, never those of running tasks). Raises QuotaExceeded if
+        the space can't be found, so the stage fails cleanly instead of filling the disk mid-render.
+        """
+        with self._lock:
+            used, free = 0, 0
+
+            def measure():
+                # Hardlinked files only free space with their last link, so nothing is assumed
+                nonlocal used, free
+                used = _disk_bytes(self._roots())
+                free = shutil.disk_usage(self.output_dir).free
+                return used
+
+            def short():
+                over_quota = used + needed_bytes - self.quota_bytes if self.quota_bytes else 0
+                under_free = ARTIFACT_MIN_FREE_BYTES + needed_bytes - free
+                return max(over_quota, under_free, 0)
+
+            measure()
+            if short() <= 0:
+                return
+            candidates = sorted(
+                (r for r in self.artifacts.values()
+                 if r["kind"] in EVICTION_ORDER and r["task_id"] not in self.active_tasks),
+                key=lambda r: (EVICTION_ORDER.index(r["kind"]), r["last_used"])
+            )
+            outputs = [r for r in candidates if r["kind"] == "output"]
+            for record in [r for r in candidates if r["kind"] != "output"]:
+                if short() <= 0:
+                    break
+                self._evict(record, used, measure)
+
+            def keep_going():
+                measure()
+                return short() > 0
+
+            for evict in self.cache_evictors:
+                if short() <= 0:
+                    break
+                before = used
+                evict(keep_going)
+                self.evicted_bytes += max(0, before - used)
+            for record in outputs:
+                if short() <= 0:
+                    break
+                self._evict(record, used, measure)
+            missing = short()
+            if missing > 0:
+                raise QuotaExceeded(f"Need {missing / 1024 ** 2:.0f} MB more disk for this stage "
+                                    f"(quota {self.quota_bytes / 1024 ** 3:.1f} GB)")
+
+    def _evict(self, record, used_before, measure):
+        task_id, path = record["task_id"], record["path"]
+        self._delete(path)
+        freed = max(0, used_before - measure())
+        self.evicted_bytes += freed
+        print(f"[Artifacts] Evicted {record['kind']} {os.path.basename(path)} ({freed / 1024 ** 2:.1f} MB freed)")
+        if self.on_evict:
+            self.on_evict(task_id, path)
+
+    # --- startup ---
+
+    def adopt_outputs(self):
+        """Registers outputs left by earlier runs so they take part in LRU eviction."""
+        with self._lock:
+            for name in os.listdir(self.output_dir):
+                path = os.path.abspath(os.path.join(self.output_dir, name))
+                if path not in self.artifacts:
+                    mtime = os.path.getmtime(path)
+                    self.artifacts[path] = {
+                        "task_id": None, "path": path, "kind": "output", "consumers": set(),
+                        "size": _size(path), "created": mtime, "last_used": mtime,
+                    }
+
+    def sweep_orphans(self, max_age_hours=ARTIFACT_ORPHAN_HOURS):
+        """Deletes untracked work files older than max_age_hours (crash leftovers). Returns bytes freed."""
+        cutoff = time.time() - max_age_hours * 3600
+        freed = 0
+        with self._lock:
+            for root in (self.upload_dir, self.tmp_dir):
+                if not root or not os.path.isdir(root):
+                    continue
+                for name in os.listdir(root):
+                    path = os.path.abspath(os.path.join(root, name))
+                    if path in self.artifacts or not os.path.isfile(path) or os.path.getmtime(path) > cutoff:
+                        continue
+                    size = _size(path)
+                    media_store.release_path(path)
+                    freed += size
+        if freed:
+            print(f"[Artifacts] Swept {freed / 1024 ** 2:.1f} MB of orphaned work files")
+        self.deleted_bytes += freed
+        return freed
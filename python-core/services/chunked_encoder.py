@@ -0,0 +1,163 @@
+
+import os
+import bisect
+import shutil
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# RENDER_CHUNKED: "auto" (long inputs only), "on" or "off"
+RENDER_CHUNKED = os.getenv("RENDER_CHUNKED", "auto")
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", str(os.cpu_count() or 4)))
+CHUNK_MIN_SECONDS = float(os.getenv("RENDER_CHUNK_MIN_SECONDS", "20"))
+CHUNKED_MIN_DURATION = float(os.getenv("RENDER_CHUNKED_MIN_DURATION", "180"))
+# Chunks per worker: a few more chunks than workers evens out slow (complex) segments
+CHUNKS_PER_WORKER = 2
+# Replaced with each segment's start time in the filter graph (timestamps restart at 0 per segment)
+CHUNK_START = "{chunk_start}"
+
+def _ffprobe_path(ffmpeg_path):
+    return ffmpeg_path.replace('ffmpeg.exe', 'ffprobe.exe').replace('ffmpeg', 'ffprobe')
+
+def probe_video_frames(input_path, ffmpeg_path="ffmpeg"):
+    """
+    Presentation timestamps of every video packet plus the keyframe subset, read from the
+    container index (no decode). Returns (sorted_pts, keyframe_pts).
+    """
+    cmd = [_ffprobe_path(ffmpeg_path), '-v', 'error', '-select_streams', 'v:0',
+           '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', input_path]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
+    pts, keyframes = [], []
+    for line in result.stdout.splitlines():
+        fields = line.strip().split(",")
+        if len(fields) < 2 or fields[0] in ("", "N/A"):
+            continue
+        t = float(fields[0])
+        pts.append(t)
+        if "K" in fields[1]:
+            keyframes.append(t)
+    pts.sort()
+    keyframes.sort()
+    return pts, keyframes
+
+def plan_segments(pts, keyframes, n_chunks, min_seconds=CHUNK_MIN_SECONDS):
+    """
+    Cuts at the keyframes closest to n_chunks equal divisions of the timeline, never
+    closer than min_seconds apart. Each segment is (start_time, frame_count): seeking to
+    a keyframe is exact, and the frame count (from the packet index) makes the end exact,
+    so concatenated segments have exactly the source's frames and timestamps.
+    """
+    if not pts:
+        return []
+    duration = pts[-1] - pts[0]
+    cuts = [pts[0]]
+    if keyframes and n_chunks > 1:
+        step = max(duration / n_chunks, min_seconds)
+        target = pts[0] + step
+        while target < pts[-1] - min_seconds:
+            i = bisect.bisect_left(keyframes, target)
+            candidates = [k for k in keyframes[max(0, i - 1):i + 1]
+                          if k - cuts[-1] >= min_seconds and pts[-1] - k >= min_seconds]
+            if candidates:
+                cuts.append(min(candidates, key=lambda k: abs(k - target)))
+                target = cuts[-1] + step
+            else:
+                target += step
+    segments = []
+    for i, start in enumerate(cuts):
+        first = bisect.bisect_left(pts, start)
+        last = bisect.bisect_left(pts, cuts[i + 1]) if i + 1 < len(cuts) else len(pts)
+        segments.append((start, last - first))
+    return segments
+
+class ChunkedEncoder:
+    """
+    Parallel render for long inputs: split at keyframes, encode every segment with the
+    same filter graph and encoder settings in its own ffmpeg process, then join the
+    segments with the concat demuxer (stream copy) and mux the untouched source audio
+    over the whole result, so there are no audio seams at chunk boundaries.
+    Filters must be per-frame (scale/crop/overlay/eq/noise); stateful filters restart per chunk,
+    and time-based ones (subtitles) shift by CHUNK_START.
+    """
+    def __init__(self, ffmpeg_path="ffmpeg", workers=RENDER_WORKERS):
+        self.ffmpeg_path = ffmpeg_path
+        self.workers = max(1, workers)
+
+    def should_chunk(self, input_path, mode=None):
+        mode = mode or RENDER_CHUNKED
+        if mode == "off" or self.workers < 2:
+            return False
+        if mode == "on":
+            return True
+        try:
+            pts, _ = probe_video_frames(input_path, self.ffmpeg_path)
+        except (subprocess.CalledProcessError, OSError):
+            return False
+        return bool(pts) and pts[-1] - pts[0] >= CHUNKED_MIN_DURATION
+
+    def chunk_command(self, input_path, start, frames, filter_complex, outputs, threads):
+        """
+        One segment: exact keyframe seek, fixed frame count, video only.
+        outputs: [(video_args, chunk_path)] where video_args come from Resizer.output_args
+        with the audio map/codec removed.
+        """
+        cmd = [self.ffmpeg_path, '-y', '-v', 'error', '-ss', f"{start:.6f}", '-i', input_path]
+        if filter_complex:
+            cmd.extend(['-filter_complex', filter_complex.replace(CHUNK_START, f"{start:.6f}")])
+        for video_args, chunk_path in outputs:
+            cmd.extend(video_args)
+            # Same timescale everywhere so the concat demuxer can copy timestamps verbatim
+            cmd.extend(['-frames:v', str(frames), '-threads', str(threads),
+                        '-an', '-video_track_timescale', '90000', chunk_path])
+        return cmd
+
+    def concat_command(self, list_path, audio_source, output_path):
+        return [self.ffmpeg_path, '-y', '-v', 'error',
+                '-f', 'concat', '-safe', '0', '-i', list_path,
+                '-i', audio_source,
+                '-map', '0:v:0', '-map', '1:a?',
+                '-c', 'copy',
+                '-movflags', '+faststart',
+                output_path]
+
+    def render(self, input_path, filter_complex, outputs, audio_source=None):
+        """
+        outputs: {name: (video_args, output_path)}. Every output comes from the same decode
+        of each segment (the split graph keeps working per chunk).
+        Returns {name: output_path}.
+        """
+        pts, keyframes = probe_video_frames(input_path, self.ffmpeg_path)
+        segments = plan_segments(pts, keyframes, self.workers * CHUNKS_PER_WORKER)
+        if not segments:
+            raise ValueError(f"No video frames found in {input_path}")
+        threads = max(1, (os.cpu_count() or self.workers) // min(self.workers, len(segments)))
+        print(f"[ChunkedEncoder] {len(pts)} frames -> {len(segments)} segments on {self.workers} workers")
+
+        work_dir = tempfile.mkdtemp(prefix="chunks_", dir=os.path.dirname(os.path.abspath(
+            next(iter(outputs.values()))[1])))
+        try:
+            commands = []
+            for i, (start, frames) in enumerate(segments):
+                chunk_outputs = [(video_args, os.path.join(work_dir, f"{name.replace(':', 'x')}_{i:04d}.mp4"))
+                                 for name, (video_args, _) in outputs.items()]
+                commands.append(self.chunk_command(input_path, start, frames, filter_complex, chunk_outputs, threads))
+
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                # Each worker just waits on its ffmpeg process; the encoding runs in the children
+                for _ in pool.map(lambda c: subprocess.run(c, check=True), commands):
+                    pass
+
+            for name, (_, output_path) in outputs.items():
+                list_path = os.path.join(work_dir, f"{name.replace(':', 'x')}.txt")
+                with open(list_path, "w", encoding="utf-8") as f:
+                    for i in range(len(segments)):
+                        chunk = os.path.join(work_dir, f"{name.replace(':', 'x')}_{i:04d}.mp4")
+                        f.write(f"file '{chunk}'\n")
+                subprocess.run(self.concat_command(list_path, audio_source or input_path, output_path), check=True)
+            return {name: output_path for name, (_, output_path) in outputs.items()}
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+from services.ffmpeg_handler import ffmpeg_handler
+
+chunked_encoder = ChunkedEncoder(ffmpeg_path=ffmpeg_handler.ffmpeg_path)
@@ -0,0 +1,99 @@
+
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+class ClientPool:
+    """
+    Bounded LRU of SDK clients keyed by a hash of the API key (raw keys are never stored as dict keys).
+    Reusing a client keeps its HTTP connection pool / TLS sessions alive across requests of the
+    same tenant; idle clients expire after idle_ttl seconds and are closed.
+    """
+    def __init__(self, factory, max_size=32, idle_ttl=600.0, name="client"):
+        self.factory = factory
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.name = name
+        self._clients = OrderedDict()  # key_hash -> [client, last_used, active leases, retired]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_hash(api_key):
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+    @contextmanager
+    def lease(self, api_key):
+        """
+        Yields the tenant's client for the duration of one request. Clients evicted or expired
+        while leased are only closed once their last lease ends, so a request is never cut off.
+        """
+        key = self.key_hash(api_key)
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            evicted.extend(self._expire(now))
+            entry = self._clients.get(key)
+            if entry is not None:
+                self._clients.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+                entry = [self.factory(api_key), now, 0, False]
+                self._clients[key] = entry
+                evicted.extend(self._evict())
+            entry[1] = now
+            entry[2] += 1
+        for old in evicted:
+            _close_client(old)
+        try:
+            yield entry[0]
+        finally:
+            with self._lock:
+                entry[1] = time.monotonic()
+                entry[2] -= 1
+                close = entry[3] and entry[2] == 0
+            if close:
+                _close_client(entry[0])
+
+    def _retire(self, key):
+        # Returns the client if it can be closed now; a leased one is closed by its last lease
+        entry = self._clients.pop(key)
+        entry[3] = True
+        return entry[0] if entry[2] == 0 else None
+
+    def _evict(self):
+        keys = list(self._clients)[:max(0, len(self._clients) - self.max_size)]
+        return [c for c in (self._retire(k) for k in keys) if c is not None]
+
+    def _expire(self, now):
+        expired = [k for k, (_, last, refs, _) in self._clients.items() if not refs and now - last > self.idle_ttl]
+        return [self._retire(k) for k in expired]
+
+    def clear(self):
+        with self._lock:
+            clients = [c for c in (self._retire(k) for k in list(self._clients)) if c is not None]
+        for client in clients:
+            _close_client(client)
+
+    def stats(self):
+        return {"name": self.name, "size": len(self._clients), "hits": self.hits, "misses": self.misses}
+
+def _close_client(client):
+    close = getattr(client, "close", None)
+    if not close:
+        return
+    try:
+        result = close()
+        if asyncio.iscoroutine(result):
+            # Async clients: close on the running loop if there is one, otherwise let GC reclaim it
+            try:
+                asyncio.get_running_loop().create_task(result)
+            except RuntimeError:
+                result.close()
+    except Exception as e:
+        print(f"[ClientPool] Error closing client: {e}")
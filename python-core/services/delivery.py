@@ -0,0 +1,157 @@
+
+import os
+import hashlib
+import subprocess
+
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+
+# Base for result/variant URLs handed to clients, e.g. https://cdn.example.com
+# Empty: derived from the request that submitted the task
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "").rstrip("/")
+# Also write HLS (fMP4 segments) next to every MP4 during the final encode
+HLS_PACKAGING = os.getenv("HLS_PACKAGING", "0") == "1"
+HLS_SEGMENT_SECONDS = int(os.getenv("HLS_SEGMENT_SECONDS", "4"))
+
+# Output names are unique per task and never rewritten once complete
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+PLAYLIST_CACHE = "public, max-age=60"
+READ_BLOCK = 256 * 1024
+
+CONTENT_TYPES = {
+    ".mp4": "video/mp4",
+    ".m4s": "video/iso.segment",
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".ts": "video/mp2t",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".webp": "image/webp",
+    ".vtt": "text/vtt",
+    ".ass": "text/x-ssa",
+}
+
+def public_url(relative_path, base_url=None):
+    base = (PUBLIC_BASE_URL or (base_url or "http://localhost:8000")).rstrip("/")
+    return f"{base}/{relative_path.lstrip('/')}"
+
+def hls_dir_for(output_path):
+    return os.path.splitext(output_path)[0] + "_hls"
+
+def _tee_escape(value):
+    # tee slave options are ':'-separated; Windows drive letters and backslashes need care
+    return value.replace("\\", "/").replace(":", "\\:")
+
+def hls_options(hls_dir):
+    return {
+        "f": "hls",
+        "hls_time": str(HLS_SEGMENT_SECONDS),
+        "hls_playlist_type": "vod",
+        "hls_segment_type": "fmp4",
+        "hls_fmp4_init_filename": "init.mp4",
+        "hls_segment_filename": os.path.join(hls_dir, "seg_%05d.m4s"),
+    }
+
+def output_target(output_path, hls=False):
+    """
+    Output arguments for one rendered file. With hls, the tee muxer writes the fast-start MP4
+    and the HLS/fMP4 rendition from the same encoded packets (no second encode).
+    """
+    if not hls:
+        return [output_path]
+    hls_dir = hls_dir_for(output_path)
+    os.makedirs(hls_dir, exist_ok=True)
+    hls_spec = ":".join(f"{k}={_tee_escape(v)}" for k, v in hls_options(hls_dir).items())
+    mp4 = output_path.replace("\\", "/")
+    playlist = os.path.join(hls_dir, "index.m3u8").replace("\\", "/")
+    # Both slaves share the encoder, so it has to emit global headers (avcC/esds) up front
+    return ['-flags', '+global_header', '-f', 'tee',
+            f"[f=mp4:movflags=+faststart]{mp4}|[{hls_spec}]{playlist}"]
+
+def package_hls_command(mp4_path, ffmpeg_path="ffmpeg"):
+    """Stream-copy remux of a finished MP4 into HLS/fMP4 (used where tee can't be, e.g. chunked renders)."""
+    hls_dir = hls_dir_for(mp4_path)
+    os.makedirs(hls_dir, exist_ok=True)
+    cmd = [ffmpeg_path, '-y', '-v', 'error', '-i', mp4_path, '-map', '0', '-c', 'copy']
+    for key, value in hls_options(hls_dir).items():
+        cmd.extend([f'-{key}', value])
+    cmd.append(os.path.join(hls_dir, "index.m3u8"))
+    return cmd
+
+def package_hls(mp4_path, ffmpeg_path="ffmpeg"):
+    subprocess.run(package_hls_command(mp4_path, ffmpeg_path), check=True)
+    return os.path.join(hls_dir_for(mp4_path), "index.m3u8")
+
+def etag_for(stat):
+    # Weak validators are enough here: outputs are immutable once renamed into place
+    token = f"{stat.st_size}-{stat.st_mtime_ns}".encode("utf-8")
+    return f'W/"{hashlib.sha1(token).hexdigest()[:16]}"'
+
+def parse_range(header, size):
+    """Single 'bytes=a-b' / 'bytes=a-' / 'bytes=-n' range -> (start, end) inclusive, or None."""
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_s, _, end_s = header[6:].strip().partition("-")
+    try:
+        if start_s == "":
+            length = int(end_s)
+            if length <= 0:
+                raise ValueError
+            return max(0, size - length), size - 1
+        start = int(start_s)
+        end = min(int(end_s), size - 1) if end_s else size - 1
+    except ValueError:
+        raise HTTPException(status_code=416, detail="Invalid range", headers={"Content-Range": f"bytes */{size}"})
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+def _iter_file(path, start, length):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            block = f.read(min(READ_BLOCK, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+
+def file_response(request, root, relative_path):
+    """
+    Serves root/relative_path with byte ranges, ETag/If-None-Match and long-lived cache headers,
+    so players can start from the moov atom and seek without downloading the whole file.
+    """
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, relative_path))
+    if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Not found")
+
+    stat = os.stat(path)
+    ext = os.path.splitext(path)[1].lower()
+    etag = etag_for(stat)
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": PLAYLIST_CACHE if ext == ".m3u8" else IMMUTABLE_CACHE,
+    }
+    media_type = CONTENT_TYPES.get(ext, "application/octet-stream")
+
+    if etag in [t.strip() for t in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    size = stat.st_size
+    byte_range = None
+    if_range = request.headers.get("if-range")
+    if not if_range or if_range == etag:
+        byte_range = parse_range(request.headers.get("range"), size)
+    if byte_range is None:
+        start, end, status = 0, size - 1, 200
+    else:
+        (start, end), status = byte_range, 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    length = end - start + 1 if size else 0
+    headers["Content-Length"] = str(length)
+
+    if request.method == "HEAD":
+        return Response(status_code=status, headers=headers, media_type=media_type)
+    return StreamingResponse(_iter_file(path, start, length), status_code=status,
+                             headers=headers, media_type=media_type)
@@ -0,0 +1,151 @@
+
+import os
+import math
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+from services.ffmpeg_handler import ffmpeg_handler
+
+# Video: poster frame + scrubbing sprite sheets (tiles of TILE_COLS x TILE_ROWS thumbnails)
+POSTER_WIDTH = int(os.getenv("POSTER_WIDTH", "640"))
+SPRITE_INTERVAL = float(os.getenv("SPRITE_INTERVAL", "2"))
+SPRITE_MAX_THUMBS = int(os.getenv("SPRITE_MAX_THUMBS", "300"))
+THUMB_WIDTH, THUMB_HEIGHT = 160, 90
+TILE_COLS, TILE_ROWS = 10, 10
+
+# Images: small WebP thumbnails next to every generated image
+IMAGE_THUMB_WIDTH = int(os.getenv("IMAGE_THUMB_WIDTH", "320"))
+IMAGE_THUMB_QUALITY = int(os.getenv("IMAGE_THUMB_QUALITY", "75"))
+IMAGE_THUMB_WORKERS = int(os.getenv("IMAGE_THUMB_WORKERS", str(min(4, os.cpu_count() or 1))))
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp"}
+THUMB_SUFFIX = "_thumb.webp"
+
+def derivatives_dir_for(output_path):
+    return os.path.splitext(output_path)[0] + "_thumbs"
+
+def _vtt_time(seconds):
+    h, rem = divmod(seconds, 3600)
+    m, s = divmod(rem, 60)
+    return f"{int(h):02d}:{int(m):02d}:{s:06.3f}"
+
+class VideoDerivatives:
+    """
+    Poster + sprite sheets tapped off a render's filter graph, so they come from the frames the
+    encoder is already decoding instead of a second pass over the finished file.
+    """
+    def plan(self, duration):
+        interval = max(SPRITE_INTERVAL, duration / SPRITE_MAX_THUMBS) if duration else SPRITE_INTERVAL
+        # Rounded once so the fps filter and the VTT cue times use the exact same step
+        interval = round(interval, 3)
+        return {
+            "interval": interval,
+            "poster_t": min(duration * 0.1, 5.0) if duration else 0.0,
+            "count": max(1, math.ceil(duration / interval)) if duration else 1,
+        }
+
+    def graph(self, in_label, plan, tag="d", kinds=("poster", "sprite")):
+        """
+        Splits [in_label] into an encode branch plus a branch per kind ("poster", "sprite").
+        Returns (filter fragment, label to encode, {kind: label}).
+        """
+        branches = {
+            "poster": f"select='gte(t,{plan['poster_t']:.3f})',trim=end_frame=1,scale={POSTER_WIDTH}:-2",
+            "sprite": (f"fps=1/{plan['interval']:.3f},"
+                       f"scale={THUMB_WIDTH}:{THUMB_HEIGHT}:force_original_aspect_ratio=decrease,"
+                       f"pad={THUMB_WIDTH}:{THUMB_HEIGHT}:(ow-iw)/2:(oh-ih)/2,"
+                       f"tile={TILE_COLS}x{TILE_ROWS}"),
+        }
+        parts = [f"[{in_label}]split={len(kinds) + 1}[{tag}_enc]" + "".join(f"[{tag}_{k}_in]" for k in kinds)]
+        parts += [f"[{tag}_{k}_in]{branches[k]}[{tag}_{k}]" for k in kinds]
+        return ";".join(parts), f"{tag}_enc", {k: f"{tag}_{k}" for k in kinds}
+
+    def output_args(self, labels, out_dir):
+        """
+        Outputs for the labels graph() returned. The poster is one declared file; the sprite sheets
+        are an image2 pattern under out_dir, so they can only be tapped where out_dir is reachable.
+        """
+        os.makedirs(out_dir, exist_ok=True)
+        args = []
+        if "poster" in labels:
+            args += ['-map', f"[{labels['poster']}]", '-frames:v', '1', '-update', '1', '-q:v', '3',
+                     os.path.join(out_dir, "poster.jpg")]
+        if "sprite" in labels:
+            args += ['-map', f"[{labels['sprite']}]", '-q:v', '5', '-f', 'image2',
+                     os.path.join(out_dir, "sprite_%03d.jpg")]
+        return args
+
+    def write_vtt(self, out_dir, plan, duration):
+        """WebVTT index mapping each interval to its tile (sprite_NNN.jpg#xywh=...), the format players expect."""
+        per_sheet = TILE_COLS * TILE_ROWS
+        lines = ["WEBVTT", ""]
+        for i in range(plan["count"]):
+            start = i * plan["interval"]
+            end = min(duration, start + plan["interval"]) if duration else start + plan["interval"]
+            sheet, cell = divmod(i, per_sheet)
+            row, col = divmod(cell, TILE_COLS)
+            lines.append(f"{_vtt_time(start)} --> {_vtt_time(end)}")
+            lines.append(f"sprite_{sheet + 1:03d}.jpg#xywh={col * THUMB_WIDTH},{row * THUMB_HEIGHT},{THUMB_WIDTH},{THUMB_HEIGHT}")
+            lines.append("")
+        path = os.path.join(out_dir, "sprites.vtt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines))
+        return path
+
+    def extract_command(self, video_path, out_dir, plan, ffmpeg_path="ffmpeg", kinds=("poster", "sprite")):
+        """Standalone pass for files whose render couldn't be tapped (e.g. chunked renders)."""
+        fragment, enc_label, labels = self.graph("0:v", plan, kinds=kinds)
+        cmd = [ffmpeg_path, '-y', '-v', 'error', '-i', video_path,
+               '-filter_complex', fragment + f";[{enc_label}]nullsink"]
+        return cmd + self.output_args(labels, out_dir)
+
+def make_image_thumbnail(image_path, width=IMAGE_THUMB_WIDTH, quality=IMAGE_THUMB_QUALITY):
+    """Process-pool worker: image -> {stem}_thumb.webp. Pillow when installed, ffmpeg otherwise."""
+    thumb_path = os.path.splitext(image_path)[0] + THUMB_SUFFIX
+    try:
+        from PIL import Image
+    except ImportError:
+        subprocess.run([ffmpeg_handler.ffmpeg_path, '-y', '-v', 'error', '-i', image_path,
+                        '-vf', f"scale='min({width},iw)':-2", '-c:v', 'libwebp', '-quality', str(quality),
+                        thumb_path], check=True)
+        return thumb_path
+    with Image.open(image_path) as img:
+        img.thumbnail((width, width * 4))
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+        img.save(thumb_path, "WEBP", quality=quality, method=4)
+    return thumb_path
+
+class ImageDerivatives:
+    """WebP thumbnails produced in a process pool (decode/resize/encode is CPU-bound)."""
+    def __init__(self, workers=IMAGE_THUMB_WORKERS):
+        self.workers = max(1, workers)
+        self._pool = None
+
+    def _executor(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def submit(self, image_path):
+        """Returns a concurrent.futures.Future resolving to the thumbnail path."""
+        return self._executor().submit(make_image_thumbnail, image_path)
+
+    def backfill(self, directory):
+        """Queues thumbnails for every image in directory that doesn't have one yet."""
+        futures = []
+        for name in sorted(os.listdir(directory)):
+            path = os.path.join(directory, name)
+            stem, ext = os.path.splitext(path)
+            if ext.lower() not in IMAGE_EXTENSIONS or name.endswith(THUMB_SUFFIX):
+                continue
+            if not os.path.exists(stem + THUMB_SUFFIX):
+                futures.append(self.submit(path))
+        return futures
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+video_derivatives = VideoDerivatives()
+image_derivatives = ImageDerivatives()
@@ -1,85 +1,197 @@
-import pandas as pd
 import json
 import os
+import csv
+import codecs
 
-def parse_storyboard(file_path):
+CSV_EXTENSIONS = (".csv", ".tsv", ".txt")
+KEY_COLUMNS = ("id", "scene id", "scene_id", "sceneid", "key", "씬번호", "장면번호")
+
+def _detect_columns(headers):
     """
-    Parses the Excel storyboard and returns a list of scene objects.
+    Maps header names to column indexes.
     Expected columns: 'Timecode', 'Content' (or '주요 내용'), 'Whisk Prompt'
+    Optional: 'ID' / 'Scene ID' / '씬 번호' as a stable key for re-imports.
     """
+    prompt_col = None
+    content_col = None
+    time_col = None
+    key_col = None
+
+    for i, col in enumerate(headers):
+        if col.lower() in KEY_COLUMNS or col.replace(" ", "") in KEY_COLUMNS:
+            key_col = i
+        elif "prompt" in col.lower() and "whisk" in col.lower():
+            prompt_col = i
+        elif "content" in col.lower() or "내용" in col:
+            content_col = i
+        elif "time" in col.lower() or "시간" in col:
+            time_col = i
+
+    return prompt_col, content_col, time_col, key_col
+
+def _cell(row, col):
+    if col is None or col >= len(row):
+        return None
+    value = row[col]
+    if value is None:
+        return None
+    value = str(value)
+    return value if value.strip() else None
+
+def _sniff_encoding(file_path):
+    # Excel on Korean Windows saves CSV as cp949; everything else we see is UTF-8 (often with BOM)
+    with open(file_path, "rb") as f:
+        head = f.read(64 * 1024)
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+        return "utf-8-sig"
+    except UnicodeDecodeError:
+        return "cp949"
+
+def _iter_csv_sheets(file_path):
+    encoding = _sniff_encoding(file_path)
+    f = open(file_path, "r", encoding=encoding, newline="")
     try:
-        df = pd.read_excel(file_path)
-        
-        # Normalize column names (strip whitespace, lower case match)
-        df.columns = [str(c).strip() for c in df.columns]
-        
-        # Identify critical columns
-        prompt_col = None
-        content_col = None
-        time_col = None
-        
-        for col in df.columns:
-            if "prompt" in col.lower() and "whisk" in col.lower():
-                prompt_col = col
-            elif "content" in col.lower() or "내용" in col:
-                content_col = col
-            elif "time" in col.lower() or "시간" in col:
-                time_col = col
-        
-        if not prompt_col:
-            raise ValueError(f"Could not find 'Whisk Prompt' column in {df.columns}")
-            
-        scenes = []
-        for idx, row in df.iterrows():
-            prompt = str(row[prompt_col]) if pd.notna(row[prompt_col]) else ""
-            content = str(row[content_col]) if content_col and pd.notna(row[content_col]) else ""
-            timecode = str(row[time_col]) if time_col and pd.notna(row[time_col]) else f"{idx}"
-            
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",\t;")
+        except csv.Error:
+            dialect = csv.excel
+        yield os.path.splitext(os.path.basename(file_path))[0], csv.reader(f, dialect)
+    finally:
+        f.close()
+
+def _iter_excel_sheets(file_path, sheets=None):
+    from openpyxl import load_workbook
+
+    # read_only streams rows from the sheet XML instead of building the whole workbook.
+    # Opened as a file object so extension-less paths (media store blobs) are accepted.
+    f = open(file_path, "rb")
+    wb = load_workbook(f, read_only=True, data_only=True)
+    try:
+        names = wb.sheetnames if sheets is None else [s for s in wb.sheetnames if s in sheets]
+        for name in names:
+            yield name, wb[name].iter_rows(values_only=True)
+    finally:
+        wb.close()
+        f.close()
+
+def iter_storyboard(file_path, sheets=None, fmt=None):
+    """
+    Streams scene objects from an Excel (.xlsx) or CSV storyboard.
+    Rows are yielded as soon as they are read, so consumers can start
+    generating on row 1 while the rest of the file is still being parsed.
+    sheets: None = every sheet that has a 'Whisk Prompt' column, or a list of sheet names.
+    fmt: "csv" or "xlsx" to override detection by file extension.
+    """
+    is_csv = fmt == "csv" if fmt else file_path.lower().endswith(CSV_EXTENSIONS)
+    sheet_iter = _iter_csv_sheets(file_path) if is_csv else _iter_excel_sheets(file_path, sheets)
+
+    found_prompt = False
+    index = 0
+    for sheet_name, rows in sheet_iter:
+        header = next(rows, None)
+        if header is None:
+            continue
+        headers = [str(c).strip() if c is not None else "" for c in header]
+        prompt_col, content_col, time_col, key_col = _detect_columns(headers)
+
+        if prompt_col is None:
+            if sheets is not None:
+                raise ValueError(f"Could not find 'Whisk Prompt' column in sheet '{sheet_name}': {headers}")
+            continue
+        found_prompt = True
+
+        for idx, row in enumerate(rows):
+            index += 1
+            prompt = _cell(row, prompt_col) or ""
+            content = _cell(row, content_col) or ""
+            timecode = _cell(row, time_col) or f"{idx}"
+
             if not prompt.strip():
                 continue
-                
-            scenes.append({
-                "id": f"scene_{idx+1}",
-                "index": idx + 1,
+
+            scene = {
+                "id": f"scene_{index}",
+                "index": index,
                 "timecode": timecode,
                 "content": content,
                 "prompt": prompt,
+                "sheet": sheet_name,
                 "status": "pending"
-            })
-            
-        return scenes
-        
+            }
+            key = _cell(row, key_col)
+            if key:
+                scene["key"] = key.strip()
+            yield scene
+
+    if not found_prompt:
+        raise ValueError(f"Could not find 'Whisk Prompt' column in {file_path}")
+
+def parse_storyboard(file_path, sheets=None):
+    """
+    Parses the storyboard and returns a list of scene objects.
+    Kept for callers that need the full list; prefer iter_storyboard for large sheets.
+    """
+    try:
+        return list(iter_storyboard(file_path, sheets=sheets))
     except Exception as e:
         print(f"Excel parsing error: {e}")
         return []
 
 import sys
+import argparse
+
+def _write_test_storyboard(test_path):
+    from openpyxl import Workbook
+
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["Timecode", "주요 내용", "Whisk Prompt (영문)"])
+    ws.append(["00:00:00", "Intro", "A cat on a roof"])
+    ws.append(["00:00:05", "Action", "A dog in a park"])
+    wb.save(test_path)
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
+    parser = argparse.ArgumentParser(description='Parse a storyboard (xlsx/csv) into scenes')
+    parser.add_argument('file_path', nargs='?', help='Storyboard file (.xlsx or .csv)')
+    parser.add_argument('--sheet', action='append', help='Sheet name to read (repeatable, default: all)')
+    parser.add_argument('--ndjson', action='store_true', help='Emit one scene per line as rows are parsed')
+    parser.add_argument('--incremental', metavar='STORYBOARD_ID', help='Diff against the last import of this storyboard')
+    args = parser.parse_args()
+
+    if args.file_path:
         # CLI Mode (Production)
-        file_path = sys.argv[1]
-        if not os.path.exists(file_path):
+        if not os.path.exists(args.file_path):
             print(json.dumps({"error": "File not found"}))
             sys.exit(1)
-            
-        scenes = parse_storyboard(file_path)
-        print(json.dumps(scenes, ensure_ascii=False))
+
+        if args.incremental:
+            sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            from services.storyboard_diff import storyboard_diff
+
+            scenes = parse_storyboard(args.file_path, sheets=args.sheet)
+            print(json.dumps(storyboard_diff.reimport(args.incremental, scenes), ensure_ascii=False))
+        elif args.ndjson:
+            try:
+                for scene in iter_storyboard(args.file_path, sheets=args.sheet):
+                    print(json.dumps(scene, ensure_ascii=False), flush=True)
+            except Exception as e:
+                print(json.dumps({"error": str(e)}, ensure_ascii=False))
+                sys.exit(1)
+        else:
+            scenes = parse_storyboard(args.file_path, sheets=args.sheet)
+            print(json.dumps(scenes, ensure_ascii=False))
     else:
         # Test Mode
-        dummy_data = {
-        "Timecode": ["00:00:00", "00:00:05"],
-        "주요 내용": ["Intro", "Action"],
-        "Whisk Prompt (영문)": ["A cat on a roof", "A dog in a park"]
-    }
-    df = pd.DataFrame(dummy_data)
-    test_path = "test_storyboard.xlsx"
-    df.to_excel(test_path, index=False)
-    
-    print("Testing parser...")
-    scenes = parse_storyboard(test_path)
-    print(json.dumps(scenes, indent=2, ensure_ascii=False))
-    
-    # Cleanup
-    if os.path.exists(test_path):
-        os.remove(test_path)
+        test_path = "test_storyboard.xlsx"
+        _write_test_storyboard(test_path)
+
+        print("Testing parser...")
+        scenes = parse_storyboard(test_path)
+        print(json.dumps(scenes, indent=2, ensure_ascii=False))
+
+        # Cleanup
+        if os.path.exists(test_path):
+            os.remove(test_path)
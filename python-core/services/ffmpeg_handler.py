@@ -1,7 +1,6 @@
 
 import os
 import subprocess
-import ffmpeg
 
 class FFmpegHandler:
     def __init__(self):
@@ -16,6 +15,7 @@ class FFmpegHandler:
         return "ffmpeg" # Fallback to system path
 
     def get_metadata(self, input_path):
+        import ffmpeg  # ffmpeg-python, deferred to keep server start fast
         try:
             probe = ffmpeg.probe(input_path, cmd=self.ffmpeg_path.replace('ffmpeg.exe', 'ffprobe.exe'))
             return probe
@@ -35,4 +35,32 @@ class FFmpegHandler:
         ]
         subprocess.run(cmd, check=True)
 
+    def stream_audio(self, input_path, sample_rate=16000, block_size=64 * 1024):
+        """
+        Decodes the first audio stream to mono s16le PCM on ffmpeg's stdout and yields it
+        in blocks, so consumers (STT uploader, silence analysis) never need an intermediate WAV.
+        """
+        cmd = [
+            self.ffmpeg_path, '-v', 'error',
+            '-i', input_path,
+            '-map', '0:a:0',
+            '-ar', str(sample_rate),
+            '-ac', '1',
+            '-f', 's16le', 'pipe:1'
+        ]
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            while True:
+                block = proc.stdout.read(block_size)
+                if not block:
+                    break
+                yield block
+            stderr = proc.stderr.read()
+            if proc.wait() != 0:
+                raise subprocess.CalledProcessError(proc.returncode, cmd, stderr=stderr)
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+
 ffmpeg_handler = FFmpegHandler()
@@ -39,6 +39,8 @@ class FingerprintBreaker:
         return {
             "speed_factor": seed,
             "video_filter": f"{eq_filter}",
+            # Grain generator alone, for graphs that feed it from their own (e.g. pre-scaled) input
+            "noise_filter": f"{noise_gen},{noise_clump},{noise_format},{noise_transparent}",
             "noise_filter_complex": f"{noise_gen},{noise_clump},{noise_format},{noise_transparent}[noise];[0:v][noise]overlay=shortest=1[outv]"
         }
 
@@ -9,6 +9,10 @@ import time
 import uuid
 import shutil
 
+# Allow `services.*` imports when run as a standalone script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.media_store import media_store
+
 # Re-use the robust path finding logic
 def find_chrome_path():
     paths = [
@@ -629,8 +633,8 @@ async def harvest_whisk_credits_and_token(prompt, cookies_path, output_dir, coun
                 filename = f"whisk_{uuid.uuid4()}.{ext}"
                 filepath = os.path.join(output_dir, filename)
                 
-                with open(filepath, "wb") as f:
-                    f.write(data)
+                # Dedup identical generations: blob is stored once, filepath is a link to it
+                media_store.store_as(data, filepath)
                 
                 saved_files.append(f"/uploads/{filename}")
             
@@ -7,6 +7,10 @@ import time
 import argparse
 from datetime import datetime
 
+# Allow `services.*` imports when run as a standalone script
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from services.media_store import media_store
+
 # Setup encoding for console output (both stdout and stderr)
 sys.stdout.reconfigure(encoding='utf-8', errors='replace')
 sys.stderr.reconfigure(encoding='utf-8', errors='replace')
@@ -112,8 +116,7 @@ def generate_image_api(prompt, output_dir, credentials_path, **kwargs):
             
         filepath = os.path.join(output_dir, filename)
         
-        with open(filepath, "wb") as f:
-            f.write(base64.b64decode(b64_data))
+        media_store.store_as(base64.b64decode(b64_data), filepath)
             
         # Success Output
         print(json.dumps({
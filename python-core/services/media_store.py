@@ -0,0 +1,317 @@
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from services.metrics import cache_result
+
+# FICLONE ioctl (Linux btrfs/xfs reflink). Other platforms fall back to hardlink/copy.
+FICLONE = 0x40049409
+
+class MediaStore:
+    """
+    Content-addressed blob store (sha256 -> file) with reference counting.
+    Layout:
+        <root>/objects/ab/abcdef...       (immutable blobs, extension kept in the index)
+        <root>/index.json                 ({digest: {"size", "ext", "refs": [owner, ...]}})
+    Refs are kept as a set of owners (materialized paths, node cache keys, task ids),
+    so re-registering the same owner is idempotent. A blob is deleted as soon as its last
+    ref is released; gc() additionally drops refs whose path disappeared out-of-band.
+    Every step that checks, writes, links or deletes a blob runs under the index lock.
+    """
+    def __init__(self, root=None):
+        self.root = root or os.getenv(
+            "MEDIA_STORE_DIR",
+            os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "media_store")
+        )
+        self.objects_dir = os.path.join(self.root, "objects")
+        self.index_path = os.path.join(self.root, "index.json")
+        self.lock_path = os.path.join(self.root, "index.lock")
+        self._lock = threading.Lock()
+        self.collected_bytes = 0
+
+    # --- Index ---
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"[MediaStore] Index unreadable, starting fresh: {e}")
+            return {}
+
+    def _save_index(self, index):
+        # Atomic replace so concurrent generator processes never see a half-written index
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".json.tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+
+    @contextmanager
+    def _index_lock(self):
+        """
+        Exclusive lock across processes (Whisk generator subprocesses write the index too), plus
+        the thread lock, since POSIX file locks are per process and don't exclude our own threads.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock, open(self.lock_path, "a+b") as f:
+            if os.name == "nt":
+                import msvcrt
+                f.seek(0)
+                # LK_LOCK retries for ~10 s before raising; keep waiting like flock does
+                while True:
+                    try:
+                        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        continue
+                try:
+                    yield
+                finally:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _update_index(self, fn):
+        with self._index_lock():
+            index = self._load_index()
+            result = fn(index)
+            self._save_index(index)
+            return result
+
+    # --- Blobs ---
+    def object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def path_for(self, digest):
+        entry = self._load_index().get(digest)
+        if not entry:
+            return None
+        return self.object_path(digest)
+
+    @staticmethod
+    def _add(index, digest, size, ext, owner):
+        entry = index.get(digest)
+        if entry is None:
+            if size is None:
+                raise KeyError(f"Unknown media digest: {digest}")
+            entry = index[digest] = {"size": size, "ext": ext, "refs": []}
+        if owner and owner not in entry["refs"]:
+            entry["refs"].append(owner)
+        return entry
+
+    def _register(self, digest, size, ext, owner):
+        return self._update_index(lambda index: self._add(index, digest, size, ext, owner))
+
+    def _commit(self, digest, size, ext, owner, place):
+        """
+        Registers a hashed blob; place(obj_path) writes it only if the object is missing. Checking
+        and registering under one lock keeps a concurrent release/gc from deleting it in between.
+        """
+        obj_path = self.object_path(digest)
+
+        def apply(index):
+            hit = os.path.exists(obj_path)
+            cache_result("media_store", hit)
+            if not hit:
+                os.makedirs(os.path.dirname(obj_path), exist_ok=True)
+                place(obj_path)
+            self._add(index, digest, size, ext, owner)
+            return hit
+        return self._update_index(apply)
+
+    def put_bytes(self, data, ext="", owner=None):
+        """Store bytes, return digest. Identical content is written only once."""
+        digest = hashlib.sha256(data).hexdigest()
+
+        def place(obj_path):
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(obj_path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, obj_path)
+        self._commit(digest, len(data), ext, owner, place)
+        return digest
+
+    def put_stream(self, stream, ext="", owner=None, chunk_size=1024 * 1024):
+        """Store a file-like object without holding it in memory, return digest."""
+        hasher = hashlib.sha256()
+        size = 0
+        os.makedirs(self.objects_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.objects_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                while True:
+                    chunk = stream.read(chunk_size)
+                    if not chunk:
+                        break
+                    hasher.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            digest = hasher.hexdigest()
+            self._commit(digest, size, ext, owner, lambda obj_path: os.replace(tmp_path, obj_path))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return digest
+
+    def put_file(self, path, owner=None):
+        ext = os.path.splitext(path)[1].lower()
+        with open(path, "rb") as f:
+            return self.put_stream(f, ext=ext, owner=owner)
+
+    def read_bytes(self, digest):
+        path = self.path_for(digest)
+        if not path:
+            raise KeyError(f"Unknown media digest: {digest}")
+        with open(path, "rb") as f:
+            return f.read()
+
+    # --- Materialization ---
+    def materialize(self, digest, dest_path):
+        """
+        Expose a blob at a real path (hardlink -> reflink -> copy) and count it as a reference.
+        Blobs are immutable, so consumers must not write into materialized paths in place.
+        """
+        src = self.object_path(digest)
+        dest_path = os.path.abspath(dest_path)
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+
+        def apply(index):
+            if digest not in index or not os.path.exists(src):
+                raise KeyError(f"Unknown media digest: {digest}")
+            # Overwriting a previously materialized path drops its old reference (a ref the
+            # path already holds on this digest is kept, so the blob can't be collected here)
+            replaced = [d for d, e in index.items() if d != digest and dest_path in e["refs"]]
+            for d in replaced:
+                index[d]["refs"].remove(dest_path)
+            if os.path.lexists(dest_path):
+                os.remove(dest_path)
+            method = self._link(src, dest_path)
+            self._add(index, digest, None, None, dest_path)
+            self._collect(index, replaced)
+            return method
+        return self._update_index(apply)
+
+    def _link(self, src, dest):
+        try:
+            os.link(src, dest)
+            return "hardlink"
+        except OSError:
+            pass
+        try:
+            import fcntl
+            with open(src, "rb") as fsrc, open(dest, "wb") as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return "reflink"
+        except (ImportError, OSError):
+            if os.path.exists(dest):
+                os.remove(dest)
+        shutil.copyfile(src, dest)
+        return "copy"
+
+    def store_as(self, data, dest_path, owner=None):
+        """Convenience for generators: put bytes and materialize them at dest_path."""
+        ext = os.path.splitext(dest_path)[1].lower()
+        digest = self.put_bytes(data, ext=ext, owner=owner or os.path.abspath(dest_path))
+        self.materialize(digest, dest_path)
+        return digest
+
+    def import_path(self, path):
+        """Move an existing file into the store and replace it with a link to the blob."""
+        digest = self.put_file(path, owner=os.path.abspath(path))
+        self.materialize(digest, path)
+        return digest
+
+    # --- Refcounting ---
+    def add_ref(self, digest, owner):
+        self._register(digest, None, None, owner)
+
+    def release(self, digest, owner):
+        """Drop one reference; the blob is deleted with its last one. Returns the refs left."""
+        def apply(index):
+            entry = index.get(digest)
+            if not entry:
+                return 0
+            if owner in entry["refs"]:
+                entry["refs"].remove(owner)
+                self._collect(index, [digest])
+            return len(entry["refs"])
+        return self._update_index(apply)
+
+    def release_owner(self, owner):
+        """Drop every reference held by an owner, return the released digests."""
+        def apply(index):
+            released = []
+            for digest, entry in index.items():
+                if owner in entry["refs"]:
+                    entry["refs"].remove(owner)
+                    released.append(digest)
+            self._collect(index, released)
+            return released
+        return self._update_index(apply)
+
+    def _collect(self, index, digests):
+        """Deletes the blobs among digests that have no refs left (caller holds the index lock)."""
+        freed = 0
+        for digest in digests:
+            entry = index.get(digest)
+            if entry is None or entry["refs"]:
+                continue
+            obj_path = self.object_path(digest)
+            if os.path.exists(obj_path):
+                freed += os.path.getsize(obj_path)
+                os.remove(obj_path)
+            del index[digest]
+        self.collected_bytes += freed
+        return freed
+
+    def release_path(self, path):
+        """Drop every reference held by a materialized path (and remove the path)."""
+        path = os.path.abspath(path)
+        released = self.release_owner(path)
+        if os.path.lexists(path):
+            os.remove(path)
+        return released
+
+    def gc(self):
+        """
+        Delete blobs nobody references. Materialized paths that were deleted
+        out-of-band are dropped first, so stale refs don't pin blobs forever.
+        Returns bytes freed.
+        """
+        def apply(index):
+            for entry in index.values():
+                entry["refs"] = [r for r in entry["refs"] if not self._is_stale(r)]
+            return self._collect(index, list(index))
+        freed = self._update_index(apply)
+        print(f"[MediaStore] GC freed {freed / (1024 * 1024):.1f} MB")
+        return freed
+
+    def _is_stale(self, owner):
+        # Path owners ("/x/y.png", or "/x/y.zip::member" style) die with their file
+        path = owner.split("::", 1)[0]
+        return os.path.isabs(path) and not os.path.lexists(path)
+
+    def stats(self):
+        index = self._load_index()
+        stored = sum(e.get("size") or 0 for e in index.values())
+        logical = sum((e.get("size") or 0) * max(len(e["refs"]), 1) for e in index.values())
+        return {
+            "objects": len(index),
+            "stored_bytes": stored,
+            "logical_bytes": logical,
+            "saved_bytes": logical - stored
+        }
+
+media_store = MediaStore()
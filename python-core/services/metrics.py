@@ -0,0 +1,198 @@
+
+import time
+import threading
+from contextlib import contextmanager
+
+# Stage latencies range from sub-second (translation) to tens of minutes (long renders)
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self.values.items())
+        return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in items]
+
+class Gauge(_Metric):
+    """Set directly, or computed at scrape time from a callback returning {label tuple: value}."""
+    kind = "gauge"
+
+    def __init__(self, *args, callback=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values = {}
+        self.callback = callback
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track_inprogress(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def render(self):
+        if self.callback is not None:
+            try:
+                items = sorted((tuple(str(v) for v in k), val) for k, val in self.callback().items())
+            except Exception as e:
+                print(f"[Metrics] Gauge {self.name} callback failed: {e}")
+                items = []
+        else:
+            with self._lock:
+                items = sorted(self.values.items())
+        return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in items]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets=DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self.series = {}  # label tuple -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self.series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self.series.items())
+        lines = self.header()
+        for key, series in items:
+            for bound, count in zip(self.buckets, series):
+                le = f'le="{_number(bound) if bound == float("inf") else bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [le])} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {round(series[-2], 6)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+class MetricsRegistry:
+    """
+    In-process metrics with Prometheus text exposition (format 0.0.4), so /metrics can be
+    scraped without adding a client library. Metric objects are thread-safe: stages run
+    in asyncio.to_thread workers as well as on the event loop.
+    """
+    def __init__(self):
+        self.metrics = {}
+
+    def _add(self, metric):
+        existing = self.metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._add(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=(), callback=None):
+        return self._add(Gauge(name, help_text, labelnames, callback=callback))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help_text, labelnames, buckets=buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+
+STAGE_SECONDS = metrics.histogram("gvva_stage_seconds", "Wall time of pipeline stages", ("stage",))
+STAGE_FAILURES = metrics.counter("gvva_stage_failures_total", "Pipeline stages that raised", ("stage",))
+CACHE_REQUESTS = metrics.counter("gvva_cache_requests_total", "Cache lookups by cache and result (hit/miss)",
+                                 ("cache", "result"))
+FALLBACKS = metrics.counter("gvva_fallbacks_total", "Fallbacks to a slower path (e.g. Whisk API -> DOM)",
+                            ("component", "reason"))
+
+# listener(stage, started) is called around every timed() block (e.g. bench_pipeline.py's resource probe)
+STAGE_LISTENERS = []
+
+def _notify(stage, started):
+    for listener in STAGE_LISTENERS:
+        try:
+            listener(stage, started)
+        except Exception as e:
+            print(f"[Metrics] Stage listener failed: {e}")
+
+@contextmanager
+def timed(stage, timings=None):
+    """
+    Times a block into gvva_stage_seconds{stage}; with timings (a task's "stages" dict) the
+    seconds are also added to the task record. Failed stages count in gvva_stage_failures_total.
+    """
+    _notify(stage, True)
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_FAILURES.inc(stage=stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        if timings is not None:
+            timings[stage] = round(timings.get(stage, 0.0) + elapsed, 3)
+        _notify(stage, False)
+
+def cache_result(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
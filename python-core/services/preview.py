@@ -0,0 +1,43 @@
+
+import os
+
+from services.resizer import resizer
+from services.sync_logic import sync_logic
+
+# "off": full render only; "background": preview first, then the full render right away;
+# "approval": preview, then wait for /api/tasks/{id}/approve before spending full render CPU
+PREVIEW_MODE = os.getenv("PREVIEW_MODE", "off")
+PREVIEW_MODES = ("off", "background", "approval")
+PREVIEW_HEIGHT = int(os.getenv("PREVIEW_HEIGHT", "360"))
+
+# Small and fast to produce: quality only has to be good enough to judge timing and content
+PREVIEW_PROFILE = {
+    "c:v": "libx264", "preset": "ultrafast", "crf": "32",
+    "maxrate": "600k", "bufsize": "1200k",
+    "c:a": "aac", "b:a": "64k",
+    "movflags": "+faststart",
+}
+
+def preview_command(video_path, audio_path, output_path, fmt, filter_data, ffmpeg_path="ffmpeg", sync=None):
+    """
+    One ffmpeg pass from the original upload + TTS audio to a low-res proxy of the final video:
+    the sync decision (as filters), the same grain/grade chain and the same variant graph,
+    all at PREVIEW_HEIGHT. Scaling first keeps every later filter cheap.
+    """
+    sync = sync or sync_logic.sync_filters(video_path, audio_path, ffmpeg_path)
+    scale = PREVIEW_HEIGHT / 1080
+    fps = resizer.probe_fps(video_path, ffmpeg_path)
+    variant_graph, labels = resizer.split_graph([fmt], in_label="outv", fps=fps, scale=scale)
+    graph = (
+        f"[0:v]{sync['video']},scale=-2:'min(ih,{PREVIEW_HEIGHT})',split[pv_a][pv_b];"
+        f"[pv_a]{filter_data['noise_filter']}[noise];"
+        f"[pv_b][noise]overlay=shortest=1[outv];"
+        f"{variant_graph};"
+        f"[1:a]{sync['audio']}[aout]"
+    )
+    cmd = [ffmpeg_path, '-y', '-i', video_path, '-i', audio_path, '-filter_complex', graph]
+    cmd.extend(resizer.output_args(fmt, labels[fmt], audio_map='[aout]', profile=PREVIEW_PROFILE))
+    if sync["shortest"]:
+        cmd.append('-shortest')
+    cmd.append(output_path)
+    return cmd
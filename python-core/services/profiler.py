@@ -0,0 +1,289 @@
+
+import os
+import re
+import sys
+import json
+import time
+import threading
+import functools
+import contextvars
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+PROFILE_DIR = os.getenv(
+    "PROFILE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "profiles")
+)
+PROFILE_INTERVAL_S = float(os.getenv("PROFILE_INTERVAL_MS", "10")) / 1000
+# Oldest profiles beyond this many are deleted when a new one is written
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "200"))
+MAX_DEPTH = 128
+
+# Where a blocked worker thread is waiting: a child process, or another thread/pool
+SUBPROCESS_FILE = os.sep + "subprocess.py"
+WAIT_FILES = (os.sep + "threading.py", os.sep + "selectors.py", os.sep + "queue.py", os.sep + "_base.py")
+
+_current = contextvars.ContextVar("profile_session", default=None)
+
+def _children_cpu():
+    """CPU seconds of this process's finished children: resource on POSIX, psutil where installed, else None."""
+    try:
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return usage.ru_utime + usage.ru_stime
+    except ImportError:
+        pass
+    try:
+        import psutil
+        times = psutil.Process().cpu_times()
+        return times.children_user + times.children_system
+    except (ImportError, AttributeError):
+        return None
+
+def _frame_name(code):
+    # Collapsed-stack format: ';' separates frames and the count follows the last space
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+def _walk(frame, stop):
+    """Codes from frame up to (excluding) the first frame for which stop(frame) is true; None if never hit."""
+    codes = []
+    while frame is not None and len(codes) < MAX_DEPTH:
+        if stop(frame):
+            return codes
+        codes.append(frame.f_code)
+        frame = frame.f_back
+    return None
+
+def _category(codes):
+    """codes run leaf-first."""
+    if any(code.co_filename.endswith(SUBPROCESS_FILE) for code in codes):
+        return "subprocess"
+    if codes and codes[0].co_filename.endswith(WAIT_FILES):
+        return "waiting"
+    return "python"
+
+class ProfileSession:
+    """
+    One task's profile. Samples the event loop thread only while the task's own coroutine is on
+    its stack, plus the executor threads running calls the task handed off (see ProfilingExecutor),
+    so concurrent tasks don't show up in each other's flame graphs.
+    """
+    def __init__(self, manager, profile_id, label=None):
+        self.manager = manager
+        self.profile_id = profile_id
+        self.label = label
+        self.root_frame = None
+        self.loop_thread = None
+        self.threads = {}  # thread ident -> nesting depth of handed-off calls
+        self.stacks = Counter()
+        self.categories = Counter()
+        # Measured time behind the samples: the sampler sleeps a fixed interval but also waits for
+        # the GIL, so a pass under CPU-bound Python code covers far more than PROFILE_INTERVAL_S
+        self.category_seconds = Counter()
+        self.leaf_seconds = Counter()
+        self.samples = 0
+        self._lock = threading.Lock()
+        self._token = None
+
+    def __enter__(self):
+        # The caller's frame (e.g. the task coroutine) bounds the event-loop stacks
+        self.root_frame = sys._getframe(1)
+        self.loop_thread = threading.get_ident()
+        self._token = _current.set(self)
+        self.started = time.time()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self._children = _children_cpu()
+        self.manager._attach(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.manager._detach(self)
+        _current.reset(self._token)
+        self.root_frame = None
+        self.manager.save(self, error=str(exc) if exc else None)
+        return False
+
+    def run_in_thread(self, fn, *args, **kwargs):
+        ident = threading.get_ident()
+        with self._lock:
+            self.threads[ident] = self.threads.get(ident, 0) + 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.threads[ident] -= 1
+                if not self.threads[ident]:
+                    del self.threads[ident]
+
+    def sample(self, frames, elapsed):
+        """elapsed: measured seconds since the sampler's previous pass, credited to each stack seen."""
+        root = self.root_frame
+        loop_frame = frames.get(self.loop_thread)
+        if root is not None and loop_frame is not None:
+            codes = _walk(loop_frame, lambda f: f is root)
+            if codes is not None:
+                self._record("loop", [root.f_code] + codes[::-1], codes + [root.f_code], elapsed)
+        with self._lock:
+            workers = list(self.threads)
+        for ident in workers:
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            codes = _walk(frame, lambda f: f.f_code is _RUN_IN_THREAD)
+            if codes:
+                self._record("worker", codes[::-1], codes, elapsed)
+
+    def _record(self, thread, root_first, leaf_first, elapsed):
+        category = f"{thread}_{_category(leaf_first)}"
+        self.stacks[";".join([thread] + [_frame_name(c) for c in root_first])] += 1
+        self.categories[category] += 1
+        self.category_seconds[category] += elapsed
+        self.leaf_seconds[_frame_name(root_first[-1])] += elapsed
+        self.samples += 1
+
+    def summary(self, error=None):
+        children = _children_cpu()
+        seconds = {k: round(v, 3) for k, v in sorted(self.category_seconds.items())}
+        return {
+            "label": self.label,
+            "started": self.started,
+            "wall_seconds": round(time.perf_counter() - self._wall, 3),
+            # Process-wide counters: other work running at the same time is included
+            "process_cpu_seconds": round(time.process_time() - self._cpu, 3),
+            "children_cpu_seconds": round(children - self._children, 3) if children is not None else None,
+            "interval_ms": PROFILE_INTERVAL_S * 1000,
+            "samples": self.samples,
+            "category_samples": dict(sorted(self.categories.items())),
+            "sampled_seconds": seconds,
+            "leaf_seconds": {k: round(v, 4) for k, v in self.leaf_seconds.most_common()},
+            "error": error,
+        }
+
+_RUN_IN_THREAD = ProfileSession.run_in_thread.__code__
+
+class ProfilingExecutor(ThreadPoolExecutor):
+    """
+    Default executor that lets a profiled task follow its work into threads: calls submitted from
+    inside a ProfileSession (asyncio.to_thread, run_in_executor(None, ...)) register their thread.
+    """
+    def submit(self, fn, *args, **kwargs):
+        session = _current.get()
+        if session is not None:
+            fn = functools.partial(session.run_in_thread, fn)
+        return super().submit(fn, *args, **kwargs)
+
+class TaskProfiler:
+    """
+    Opt-in per-task sampling profiler. One daemon thread samples sys._current_frames() every
+    PROFILE_INTERVAL_MS while any session is open, and exits when the last one closes. Output per
+    profile id: <id>.folded (collapsed stacks, for flamegraph.pl / speedscope) and <id>.json.
+    """
+    def __init__(self, profile_dir=PROFILE_DIR):
+        self.profile_dir = profile_dir
+        self.sessions = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def session(self, profile_id, label=None):
+        return ProfileSession(self, profile_id, label)
+
+    def current(self):
+        return _current.get()
+
+    def _attach(self, session):
+        with self._lock:
+            self.sessions.append(session)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample_loop, name="task-profiler", daemon=True)
+                self._thread.start()
+
+    def _detach(self, session):
+        with self._lock:
+            self.sessions.remove(session)
+
+    def _sample_loop(self):
+        own = threading.get_ident()
+        last = time.perf_counter()
+        while True:
+            with self._lock:
+                sessions = list(self.sessions)
+                if not sessions:
+                    self._thread = None
+                    return
+            frames = sys._current_frames()
+            frames.pop(own, None)
+            now = time.perf_counter()
+            for session in sessions:
+                # A session opened mid-interval only owns the part since it started
+                session.sample(frames, min(now - last, now - session._wall))
+            last = now
+            del frames
+            time.sleep(PROFILE_INTERVAL_S)
+
+    def _path(self, profile_id, ext):
+        if not re.fullmatch(r"[\w-]+", profile_id or ""):
+            raise ValueError(f"Invalid profile id: {profile_id!r}")
+        return os.path.join(self.profile_dir, f"{profile_id}{ext}")
+
+    def save(self, session, error=None):
+        """Appends to an existing profile of the same id (e.g. a task resumed after preview approval)."""
+        os.makedirs(self.profile_dir, exist_ok=True)
+        folded_path = self._path(session.profile_id, ".folded")
+        stacks = Counter(session.stacks)
+        if os.path.exists(folded_path):
+            stacks.update(self._read_folded(folded_path))
+        with open(folded_path, "w", encoding="utf-8") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        meta = self.load(session.profile_id) or {"profile_id": session.profile_id, "segments": []}
+        segment = session.summary(error)
+        meta["segments"].append(segment)
+        with open(self._path(session.profile_id, ".json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+        print(f"[Profiler] {session.profile_id}: {segment['samples']} samples over {segment['wall_seconds']}s "
+              f"-> {folded_path}")
+        self._prune()
+
+    def _read_folded(self, path):
+        stacks = Counter()
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                stack, _, count = line.rstrip("\n").rpartition(" ")
+                if stack:
+                    stacks[stack] += int(count)
+        return stacks
+
+    def load(self, profile_id):
+        path = self._path(profile_id, ".json")
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def folded(self, profile_id):
+        path = self._path(profile_id, ".folded")
+        return path if os.path.exists(path) else None
+
+    def top(self, profile_id, limit=20):
+        """Hottest leaf frames (self time) of a profile: raw sample counts and measured seconds."""
+        leaves = Counter()
+        for stack, count in self._read_folded(self._path(profile_id, ".folded")).items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        seconds = Counter()
+        for segment in (self.load(profile_id) or {}).get("segments", []):
+            seconds.update(segment.get("leaf_seconds", {}))
+        return [{"frame": frame, "samples": count, "seconds": round(seconds[frame], 3)}
+                for frame, count in leaves.most_common(limit)]
+
+    def _prune(self):
+        entries = sorted((e for e in os.scandir(self.profile_dir) if e.name.endswith(".json")),
+                         key=lambda e: e.stat().st_mtime)
+        for entry in entries[:max(0, len(entries) - PROFILE_KEEP)]:
+            stem = entry.path[:-len(".json")]
+            for path in (stem + ".json", stem + ".folded"):
+                if os.path.exists(path):
+                    os.remove(path)
+
+task_profiler = TaskProfiler()
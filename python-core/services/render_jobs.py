@@ -0,0 +1,324 @@
+
+import os
+import sys
+import time
+import uuid
+import asyncio
+import subprocess
+from collections import deque
+
+from services.metrics import metrics
+
+# "inline": ffmpeg runs inside the API process (default)
+# "workers": jobs are queued for render workers (services/render_worker.py) that pull them over HTTP
+RENDER_BACKEND = os.getenv("RENDER_BACKEND", "inline")
+# >0: the API spawns this many local worker processes on startup (implies the workers backend)
+RENDER_LOCAL_WORKERS = int(os.getenv("RENDER_LOCAL_WORKERS", "0"))
+# A worker that hasn't reported for this long loses its job back to the queue
+WORKER_LEASE_SECONDS = float(os.getenv("RENDER_WORKER_LEASE_SECONDS", "60"))
+RENDER_JOB_ATTEMPTS = int(os.getenv("RENDER_JOB_ATTEMPTS", "3"))
+# A job not finished this long after submit (queue wait included) fails; 0 disables
+RENDER_JOB_DEADLINE_SECONDS = float(os.getenv("RENDER_JOB_DEADLINE_SECONDS", "10800"))
+# How often the API sweeps expired leases / deadlines and respawns dead local workers
+RENDER_SWEEP_SECONDS = float(os.getenv("RENDER_SWEEP_SECONDS", "10"))
+RENDER_WORKER_TOKEN = os.getenv("RENDER_WORKER_TOKEN", "")
+
+RENDER_SECONDS = metrics.histogram("gvva_render_job_seconds", "ffmpeg jobs from submit to finish (queue wait included)",
+                                   ("label", "backend"))
+
+def template_command(cmd, inputs, outputs):
+    """
+    Makes an ffmpeg argv host-independent: the binary becomes {ffmpeg} and every argument that
+    is exactly an input/output path becomes {in:name} / {out:name}. Workers substitute their own.
+    """
+    by_path = {os.path.abspath(p): f"{{in:{n}}}" for n, p in inputs.items()}
+    by_path.update({os.path.abspath(p): f"{{out:{n}}}" for n, p in outputs.items()})
+    args = ["{ffmpeg}"]
+    for arg in cmd[1:]:
+        key = os.path.abspath(arg) if isinstance(arg, str) and os.sep in arg else None
+        args.append(by_path.get(key, arg))
+    return args
+
+def expand_command(args, ffmpeg_path, inputs, outputs):
+    mapping = {"{ffmpeg}": ffmpeg_path}
+    mapping.update({f"{{in:{n}}}": p for n, p in inputs.items()})
+    mapping.update({f"{{out:{n}}}": p for n, p in outputs.items()})
+    return [mapping.get(a, a) for a in args]
+
+class RenderJob:
+    def __init__(self, task_id, args, inputs, outputs, duration=None, label="render", shared_only=False):
+        self.job_id = str(uuid.uuid4())
+        self.task_id = task_id
+        self.args = args            # templated argv (see template_command)
+        self.inputs = inputs        # {name: path on the API host}
+        self.outputs = outputs      # {name: path on the API host}
+        self.duration = duration    # seconds of media, for progress fractions
+        self.label = label
+        self.shared_only = shared_only  # argv still has API-host paths (tee slaves, image patterns...)
+        self.status = "pending"
+        self.worker_id = None
+        self.attempts = 0
+        self.progress = 0.0
+        self.error = None
+        self.lease_until = 0.0
+        self.deadline = time.time() + RENDER_JOB_DEADLINE_SECONDS if RENDER_JOB_DEADLINE_SECONDS > 0 else None
+        self.future = None
+        self.on_progress = None
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "task_id": self.task_id,
+            "label": self.label,
+            "shared_only": self.shared_only,
+            "args": self.args,
+            "inputs": self.inputs,
+            "outputs": self.outputs,
+            "duration": self.duration,
+            "status": self.status,
+            "worker_id": self.worker_id,
+            "attempts": self.attempts,
+            "progress": self.progress,
+        }
+
+class RenderQueue:
+    """
+    API-side half of the render worker protocol. The pipeline submits ffmpeg commands and awaits
+    them; workers register, long-poll claim, report progress (which renews their lease), and
+    complete or fail. Files move either through shared storage (paths used verbatim) or through
+    the input download / output upload endpoints.
+    """
+    def __init__(self, backend=None):
+        self.backend = backend or ("workers" if RENDER_LOCAL_WORKERS > 0 else RENDER_BACKEND)
+        self.jobs = {}
+        self.pending = deque()
+        self.workers = {}
+        self._wakeup = None
+        self._local_procs = []
+        self._local_api_url = None
+        self._sweeper = None
+
+    def _event(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        return self._wakeup
+
+    def shared_storage_available(self):
+        """True when some worker (or the API itself) can run commands that reference API-host paths."""
+        return (self.backend != "workers" or RENDER_LOCAL_WORKERS > 0
+                or any(w["shared_storage"] for w in self.workers.values()))
+
+    async def run(self, task_id, cmd, inputs, outputs, duration=None, label="render", on_progress=None,
+                  shared_only=False, local=False):
+        """
+        Runs one ffmpeg command on the configured backend; raises on failure. shared_only: the
+        command uses paths besides its declared inputs/outputs, so only shared-storage workers claim it.
+        local: run it in the API process whatever the backend (when no worker could reach those paths).
+        """
+        started = time.perf_counter()
+        try:
+            return await self._run(task_id, cmd, inputs, outputs, duration, label, on_progress, shared_only, local)
+        finally:
+            RENDER_SECONDS.observe(time.perf_counter() - started, label=label,
+                                   backend="inline" if local else self.backend)
+
+    async def _run(self, task_id, cmd, inputs, outputs, duration, label, on_progress, shared_only, local):
+        if self.backend != "workers" or local:
+            await asyncio.to_thread(subprocess.run, cmd, check=True)
+            return outputs
+        job = RenderJob(task_id, template_command(cmd, inputs, outputs), inputs, outputs, duration, label,
+                        shared_only=shared_only)
+        job.future = asyncio.get_running_loop().create_future()
+        job.on_progress = on_progress
+        self.jobs[job.job_id] = job
+        self.pending.append(job.job_id)
+        self._event().set()
+        print(f"[RenderQueue] {task_id} queued {label} job {job.job_id[:8]} ({len(self.pending)} pending)")
+        try:
+            return await job.future
+        finally:
+            self.jobs.pop(job.job_id, None)
+
+    def register(self, host="", slots=1, shared_storage=True, worker_id=None):
+        worker_id = worker_id or str(uuid.uuid4())
+        self.workers[worker_id] = {
+            "worker_id": worker_id, "host": host, "slots": slots,
+            "shared_storage": shared_storage, "last_seen": time.time(), "jobs": [],
+        }
+        print(f"[RenderQueue] Worker {worker_id[:8]} registered ({host}, shared_storage={shared_storage})")
+        return worker_id
+
+    def _touch(self, worker_id):
+        worker = self.workers.get(worker_id)
+        if worker is None:
+            raise KeyError(f"Unknown worker {worker_id}")
+        worker["last_seen"] = time.time()
+        return worker
+
+    def requeue_expired(self):
+        now = time.time()
+        for job in list(self.jobs.values()):
+            if job.status == "running" and job.lease_until < now:
+                print(f"[RenderQueue] Lease expired on job {job.job_id[:8]} (worker {job.worker_id[:8]})")
+                self._release(job, "lease expired")
+
+    def expire_deadlines(self):
+        now = time.time()
+        for job in list(self.jobs.values()):
+            if job.deadline is not None and job.deadline < now and job.status in ("pending", "running"):
+                print(f"[RenderQueue] Job {job.job_id[:8]} missed its {RENDER_JOB_DEADLINE_SECONDS:.0f}s deadline")
+                self._fail(job, TimeoutError(f"Render job {job.label} exceeded its deadline ({job.status})"))
+
+    def _fail(self, job, exc):
+        worker = self.workers.get(job.worker_id)
+        if worker and job.job_id in worker["jobs"]:
+            worker["jobs"].remove(job.job_id)
+        job.status = "failed"
+        if not job.future.done():
+            job.future.set_exception(exc)
+
+    def _release(self, job, error):
+        if job.attempts >= RENDER_JOB_ATTEMPTS:
+            self._fail(job, RuntimeError(f"Render job {job.label} failed after {job.attempts} attempts: {error}"))
+            return
+        worker = self.workers.get(job.worker_id)
+        if worker and job.job_id in worker["jobs"]:
+            worker["jobs"].remove(job.job_id)
+        job.status, job.worker_id, job.error = "pending", None, error
+        self.pending.appendleft(job.job_id)
+        self._event().set()
+
+    async def claim(self, worker_id, wait_s=25.0):
+        """Long-poll for the next job; returns the job dict or None when nothing arrived in wait_s."""
+        deadline = time.monotonic() + wait_s
+        while True:
+            worker = self._touch(worker_id)
+            self.requeue_expired()
+            for job_id in list(self.pending):
+                job = self.jobs.get(job_id)
+                if job is not None and job.status == "pending" and job.shared_only and not worker["shared_storage"]:
+                    continue
+                self.pending.remove(job_id)
+                if job is None or job.status != "pending":
+                    continue
+                job.status, job.worker_id = "running", worker_id
+                job.attempts += 1
+                job.lease_until = time.time() + WORKER_LEASE_SECONDS
+                worker["jobs"].append(job.job_id)
+                return job.to_dict()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            event = self._event()
+            event.clear()
+            try:
+                await asyncio.wait_for(event.wait(), timeout=min(remaining, WORKER_LEASE_SECONDS / 2))
+            except asyncio.TimeoutError:
+                pass
+
+    def get_job(self, job_id, worker_id):
+        job = self.jobs.get(job_id)
+        if job is None or job.worker_id != worker_id:
+            raise KeyError(f"Job {job_id} is not assigned to worker {worker_id}")
+        return job
+
+    def progress(self, job_id, worker_id, out_time_s):
+        self._touch(worker_id)
+        job = self.get_job(job_id, worker_id)
+        job.lease_until = time.time() + WORKER_LEASE_SECONDS
+        if job.duration:
+            job.progress = max(0.0, min(1.0, out_time_s / job.duration))
+            if job.on_progress:
+                job.on_progress(job.progress)
+
+    def complete(self, job_id, worker_id):
+        self._touch(worker_id)
+        job = self.get_job(job_id, worker_id)
+        missing = [p for p in job.outputs.values() if not os.path.exists(p)]
+        if missing:
+            raise FileNotFoundError(f"Outputs not delivered: {missing}")
+        job.status, job.progress = "completed", 1.0
+        self.workers[worker_id]["jobs"].remove(job_id)
+        if not job.future.done():
+            job.future.set_result(job.outputs)
+
+    def fail(self, job_id, worker_id, error):
+        self._touch(worker_id)
+        job = self.get_job(job_id, worker_id)
+        print(f"[RenderQueue] Job {job.job_id[:8]} failed on worker {worker_id[:8]}: {error}")
+        self._release(job, error)
+
+    def stats(self):
+        now = time.time()
+        return {
+            "backend": self.backend,
+            "pending": len(self.pending),
+            "running": sum(1 for j in self.jobs.values() if j.status == "running"),
+            "workers": [dict(w, idle_s=round(now - w["last_seen"], 1)) for w in self.workers.values()],
+        }
+
+    def sweep(self):
+        """Periodic upkeep, so dead workers are noticed even when no live worker is claiming."""
+        self.requeue_expired()
+        self.expire_deadlines()
+        self.respawn_local_workers()
+
+    async def _sweep_loop(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"[RenderQueue] Sweep failed: {e}")
+
+    def start_sweeper(self, interval=RENDER_SWEEP_SECONDS):
+        if self._sweeper is None:
+            self._sweeper = asyncio.get_running_loop().create_task(self._sweep_loop(interval))
+
+    async def stop_sweeper(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+    def _spawn_local_worker(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        cmd = [sys.executable, "-m", "services.render_worker", "--api", self._local_api_url]
+        return subprocess.Popen(cmd, cwd=root)
+
+    def start_local_workers(self, api_url, count=RENDER_LOCAL_WORKERS):
+        """Local multi-process mode: N worker processes on this host, talking to this API over HTTP."""
+        self._local_api_url = api_url
+        for _ in range(count):
+            self._local_procs.append(self._spawn_local_worker())
+        if count:
+            print(f"[RenderQueue] Started {count} local render workers -> {api_url}")
+
+    def respawn_local_workers(self):
+        # A crashed worker's jobs come back through lease expiry; its process is replaced here
+        for i, proc in enumerate(self._local_procs):
+            if proc.poll() is not None:
+                print(f"[RenderQueue] Local render worker pid {proc.pid} exited ({proc.returncode}), respawning")
+                self._local_procs[i] = self._spawn_local_worker()
+
+    def stop_local_workers(self):
+        for proc in self._local_procs:
+            if proc.poll() is None:
+                proc.terminate()
+        for proc in self._local_procs:
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        self._local_procs = []
+
+render_queue = RenderQueue()
+
+metrics.gauge("gvva_render_queue_jobs", "Render jobs by state", ("state",), callback=lambda: {
+    ("pending",): len(render_queue.pending),
+    ("running",): sum(1 for j in render_queue.jobs.values() if j.status == "running"),
+})
+metrics.gauge("gvva_render_workers", "Registered render workers", callback=lambda: {(): len(render_queue.workers)})
@@ -0,0 +1,189 @@
+
+import os
+import sys
+import time
+import socket
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+
+# Add python-core to path when started as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.render_jobs import expand_command
+from services.ffmpeg_handler import FFmpegHandler
+
+# Lease renewal + progress report period, far below RENDER_WORKER_LEASE_SECONDS
+HEARTBEAT_INTERVAL = 1.0
+
+class RenderWorker:
+    """
+    Worker half of the render protocol: register with the API, long-poll for jobs, run ffmpeg
+    with -progress, report progress/completion. With shared storage the job's paths are used
+    as-is; otherwise inputs are downloaded and outputs uploaded through the API.
+    """
+    def __init__(self, api_url, shared_storage=True, work_dir=None, token=None):
+        import requests  # deferred: only worker processes need an HTTP client
+        self.http = requests.Session()
+        token = token if token is not None else os.getenv("RENDER_WORKER_TOKEN", "")
+        if token:
+            self.http.headers["x-render-token"] = token
+        self.api_url = api_url.rstrip("/")
+        self.shared_storage = shared_storage
+        self.work_dir = work_dir or tempfile.gettempdir()
+        self.ffmpeg_path = FFmpegHandler().ffmpeg_path
+        self.worker_id = None
+
+    def _post(self, path, timeout=30, http=None, **kwargs):
+        response = (http or self.http).post(f"{self.api_url}{path}", timeout=timeout, **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    def register(self):
+        self.worker_id = self._post("/api/render-workers/register", json={
+            "host": socket.gethostname(), "slots": 1, "shared_storage": self.shared_storage
+        })["worker_id"]
+        print(f"[RenderWorker] Registered as {self.worker_id[:8]} with {self.api_url}")
+
+    def run_forever(self, poll_wait=25):
+        self.register()
+        while True:
+            try:
+                job = self._post(f"/api/render-workers/{self.worker_id}/claim",
+                                 params={"wait": poll_wait}, timeout=poll_wait + 10).get("job")
+            except Exception as e:
+                print(f"[RenderWorker] Claim failed: {e}. Re-registering in 5s...")
+                time.sleep(5)
+                try:
+                    self.register()
+                except Exception:
+                    pass
+                continue
+            if job:
+                self.execute(job)
+
+    def _stage_files(self, job, job_dir):
+        if self.shared_storage:
+            return job["inputs"], job["outputs"]
+        inputs, outputs = {}, {}
+        for name, path in job["inputs"].items():
+            local = os.path.join(job_dir, f"in_{name}{os.path.splitext(path)[1]}")
+            with self.http.get(f"{self.api_url}/api/render-jobs/{job['job_id']}/inputs/{name}",
+                               params={"worker_id": self.worker_id}, stream=True, timeout=60) as r:
+                r.raise_for_status()
+                with open(local, "wb") as f:
+                    shutil.copyfileobj(r.raw, f, 1024 * 1024)
+            inputs[name] = local
+        for name, path in job["outputs"].items():
+            outputs[name] = os.path.join(job_dir, f"out_{name}{os.path.splitext(path)[1]}")
+        return inputs, outputs
+
+    def _heartbeat(self, job_id, state, done, lost):
+        """
+        Renews the job's lease (and reports the latest ffmpeg position) from a timer thread for the
+        whole job, so input downloads and output uploads keep it alive just like encoding does.
+        A 404 means the lease already expired and the job went to another worker.
+        """
+        import requests
+        # Own session: the job thread may be mid-upload on self.http
+        http = requests.Session()
+        http.headers.update(self.http.headers)
+        while not done.wait(HEARTBEAT_INTERVAL):
+            try:
+                self._post(f"/api/render-jobs/{job_id}/progress", http=http,
+                           json={"worker_id": self.worker_id, "out_time_s": state["out_time_s"]})
+            except Exception as e:
+                if getattr(getattr(e, "response", None), "status_code", None) != 404:
+                    print(f"[RenderWorker] Heartbeat for job {job_id[:8]} failed: {e}")
+                    continue
+                print(f"[RenderWorker] Job {job_id[:8]} is no longer ours, stopping it")
+                lost.set()
+                proc = state["proc"]
+                if proc is not None and proc.poll() is None:
+                    proc.kill()
+                return
+
+    def execute(self, job):
+        job_id = job["job_id"]
+        job_dir = tempfile.mkdtemp(prefix=f"render_{job_id[:8]}_", dir=self.work_dir)
+        state = {"out_time_s": 0.0, "proc": None}
+        done, lost = threading.Event(), threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job_id, state, done, lost),
+                                     name=f"heartbeat-{job_id[:8]}", daemon=True)
+        heartbeat.start()
+        try:
+            inputs, outputs = self._stage_files(job, job_dir)
+            if lost.is_set():
+                raise RuntimeError("lease lost while downloading inputs")
+            cmd = expand_command(job["args"], self.ffmpeg_path, inputs, outputs)
+            # Machine-readable progress on stdout; the heartbeat thread reports the latest position
+            cmd = cmd[:1] + ['-progress', 'pipe:1', '-nostats'] + cmd[1:]
+            print(f"[RenderWorker] Running {job['label']} job {job_id[:8]} for task {job['task_id']}")
+            # stderr goes to a file: a full stderr pipe would stall ffmpeg while we read stdout
+            with tempfile.TemporaryFile(mode="w+", dir=job_dir) as log:
+                proc = state["proc"] = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=log, text=True)
+                try:
+                    for line in proc.stdout:
+                        key, _, value = line.strip().partition("=")
+                        # out_time_ms is microseconds too (older ffmpeg spelling)
+                        if key in ("out_time_us", "out_time_ms") and value.isdigit():
+                            state["out_time_s"] = int(value) / 1e6
+                    if proc.wait() != 0:
+                        if lost.is_set():
+                            raise RuntimeError("lease lost during encode")
+                        log.seek(0)
+                        raise RuntimeError(f"ffmpeg exited with {proc.returncode}: {log.read()[-1000:]}")
+                finally:
+                    # Never leave an orphaned ffmpeg writing to paths a reassigned job now owns
+                    if proc.poll() is None:
+                        proc.kill()
+                        proc.wait()
+
+            if not self.shared_storage:
+                for name, local in outputs.items():
+                    if lost.is_set():
+                        break
+                    with open(local, "rb") as f:
+                        response = self.http.put(f"{self.api_url}/api/render-jobs/{job_id}/outputs/{name}",
+                                                 params={"worker_id": self.worker_id}, data=f, timeout=600)
+                        response.raise_for_status()
+            if lost.is_set():
+                raise RuntimeError("lease lost")
+            self._post(f"/api/render-jobs/{job_id}/complete", json={"worker_id": self.worker_id})
+            print(f"[RenderWorker] Job {job_id[:8]} done")
+        except Exception as e:
+            print(f"[RenderWorker] Job {job_id[:8]} failed: {e}")
+            if not lost.is_set():
+                try:
+                    self._post(f"/api/render-jobs/{job_id}/fail", json={"worker_id": self.worker_id, "error": str(e)})
+                except Exception as report_error:
+                    print(f"[RenderWorker] Could not report failure: {report_error}")
+        finally:
+            done.set()
+            heartbeat.join()
+            shutil.rmtree(job_dir, ignore_errors=True)
+
+def _run_one(api_url, shared_storage, work_dir):
+    RenderWorker(api_url, shared_storage=shared_storage, work_dir=work_dir).run_forever()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="GVVA render worker")
+    parser.add_argument("--api", default=os.getenv("RENDER_API_URL", "http://127.0.0.1:8000"))
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes to run on this host")
+    parser.add_argument("--no-shared-storage", action="store_true",
+                        help="Download inputs / upload outputs through the API instead of using its paths")
+    parser.add_argument("--work-dir", default=None)
+    args = parser.parse_args()
+
+    if args.workers <= 1:
+        _run_one(args.api, not args.no_shared_storage, args.work_dir)
+    else:
+        import multiprocessing
+        procs = [multiprocessing.Process(target=_run_one, args=(args.api, not args.no_shared_storage, args.work_dir))
+                 for _ in range(args.workers)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
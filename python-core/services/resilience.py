@@ -0,0 +1,200 @@
+
+import os
+import time
+import random
+import asyncio
+import hashlib
+import threading
+
+from services.metrics import metrics
+
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+MAX_RETRIES = int(os.getenv("AI_MAX_RETRIES", "5"))
+BASE_DELAY = float(os.getenv("AI_RETRY_BASE_DELAY", "1.0"))
+MAX_DELAY = float(os.getenv("AI_RETRY_MAX_DELAY", "30.0"))
+
+# Requests per period per (api key, model): "model=count/seconds,..." ("*" is the default)
+DEFAULT_RATE_LIMITS = "whisper-1=50/60,gpt-4o=500/60,eleven_multilingual_v2=100/60,*=300/60"
+
+RETRIES = metrics.counter("gvva_ai_retries_total", "Retried AI API calls", ("label",))
+HEDGES = metrics.counter("gvva_ai_hedges_total", "Hedge requests sent for slow AI API calls", ("label",))
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+class TokenBucket:
+    """Classic token bucket; thread-safe, with a non-blocking reserve() used by both sync and async waits."""
+    def __init__(self, rate, capacity):
+        self.rate = rate            # tokens per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Takes a token now if available, otherwise returns seconds to wait before retrying."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self, deadline=None):
+        while True:
+            wait = self.reserve()
+            if wait == 0:
+                return
+            if deadline is not None and time.monotonic() + wait > deadline:
+                raise DeadlineExceeded("Deadline exceeded waiting for rate limit")
+            time.sleep(wait)
+
+    async def aacquire(self, deadline=None):
+        while True:
+            wait = self.reserve()
+            if wait == 0:
+                return
+            if deadline is not None and time.monotonic() + wait > deadline:
+                raise DeadlineExceeded("Deadline exceeded waiting for rate limit")
+            await asyncio.sleep(wait)
+
+def _parse_limits(spec):
+    limits = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        model, value = item.strip().split("=", 1)
+        count, seconds = value.split("/")
+        limits[model] = (float(count), float(seconds))
+    return limits
+
+class RateLimiter:
+    """One token bucket per (hashed API key, model), so tenants don't throttle each other."""
+    def __init__(self, spec=None):
+        self.limits = _parse_limits(spec or os.getenv("AI_RATE_LIMITS", DEFAULT_RATE_LIMITS))
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, api_key, model):
+        key = (hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16], model)
+        with self._lock:
+            if key not in self._buckets:
+                count, seconds = self.limits.get(model) or self.limits.get("*", (300.0, 60.0))
+                self._buckets[key] = TokenBucket(rate=count / seconds, capacity=max(1.0, count))
+            return self._buckets[key]
+
+rate_limiter = RateLimiter()
+
+def _status_code(exc):
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status
+
+def is_retryable(exc):
+    """429/5xx from any SDK (duck-typed status_code), plus connection errors and timeouts."""
+    if isinstance(exc, DeadlineExceeded):
+        return False
+    status = _status_code(exc)
+    if status is not None:
+        return status in RETRY_STATUS
+    name = type(exc).__name__
+    return isinstance(exc, (ConnectionError, TimeoutError)) or "Timeout" in name or "Connection" in name
+
+def _retry_after(exc):
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt, exc=None):
+    """Exponential backoff with full jitter; honors Retry-After when the provider sends one."""
+    hinted = _retry_after(exc) if exc is not None else None
+    if hinted is not None:
+        return min(MAX_DELAY, hinted)
+    return random.uniform(0, min(MAX_DELAY, BASE_DELAY * (2 ** attempt)))
+
+def call_with_resilience(fn, api_key=None, model="*", deadline_s=120.0, retries=MAX_RETRIES, label="AI"):
+    """
+    Runs fn(timeout_s) under the (key, model) rate limit, retrying retryable failures.
+    fn receives the remaining deadline so it can pass it on as the SDK request timeout.
+    """
+    deadline = time.monotonic() + deadline_s
+    bucket = rate_limiter.bucket(api_key, model)
+    attempt = 0
+    while True:
+        bucket.acquire(deadline)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"{label} deadline of {deadline_s:.1f}s exceeded")
+        try:
+            return fn(remaining)
+        except Exception as e:
+            delay = backoff_delay(attempt, e)
+            if attempt >= retries or not is_retryable(e) or time.monotonic() + delay >= deadline:
+                raise
+            attempt += 1
+            RETRIES.inc(label=label)
+            print(f"[{label}] {type(e).__name__} (status {_status_code(e)}), retry {attempt}/{retries} in {delay:.1f}s")
+            time.sleep(delay)
+
+async def acall_with_resilience(fn, api_key=None, model="*", deadline_s=120.0, retries=MAX_RETRIES,
+                                hedge_after_s=None, label="AI"):
+    """
+    Async counterpart of call_with_resilience; fn(timeout_s) returns an awaitable.
+    hedge_after_s: if the first attempt hasn't finished by then, fire a second identical
+    request and take whichever succeeds first (for short, tail-latency-sensitive calls).
+    """
+    deadline = time.monotonic() + deadline_s
+    bucket = rate_limiter.bucket(api_key, model)
+
+    async def attempt_once():
+        await bucket.aacquire(deadline)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"{label} deadline of {deadline_s:.1f}s exceeded")
+        return await asyncio.wait_for(fn(remaining), timeout=remaining)
+
+    async def hedged():
+        primary = asyncio.ensure_future(attempt_once())
+        done, _ = await asyncio.wait({primary}, timeout=hedge_after_s)
+        if done:
+            return primary.result()
+        print(f"[{label}] No response after {hedge_after_s:.1f}s, sending hedge request")
+        HEDGES.inc(label=label)
+        pending = {primary, asyncio.ensure_future(attempt_once())}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    attempt = 0
+    while True:
+        try:
+            if hedge_after_s:
+                return await hedged()
+            return await attempt_once()
+        except Exception as e:
+            # wait_for's timeout is only the deadline if the deadline has actually passed; a
+            # TimeoutError raised by the SDK/transport (builtin since 3.11) is retried like the sync path
+            timed_out = isinstance(e, (asyncio.TimeoutError, TimeoutError)) and not isinstance(e, DeadlineExceeded)
+            if timed_out and time.monotonic() >= deadline:
+                raise DeadlineExceeded(f"{label} deadline of {deadline_s:.1f}s exceeded") from e
+            delay = backoff_delay(attempt, e)
+            if attempt >= retries or not is_retryable(e) or time.monotonic() + delay >= deadline:
+                raise
+            attempt += 1
+            RETRIES.inc(label=label)
+            print(f"[{label}] {type(e).__name__} (status {_status_code(e)}), retry {attempt}/{retries} in {delay:.1f}s")
+            await asyncio.sleep(delay)
@@ -1,32 +1,175 @@
 
+import os
 import subprocess
 
+# Output variants we publish. "source" keeps the input geometry untouched.
+VARIANTS = {
+    "16:9": {"width": 1920, "height": 1080, "mode": "pad"},
+    "9:16": {"width": 1080, "height": 1920, "mode": "blur"},
+    "1:1": {"width": 1080, "height": 1080, "mode": "crop"},
+    "source": {"width": None, "height": None, "mode": "none"},
+}
+
+# Per-variant encoder settings (merged over DEFAULT_PROFILE)
+# +faststart moves the moov atom to the front so players can start before the download ends
+DEFAULT_PROFILE = {"c:v": "libx264", "preset": "fast", "c:a": "copy", "movflags": "+faststart"}
+VARIANT_PROFILES = {
+    "9:16": {"crf": "21"},
+    "1:1": {"crf": "21"},
+}
+
+# Shorts background modes, cheapest last:
+#   full     - original: boxblur=20:10 on the full 1080x1920 frame, every frame
+#   fast     - downscale 8x, blur at low res, upscale (same look, ~1/64 of the pixels)
+#   periodic - fast, but the background is only recomputed BG_FPS times per second
+#   scene    - fast, recomputed on the first frame and on scene cuts only
+#   static   - fast, computed once from the first frame and held (talking heads)
+BLUR_MODES = ("full", "fast", "periodic", "scene", "static")
+SHORTS_BLUR_MODE = os.getenv("SHORTS_BLUR_MODE", "fast")
+BG_DOWNSCALE = 8
+BG_FPS = float(os.getenv("SHORTS_BG_FPS", "2"))
+SCENE_THRESHOLD = 0.3
+
 class Resizer:
     def __init__(self):
         pass
 
-    def resize_to_shorts(self, input_path, output_path, ffmpeg_path="ffmpeg"):
+    def probe_fps(self, video_path, ffmpeg_path="ffmpeg"):
+        """
+        Frame rate of the first video stream as an ffmpeg rate string ("25/1", "30000/1001").
+        The background of the periodic/scene/static modes drives the Shorts overlay, so it
+        has to be rebuilt at the source rate; falls back to 30 when the probe fails.
+        """
+        ffprobe = ffmpeg_path.replace('ffmpeg.exe', 'ffprobe.exe').replace('ffmpeg', 'ffprobe')
+        try:
+            result = subprocess.run([ffprobe, '-v', 'error', '-select_streams', 'v:0',
+                                     '-show_entries', 'stream=avg_frame_rate,r_frame_rate',
+                                     '-of', 'default=noprint_wrappers=1:nokey=1', video_path],
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
+            for rate in result.stdout.split():
+                num, _, den = rate.partition("/")
+                if float(num) > 0 and float(den or 1) > 0:
+                    return rate
+        except Exception as e:
+            print(f"[Resizer] Error probing frame rate of {video_path}: {e}")
+        return "30"
+
+    def background_chain(self, in_label, out_label, w, h, mode=None, fps=30):
+        """Blurred fill background for [in_label] at w x h (see BLUR_MODES). fps is the source rate."""
+        mode = mode or SHORTS_BLUR_MODE
+        if mode not in BLUR_MODES:
+            raise ValueError(f"Unknown blur mode '{mode}' (choose from {', '.join(BLUR_MODES)})")
+        if mode == "full":
+            return (f"[{in_label}]scale={w}:{h}:force_original_aspect_ratio=increase,"
+                    f"crop={w}:{h},boxblur=20:10[{out_label}]")
+
+        lw, lh = w // BG_DOWNSCALE, h // BG_DOWNSCALE
+        # Choose which frames get a fresh background before paying for scale/blur
+        if mode == "periodic":
+            pick = f"fps={BG_FPS},"
+        elif mode == "scene":
+            # Scene score computed on a tiny copy so detection stays cheap
+            pick = f"scale=160:-2,select='eq(n,0)+gt(scene,{SCENE_THRESHOLD})',"
+        elif mode == "static":
+            pick = "trim=end_frame=1,"
+        else:
+            pick = ""
+        low_res = (f"{pick}scale={lw}:{lh}:force_original_aspect_ratio=increase,crop={lw}:{lh},"
+                   f"boxblur=3:3,scale={w}:{h}:flags=fast_bilinear")
+        if mode == "static":
+            # Hold the single frame forever; the overlay ends with the foreground
+            return f"[{in_label}]{low_res},loop=loop=-1:size=1,setpts=N/({fps})/TB[{out_label}]"
+        if mode in ("periodic", "scene"):
+            # Duplicate the sparse background frames back up to the output rate
+            return f"[{in_label}]{low_res},fps={fps}[{out_label}]"
+        return f"[{in_label}]{low_res}[{out_label}]"
+
+    def variant_chain(self, variant, in_label, out_label, tag="v", blur_mode=None, fps=30, scale=1.0):
+        """
+        Filter graph fragment turning [in_label] into [out_label] for one output variant.
+        - pad:  letterbox into the frame (landscape)
+        - crop: fill and center-crop (square)
+        - blur: foreground fitted over a blurred, filled copy of itself (Shorts)
+        scale shrinks the target frame (e.g. 1/3 for a 360p proxy) while keeping the same graph.
+        """
+        spec = VARIANTS[variant]
+        w, h = spec["width"], spec["height"]
+        if w and scale != 1.0:
+            w, h = int(w * scale) // 2 * 2, int(h * scale) // 2 * 2
+        mode = spec["mode"]
+        if mode == "none":
+            return f"[{in_label}]null[{out_label}]"
+        if mode == "pad":
+            return (f"[{in_label}]scale={w}:{h}:force_original_aspect_ratio=decrease,"
+                    f"pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,setsar=1[{out_label}]")
+        if mode == "crop":
+            return (f"[{in_label}]scale={w}:{h}:force_original_aspect_ratio=increase,"
+                    f"crop={w}:{h},setsar=1[{out_label}]")
+        # blur
+        return (f"[{in_label}]split[{tag}a][{tag}b];"
+                + self.background_chain(f"{tag}a", f"{tag}bg", w, h, blur_mode, fps) + ";"
+                f"[{tag}b]scale={w}:-2[{tag}fg];"
+                f"[{tag}bg][{tag}fg]overlay=(W-w)/2:(H-h)/2:shortest=1,setsar=1[{out_label}]")
+
+    def split_graph(self, variants, in_label="0:v", blur_mode=None, fps=30, scale=1.0):
+        """
+        One decode feeding every variant: [in]split=N -> per-variant chain.
+        Returns (filter_complex, {variant: output_label}).
+        """
+        labels = {v: f"out_{i}" for i, v in enumerate(variants)}
+        if len(variants) == 1:
+            v = variants[0]
+            return self.variant_chain(v, in_label, labels[v], tag="v0", blur_mode=blur_mode, fps=fps, scale=scale), labels
+        parts = [f"[{in_label}]split={len(variants)}" + "".join(f"[s{i}]" for i in range(len(variants)))]
+        for i, v in enumerate(variants):
+            parts.append(self.variant_chain(v, f"s{i}", labels[v], tag=f"v{i}", blur_mode=blur_mode, fps=fps, scale=scale))
+        return ";".join(parts), labels
+
+    def output_args(self, variant, out_label, audio_map="0:a?", profile=None):
+        """-map / encoder arguments for one output file."""
+        settings = dict(DEFAULT_PROFILE)
+        settings.update(VARIANT_PROFILES.get(variant, {}))
+        settings.update(profile or {})
+        args = ['-map', f'[{out_label}]']
+        if audio_map:
+            args.extend(['-map', audio_map])
+        for key, value in settings.items():
+            if value is None:  # a profile can drop a default, e.g. {"c:a": None}
+                continue
+            args.extend([f'-{key}', str(value)])
+        return args
+
+    def multi_format_command(self, input_path, outputs, ffmpeg_path="ffmpeg", profiles=None, blur_mode=None, fps=None):
+        """
+        Builds a single ffmpeg command that decodes input_path once and encodes every
+        requested variant. outputs: {variant: output_path}, e.g. {"16:9": a, "9:16": b, "1:1": c}.
+        ffmpeg runs the per-output encoders in parallel threads of the same process.
+        """
+        variants = list(outputs.keys())
+        fps = fps or self.probe_fps(input_path, ffmpeg_path)
+        filter_complex, labels = self.split_graph(variants, blur_mode=blur_mode, fps=fps)
+        cmd = [ffmpeg_path, '-y', '-i', input_path, '-filter_complex', filter_complex]
+        for v in variants:
+            cmd.extend(self.output_args(v, labels[v], profile=(profiles or {}).get(v)))
+            cmd.append(outputs[v])
+        return cmd
+
+    def render_variants(self, input_path, outputs, ffmpeg_path="ffmpeg", profiles=None, blur_mode=None, fps=None):
+        cmd = self.multi_format_command(input_path, outputs, ffmpeg_path, profiles, blur_mode, fps)
+        subprocess.run(cmd, check=True)
+        return outputs
+
+    def resize_to_shorts(self, input_path, output_path, ffmpeg_path="ffmpeg", blur_mode=None, fps=None):
         """
         Convert 16:9 to 9:16 with blurred background.
         Process:
         1. Split input into [main] and [bg]
-        2. [bg] scale to fill 1080x1920, boxblur
+        2. [bg] fill 1080x1920 and blur (see BLUR_MODES for the cheaper paths)
         3. [main] scale width to 1080, keep aspect ratio
         4. Overlay [main] on center of [bg]
         """
-        # split[a][b];[a]scale=1080:1920,boxblur=20:10[bg];[b]scale=1080:-1[fg];[bg][fg]overlay=(W-w)/2:(H-h)/2
-        filter_complex = "split[a][b];[a]scale=1080:1920:force_original_aspect_ratio=increase,crop=1080:1920,boxblur=20:10[bg];[b]scale=1080:-1[fg];[bg][fg]overlay=(W-w)/2:(H-h)/2"
-        
-        cmd = [
-            ffmpeg_path, '-y',
-            '-i', input_path,
-            '-filter_complex', filter_complex,
-            '-c:v', 'libx264',
-            '-preset', 'fast',
-            '-c:a', 'copy',
-            output_path
-        ]
-        
+        cmd = self.multi_format_command(input_path, {"9:16": output_path}, ffmpeg_path, blur_mode=blur_mode, fps=fps)
+
         # subprocess.run(cmd, check=True)
         return cmd
 
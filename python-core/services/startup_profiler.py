@@ -0,0 +1,85 @@
+
+import os
+import re
+import sys
+import subprocess
+
+CORE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# "import time:       123 |       4567 |   package.module"
+IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+)\s*\|\s*(\d+)\s*\|(\s*)(\S+)")
+
+def profile_imports(module="main"):
+    """
+    Imports `module` in a fresh interpreter with `-X importtime` and parses the report.
+    A fresh process is required: anything already in sys.modules would report 0.
+    Returns {"total_ms", "wall_ms", "modules": [{"name", "self_ms", "cumulative_ms", "depth"}]}.
+    """
+    env = os.environ.copy()
+    env["PYTHONPATH"] = CORE_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    code = (
+        "import time, sys; t = time.perf_counter(); "
+        f"import {module}; "
+        "sys.__stdout__.write('WALL_MS=%.1f\\n' % ((time.perf_counter() - t) * 1000))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=CORE_DIR, env=env, capture_output=True, text=True, encoding="utf-8", errors="replace"
+    )
+    if result.returncode != 0:
+        tail = result.stderr.strip().splitlines()[-1:] or ["unknown error"]
+        raise RuntimeError(f"Importing {module} failed: {tail[0]}")
+
+    modules = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        modules.append({
+            "name": name,
+            "self_ms": int(self_us) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000,
+            "depth": len(indent) // 2
+        })
+
+    wall_match = re.search(r"WALL_MS=([\d.]+)", result.stdout)
+    target = next((m for m in modules if m["name"] == module), None)
+    return {
+        "module": module,
+        "total_ms": target["cumulative_ms"] if target else sum(m["self_ms"] for m in modules),
+        "wall_ms": float(wall_match.group(1)) if wall_match else None,
+        "modules": modules
+    }
+
+def direct_imports(profile):
+    """Modules imported directly by the profiled module (what main.py itself can defer)."""
+    modules = profile["modules"]
+    idx = next((i for i, m in enumerate(modules) if m["name"] == profile["module"]), None)
+    if idx is None:
+        return []
+    # importtime prints children before their parent, one indent level deeper
+    depth = modules[idx]["depth"]
+    direct = []
+    for m in reversed(modules[:idx]):
+        if m["depth"] <= depth:
+            break
+        if m["depth"] == depth + 1:
+            direct.append(m)
+    return direct
+
+def format_report(profile, top=25):
+    direct = direct_imports(profile)
+    heaviest = sorted(profile["modules"], key=lambda m: m["self_ms"], reverse=True)[:top]
+
+    lines = [f"=== Startup import profile: {profile['module']} ===",
+             f"Total import time: {profile['total_ms']:.1f} ms (wall {profile['wall_ms'] or 0:.1f} ms)",
+             "",
+             "Direct imports (cumulative):"]
+    for m in sorted(direct, key=lambda m: m["cumulative_ms"], reverse=True)[:top]:
+        lines.append(f"  {m['cumulative_ms']:9.1f} ms  {m['name']}")
+    lines.append("")
+    lines.append(f"Top {top} modules (self):")
+    for m in heaviest:
+        lines.append(f"  {m['self_ms']:9.1f} ms  {m['name']}")
+    return "\n".join(lines)
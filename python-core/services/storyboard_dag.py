@@ -0,0 +1,588 @@
+
+import os
+import re
+import json
+import time
+import uuid
+import math
+import asyncio
+import hashlib
+import subprocess
+from collections import OrderedDict
+
+from services.media_store import media_store
+from services.render_jobs import render_queue
+from services.ffmpeg_handler import ffmpeg_handler
+from services.ai_handler import ai_handler
+from services.sync_logic import sync_logic
+from services.metrics import metrics, cache_result
+
+STORYBOARD_RUNS_DIR = os.getenv(
+    "STORYBOARD_RUNS_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "storyboard_runs")
+)
+CLIP_WIDTH, CLIP_HEIGHT = (int(v) for v in os.getenv("STORYBOARD_CLIP_SIZE", "1920x1080").split("x"))
+CLIP_FPS = int(os.getenv("STORYBOARD_CLIP_FPS", "30"))
+# Scenes without narration are held on screen this long
+SILENT_SCENE_SECONDS = float(os.getenv("STORYBOARD_SILENT_SCENE_SECONDS", "3"))
+NODE_ATTEMPTS = int(os.getenv("STORYBOARD_NODE_ATTEMPTS", "2"))
+# Node cache entries unused this long are dropped (their blobs go with the last ref); 0 keeps them
+NODE_CACHE_TTL_SECONDS = float(os.getenv("STORYBOARD_CACHE_TTL_DAYS", "30")) * 86400
+
+# Concurrent nodes per resource: Whisk drives a single browser, TTS is rate-limited upstream,
+# clip encodes are CPU-bound and the final concat is a stream copy
+RESOURCE_LIMITS = {
+    "image": int(os.getenv("STORYBOARD_IMAGE_CONCURRENCY", "1")),
+    "voice": int(os.getenv("STORYBOARD_VOICE_CONCURRENCY", "4")),
+    "clip": int(os.getenv("STORYBOARD_CLIP_CONCURRENCY", str(max(1, (os.cpu_count() or 2) // 2)))),
+    "final": 1,
+}
+
+# Every clip is encoded with the same parameters, so clips concatenate with stream copy
+CLIP_PROFILE = {
+    "c:v": "libx264", "preset": "fast", "crf": "20", "tune": "stillimage",
+    "pix_fmt": "yuv420p", "r": str(CLIP_FPS), "g": str(CLIP_FPS * 2),
+    "c:a": "aac", "b:a": "192k", "ar": "48000", "ac": "2",
+}
+
+DONE_STATES = ("done", "cached")
+
+NODE_SECONDS = metrics.histogram("gvva_dag_node_seconds", "Storyboard DAG node execution (cache hits excluded)",
+                                 ("kind", "status"))
+
+def _node_key(kind, params, dep_keys):
+    # Merkle-style: a node's key covers its own inputs and the keys of everything upstream
+    raw = json.dumps({"kind": kind, "params": params, "deps": dep_keys}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def _safe(name):
+    return re.sub(r"[^\w.-]", "_", name)
+
+class Node:
+    def __init__(self, node_id, kind, params, deps=()):
+        self.id = node_id
+        self.kind = kind
+        self.params = params
+        self.deps = list(deps)
+        self.key = None
+        self.status = "pending"   # pending | running | done | cached | failed | blocked
+        self.output = None
+        self.digest = None
+        self.error = None
+        self.attempts = 0
+        self.seconds = None
+        self.meta = {}            # e.g. a clip's frame count, kept with its cache entry
+
+    def to_dict(self):
+        return {
+            "kind": self.kind, "key": self.key, "status": self.status, "output": self.output,
+            "digest": self.digest, "error": self.error, "attempts": self.attempts, "seconds": self.seconds,
+            "meta": self.meta,
+        }
+
+def build_graph(scenes, options=None):
+    """
+    scene -> image, scene -> voice, image + voice -> clip, clips -> final.
+    Returns an OrderedDict of nodes in topological order with their input hashes filled in.
+    Scenes may bring their own media ("image_digest"/"audio_digest", set by create_run);
+    those nodes just materialize the blob.
+    """
+    options = options or {}
+    nodes = OrderedDict()
+
+    def add(node):
+        node.key = _node_key(node.kind, node.params, [nodes[d].key for d in node.deps])
+        nodes[node.id] = node
+        return node
+
+    clips = []
+    for i, scene in enumerate(scenes):
+        scene_id = scene.get("id") or f"scene_{i}"
+        prompt = (scene.get("prompt") or "").strip()
+        content = (scene.get("content") or "").strip()
+        if scene.get("image_digest"):
+            image = add(Node(f"image:{scene_id}", "image",
+                             {"digest": scene["image_digest"], "ext": scene.get("image_ext", "")}))
+        elif prompt:
+            image = add(Node(f"image:{scene_id}", "image", {
+                "prompt": prompt,
+                # Placeholder frames must never be served from the cache for a real generation
+                "provider": "placeholder" if options.get("image_mode") == "placeholder" else "whisk",
+            }))
+        else:
+            raise ValueError(f"Scene {scene_id} has neither a prompt nor an image")
+
+        deps = [image.id]
+        if scene.get("audio_digest"):
+            deps.append(add(Node(f"voice:{scene_id}", "voice",
+                                 {"digest": scene["audio_digest"], "ext": scene.get("audio_ext", "")})).id)
+        elif content:
+            deps.append(add(Node(f"voice:{scene_id}", "voice", {
+                "text": content, "voice_id": options.get("voice_id"),
+                # Local tone bursts (AI_PROVIDER=local) must never be served from the cache as narration
+                "provider": ai_handler.tts.name,
+            })).id)
+
+        clips.append(add(Node(f"clip:{scene_id}", "clip", {
+            "size": f"{CLIP_WIDTH}x{CLIP_HEIGHT}", "profile": CLIP_PROFILE,
+            "silent_seconds": None if len(deps) > 1 else SILENT_SCENE_SECONDS,
+            # Length set in the filter graph (older -shortest / -frames:v clips must not be reused)
+            "frame_exact": True,
+        }, deps)).id)
+
+    if not clips:
+        raise ValueError("Storyboard has no scenes")
+    add(Node("final", "final", {"scenes": len(clips)}, clips))
+    return nodes
+
+def clip_frames(duration):
+    """Whole frames covering duration (a scene is never cut short of its narration)."""
+    return max(1, math.ceil(round(duration * CLIP_FPS, 6)))
+
+def clip_command(image_path, audio_path, output_path, frames, ffmpeg_path="ffmpeg"):
+    """
+    Still image held for exactly `frames` frames, audio padded/trimmed to the same length.
+    Video and audio ending together in every clip is what keeps a stream-copy concat of
+    hundreds of clips in sync (otherwise each boundary adds the difference as drift).
+    Both lengths are set by trim filters: an output -frames:v limit ends the whole output
+    once the video is done, which can leave the clip without its audio stream.
+    """
+    w, h = CLIP_WIDTH, CLIP_HEIGHT
+    length = frames / CLIP_FPS
+    cmd = [ffmpeg_path, '-y', '-v', 'error', '-loop', '1', '-framerate', str(CLIP_FPS), '-i', image_path]
+    if audio_path:
+        cmd.extend(['-i', audio_path])
+    else:
+        cmd.extend(['-f', 'lavfi', '-i', 'anullsrc=r=48000:cl=stereo'])
+    cmd.extend([
+        '-filter_complex',
+        f"[0:v]scale={w}:{h}:force_original_aspect_ratio=decrease,"
+        f"pad={w}:{h}:(ow-iw)/2:(oh-ih)/2,setsar=1,format=yuv420p,trim=end_frame={frames}[v];"
+        f"[1:a]aformat=sample_rates=48000:channel_layouts=stereo,apad,atrim=end={length:.6f}[a]",
+        '-map', '[v]', '-map', '[a]',
+    ])
+    for key, value in CLIP_PROFILE.items():
+        cmd.extend([f'-{key}', value])
+    cmd.extend(['-movflags', '+faststart', output_path])
+    return cmd
+
+def has_audio_stream(path, ffmpeg_path="ffmpeg"):
+    ffprobe = ffmpeg_path.replace('ffmpeg.exe', 'ffprobe.exe').replace('ffmpeg', 'ffprobe')
+    result = subprocess.run([ffprobe, '-v', 'error', '-select_streams', 'a', '-show_entries', 'stream=index',
+                             '-of', 'csv=p=0', path],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
+    return bool(result.stdout.strip())
+
+def write_concat_list(paths, list_path):
+    with open(list_path, "w", encoding="utf-8") as f:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    return list_path
+
+def concat_command(list_path, output_path, ffmpeg_path="ffmpeg"):
+    """
+    Video is stream-copied. Audio is re-encoded: every AAC clip starts with its own encoder
+    priming, and copying those packets back to back would leave a click at every cut.
+    Decoding honours the priming skip, and re-encoding even an hour of AAC takes seconds.
+    """
+    return [ffmpeg_path, '-y', '-v', 'error', '-f', 'concat', '-safe', '0', '-i', list_path,
+            '-map', '0:v:0', '-map', '0:a:0', '-c:v', 'copy',
+            '-c:a', CLIP_PROFILE["c:a"], '-b:a', CLIP_PROFILE["b:a"],
+            '-movflags', '+faststart', output_path]
+
+class StoryboardExecutor:
+    """
+    Runs a storyboard's DAG with per-resource concurrency limits. Every node output is cached in
+    the media store under its input hash, and the run state is persisted after every node, so a
+    crashed or failed run resumes where it stopped and unchanged scenes are never regenerated.
+    Handlers are async callables (node, deps, out_stem, job) -> output path; main.py plugs in
+    the Whisk image generator, the default image handler renders a placeholder frame.
+    """
+    def __init__(self, runs_dir=None, limits=None):
+        self.runs_dir = runs_dir or STORYBOARD_RUNS_DIR
+        self.cache_dir = os.path.join(self.runs_dir, "cache")
+        self.limits = dict(RESOURCE_LIMITS, **(limits or {}))
+        self._semaphores = None
+        self.ffmpeg_path = ffmpeg_handler.ffmpeg_path
+        self.handlers = {
+            "image": self.placeholder_image,
+            "voice": self.voice,
+            "clip": self.clip,
+            "final": self.final,
+        }
+
+    def _semaphore(self, kind):
+        # Created lazily so they bind to the server's event loop
+        if self._semaphores is None:
+            self._semaphores = {k: asyncio.Semaphore(max(1, n)) for k, n in self.limits.items()}
+        return self._semaphores[kind]
+
+    # --- node cache ---
+
+    def _cache_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def cache_get(self, key):
+        path = self._cache_path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        # The blob may have been garbage-collected since
+        if not media_store.path_for(entry["digest"]):
+            return None
+        # The entry file's mtime is its last use, for LRU eviction
+        os.utime(path)
+        return entry
+
+    def _cache_entries(self):
+        """(last used, key) of every node cache entry, least recently used first."""
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".json"):
+                    try:
+                        entries.append((os.path.getmtime(os.path.join(root, name)), name[:-len(".json")]))
+                    except OSError:
+                        pass
+        return sorted(entries)
+
+    def cache_drop(self, key):
+        path = self._cache_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                digest = json.load(f)["digest"]
+            os.remove(path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[StoryboardDAG] Could not drop cache entry {key[:12]}: {e}")
+            return
+        media_store.release(digest, f"dag::{key}")
+
+    def evict_cache(self, keep_going):
+        """ArtifactManager cache evictor: drops least recently used entries while keep_going() holds."""
+        dropped = 0
+        for _, key in self._cache_entries():
+            if not keep_going():
+                break
+            self.cache_drop(key)
+            dropped += 1
+        if dropped:
+            print(f"[StoryboardDAG] Evicted {dropped} node cache entries")
+        return dropped
+
+    def prune_cache(self, max_age_s=NODE_CACHE_TTL_SECONDS):
+        """Drops entries unused for max_age_s. Returns how many."""
+        if max_age_s <= 0:
+            return 0
+        cutoff = time.time() - max_age_s
+        expired = [key for used, key in self._cache_entries() if used < cutoff]
+        for key in expired:
+            self.cache_drop(key)
+        if expired:
+            print(f"[StoryboardDAG] Pruned {len(expired)} node cache entries unused for {max_age_s / 86400:.0f} days")
+        return len(expired)
+
+    def cache_put(self, key, path, meta=None):
+        """Moves a node output into the media store (the work path becomes a link to the blob)."""
+        digest = media_store.put_file(path, owner=f"dag::{key}")
+        media_store.materialize(digest, path)
+        cache_path = self._cache_path(key)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"digest": digest, "ext": os.path.splitext(path)[1].lower(), "meta": meta or {},
+                       "created": time.time()}, f)
+        os.replace(tmp_path, cache_path)
+        return digest
+
+    # --- clip manifests ---
+
+    def _manifest_path(self, storyboard_id):
+        return os.path.join(self.runs_dir, "manifests", f"{_safe(storyboard_id)}.json")
+
+    def load_manifest(self, storyboard_id):
+        path = self._manifest_path(storyboard_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save_manifest(self, storyboard_id, run_id, nodes):
+        """
+        Per-scene clips of the last completed render, in order, keyed by their input hash.
+        The next render of the same storyboard compares against it to report what it reuses.
+        """
+        clips = nodes["final"].deps
+        manifest = {
+            "storyboard_id": storyboard_id,
+            "run_id": run_id,
+            "updated": time.time(),
+            "scenes": [{
+                "scene_id": clip_id.split(":", 1)[1], "key": nodes[clip_id].key,
+                "digest": nodes[clip_id].digest, "frames": nodes[clip_id].meta.get("frames"),
+            } for clip_id in clips],
+            "final_key": nodes["final"].key,
+            "final_digest": nodes["final"].digest,
+        }
+        path = self._manifest_path(storyboard_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        return manifest
+
+    @staticmethod
+    def incremental_plan(manifest, nodes):
+        """Which scene clips the previous render already has (same key) and which must be encoded."""
+        known = {s["key"] for s in (manifest or {}).get("scenes", [])}
+        clips = nodes["final"].deps
+        reused = [c.split(":", 1)[1] for c in clips if nodes[c].key in known]
+        changed = [c.split(":", 1)[1] for c in clips if nodes[c].key not in known]
+        return {"previous_run": (manifest or {}).get("run_id"), "reused": reused, "changed": changed}
+
+    # --- run state ---
+
+    def _run_dir(self, run_id):
+        return os.path.join(self.runs_dir, _safe(run_id))
+
+    def _state_path(self, run_id):
+        return os.path.join(self._run_dir(run_id), "state.json")
+
+    def save_run(self, state):
+        state["updated"] = time.time()
+        path = self._state_path(state["run_id"])
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def load_run(self, run_id):
+        path = self._state_path(run_id)
+        if not os.path.exists(path):
+            raise KeyError(f"Unknown storyboard run: {run_id}")
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def release_work_files(self, run_id):
+        """
+        Drops a finished run's node files, keeping state.json. Node outputs live on in the node
+        cache (media store), so a later resume or re-render materializes them again. Returns bytes freed.
+        """
+        run_dir = self._run_dir(run_id)
+        if not os.path.isdir(run_dir):
+            return 0
+        freed = 0
+        for entry in os.scandir(run_dir):
+            if entry.name == "state.json" or not entry.is_file():
+                continue
+            freed += entry.stat().st_size
+            media_store.release_path(entry.path)
+        return freed
+
+    def list_runs(self):
+        runs = []
+        if not os.path.isdir(self.runs_dir):
+            return runs
+        for name in sorted(os.listdir(self.runs_dir)):
+            if os.path.exists(os.path.join(self.runs_dir, name, "state.json")):
+                try:
+                    runs.append(self.load_run(name))
+                except (OSError, ValueError) as e:
+                    print(f"[StoryboardDAG] Unreadable run state {name}: {e}")
+        return runs
+
+    def interrupted_runs(self):
+        """Runs whose process died mid-execution (still marked running on disk)."""
+        return [r for r in self.list_runs() if r["status"] in ("queued", "running")]
+
+    def create_run(self, scenes, options=None, storyboard_id=None, run_id=None):
+        """Persists a new run. Scene image_path/audio_path files are stored by content so they hash like outputs."""
+        run_id = run_id or str(uuid.uuid4())
+        resolved = []
+        for scene in scenes:
+            scene = dict(scene)
+            for kind in ("image", "audio"):
+                path = scene.get(f"{kind}_path")
+                if path and os.path.exists(path):
+                    scene[f"{kind}_digest"] = media_store.put_file(path, owner=f"storyboard-run::{run_id}")
+                    scene[f"{kind}_ext"] = os.path.splitext(path)[1].lower()
+            resolved.append(scene)
+        nodes = build_graph(resolved, options)  # validates before anything is persisted
+        os.makedirs(self._run_dir(run_id), exist_ok=True)
+        state = {
+            "run_id": run_id,
+            "storyboard_id": storyboard_id,
+            "status": "queued",
+            "created": time.time(),
+            "options": options or {},
+            "scenes": resolved,
+            "nodes": {node_id: node.to_dict() for node_id, node in nodes.items()},
+            "output": None,
+            "error": None,
+        }
+        self.save_run(state)
+        return state
+
+    @staticmethod
+    def summary(state):
+        counts = {}
+        for node in state["nodes"].values():
+            counts[node["status"]] = counts.get(node["status"], 0) + 1
+        return counts
+
+    # --- execution ---
+
+    async def run(self, run_id, secrets=None, on_progress=None):
+        """
+        Executes (or resumes) a run. Nodes already finished with the same input hash keep their
+        outputs; everything else is served from the node cache or produced by its handler.
+        A failed node only blocks its dependents, so one bad scene doesn't stop the others.
+        """
+        state = self.load_run(run_id)
+        nodes = build_graph(state["scenes"], state["options"])
+        for node in nodes.values():
+            previous = state["nodes"].get(node.id)
+            if (previous and previous["status"] in DONE_STATES and previous["key"] == node.key
+                    and previous["output"] and os.path.exists(previous["output"])):
+                node.status, node.output, node.digest = previous["status"], previous["output"], previous["digest"]
+                node.meta = previous.get("meta") or {}
+        state["nodes"] = {node_id: node.to_dict() for node_id, node in nodes.items()}
+        state["status"], state["error"] = "running", None
+        manifest_id = state.get("storyboard_id") or run_id
+        state["incremental"] = self.incremental_plan(self.load_manifest(manifest_id), nodes)
+        if state["incremental"]["previous_run"]:
+            print(f"[StoryboardDAG] Run {run_id}: {len(state['incremental']['reused'])} scene clips reused, "
+                  f"{len(state['incremental']['changed'])} to encode")
+        self.save_run(state)
+
+        job = {"run_id": run_id, "work_dir": self._run_dir(run_id), "options": state["options"],
+               "secrets": secrets or {}}
+
+        def record(node):
+            state["nodes"][node.id] = node.to_dict()
+            self.save_run(state)
+            if on_progress:
+                on_progress(state)
+
+        tasks = {}
+        for node in nodes.values():
+            # Topological order: every dependency already has its task
+            tasks[node.id] = asyncio.ensure_future(
+                self._run_node(node, [tasks[d] for d in node.deps], nodes, job, record))
+        await asyncio.gather(*tasks.values())
+
+        final = nodes["final"]
+        failed = [n for n in nodes.values() if n.status == "failed"]
+        if final.status in DONE_STATES:
+            state["status"] = "completed"
+            state["output"] = final.output
+            output_path = state["options"].get("output_path")
+            if output_path:
+                await asyncio.to_thread(media_store.materialize, final.digest, output_path)
+                state["output"] = output_path
+            self.save_manifest(manifest_id, run_id, nodes)
+        else:
+            state["status"] = "failed"
+            state["error"] = "; ".join(f"{n.id}: {n.error}" for n in failed[:5]) or final.error
+        self.save_run(state)
+        print(f"[StoryboardDAG] Run {run_id} {state['status']}: {self.summary(state)}")
+        return state
+
+    async def _run_node(self, node, dep_tasks, nodes, job, record):
+        if dep_tasks:
+            await asyncio.gather(*dep_tasks)
+        if node.status in DONE_STATES:
+            return
+        deps = [nodes[d] for d in node.deps]
+        broken = [d.id for d in deps if d.status not in DONE_STATES]
+        if broken:
+            node.status, node.error = "blocked", f"upstream failed: {', '.join(broken[:3])}"
+            record(node)
+            return
+
+        out_stem = os.path.join(job["work_dir"], f"{_safe(node.id)}_{node.key[:12]}")
+        started = time.monotonic()
+        entry = await asyncio.to_thread(self.cache_get, node.key)
+        cache_result("dag_node", bool(entry))
+        if entry:
+            node.output = out_stem + entry["ext"]
+            await asyncio.to_thread(media_store.materialize, entry["digest"], node.output)
+            node.status, node.digest, node.meta = "cached", entry["digest"], entry.get("meta") or {}
+            node.seconds = round(time.monotonic() - started, 3)
+            record(node)
+            return
+
+        async with self._semaphore(node.kind):
+            node.status = "running"
+            record(node)
+            started = time.monotonic()
+            while True:
+                node.attempts += 1
+                try:
+                    if "digest" in node.params:
+                        # Media supplied with the storyboard: nothing to generate
+                        output = out_stem + node.params["ext"]
+                        await asyncio.to_thread(media_store.materialize, node.params["digest"], output)
+                    else:
+                        output = await self.handlers[node.kind](node, deps, out_stem, job)
+                    node.digest = await asyncio.to_thread(self.cache_put, node.key, output, node.meta)
+                    node.output, node.status, node.error = output, "done", None
+                    break
+                except Exception as e:
+                    node.error = str(e)
+                    print(f"[StoryboardDAG] {job['run_id']} {node.id} attempt {node.attempts} failed: {e}")
+                    if node.attempts >= NODE_ATTEMPTS:
+                        node.status = "failed"
+                        break
+            node.seconds = round(time.monotonic() - started, 3)
+        NODE_SECONDS.observe(node.seconds, kind=node.kind, status=node.status)
+        record(node)
+
+    # --- default handlers ---
+
+    async def placeholder_image(self, node, deps, out_stem, job):
+        """Flat frame with the prompt's hash as colour; lets the rest of the DAG run without Whisk."""
+        output = out_stem + ".png"
+        color = hashlib.sha1(node.params.get("prompt", "").encode("utf-8")).hexdigest()[:6]
+        await asyncio.to_thread(subprocess.run, [
+            self.ffmpeg_path, '-y', '-v', 'error', '-f', 'lavfi',
+            '-i', f"color=c=0x{color}:s={CLIP_WIDTH}x{CLIP_HEIGHT}", '-frames:v', '1', output
+        ], check=True)
+        return output
+
+    async def voice(self, node, deps, out_stem, job):
+        audio = await ai_handler.agenerate_voice(node.params["text"], voice_id=node.params.get("voice_id"),
+                                                 api_key=job["secrets"].get("eleven_key"))
+        output = out_stem + ".mp3"
+        with open(output, "wb") as f:
+            f.write(audio)
+        return output
+
+    async def clip(self, node, deps, out_stem, job):
+        by_kind = {d.kind: d.output for d in deps}
+        voice = by_kind.get("voice")
+        duration = (await asyncio.to_thread(sync_logic.get_duration, voice, self.ffmpeg_path)
+                    if voice else SILENT_SCENE_SECONDS)
+        frames = clip_frames(duration or SILENT_SCENE_SECONDS)
+        node.meta = {"frames": frames, "duration": round(frames / CLIP_FPS, 6)}
+        output = out_stem + ".mp4"
+        await render_queue.run(job["run_id"], clip_command(by_kind["image"], voice, output, frames, self.ffmpeg_path),
+                               inputs={k: v for k, v in by_kind.items() if v}, outputs={"clip": output},
+                               duration=node.meta["duration"], label="clip")
+        # The final concat maps 0:a:0 from every clip: a clip without audio fails here, where it is retried
+        if not await asyncio.to_thread(has_audio_stream, output, self.ffmpeg_path):
+            raise RuntimeError(f"Clip {node.id} was rendered without an audio stream")
+        return output
+
+    async def final(self, node, deps, out_stem, job):
+        output = out_stem + ".mp4"
+        list_path = write_concat_list([d.output for d in deps], out_stem + ".txt")
+        # No video re-encode: cheap enough to run here rather than on a render worker
+        await asyncio.to_thread(subprocess.run, concat_command(list_path, output, self.ffmpeg_path), check=True)
+        return output
+
+storyboard_executor = StoryboardExecutor()
@@ -0,0 +1,176 @@
+
+import os
+import re
+import json
+import hashlib
+import difflib
+
+SNAPSHOT_DIR = os.getenv(
+    "STORYBOARD_SNAPSHOT_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "storyboard_snapshots")
+)
+
+# Which generation stages depend on which scene field
+STAGE_FIELDS = {
+    "image": "prompt",
+    "voice": "content",
+}
+
+def _fingerprint(scene):
+    raw = f"{scene.get('prompt', '').strip()}\x1f{scene.get('content', '').strip()}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+def _changed_fields(old, new):
+    return [f for f in ("prompt", "content", "timecode") if (old.get(f) or "").strip() != (new.get(f) or "").strip()]
+
+def _scene_key(scene):
+    # Keys are only unique within a sheet ("1", "2", ... restart on every tab)
+    return (scene.get("sheet") or "", scene.get("key"))
+
+def _fill_sheets(scenes, default):
+    # Snapshots from before every scene carried its sheet left it off the first (or only) tab
+    for scene in scenes:
+        if not scene.get("sheet"):
+            scene["sheet"] = default
+
+def _requeue_for(changed):
+    return [stage for stage, field in STAGE_FIELDS.items() if field in changed]
+
+class StoryboardDiff:
+    """
+    Incremental storyboard re-import.
+    Scenes get stable ids from a keyed column ('ID', '씬 번호', ...) when the sheet has one,
+    otherwise from their content; re-imports are diffed against the last stored snapshot
+    so only scenes whose prompt/content changed are re-queued for image/voice generation.
+    """
+    def __init__(self, snapshot_dir=None):
+        self.snapshot_dir = snapshot_dir or SNAPSHOT_DIR
+
+    def _snapshot_path(self, storyboard_id):
+        safe = re.sub(r"[^\w.-]", "_", storyboard_id)
+        return os.path.join(self.snapshot_dir, f"{safe}.json")
+
+    def load_snapshot(self, storyboard_id):
+        path = self._snapshot_path(storyboard_id)
+        if not os.path.exists(path):
+            return []
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get("scenes", [])
+
+    def save_snapshot(self, storyboard_id, scenes):
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        path = self._snapshot_path(storyboard_id)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"storyboard_id": storyboard_id, "scenes": scenes}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def diff(self, old_scenes, new_scenes):
+        """
+        Annotates new_scenes in place with a stable "id", "change"
+        ("unchanged" | "modified" | "retimed" | "inserted") and "requeue" (stages to regenerate).
+        "retimed" scenes only moved on the timeline: nothing to regenerate, but the edit needs them.
+        Returns the list of deleted old scenes.
+        """
+        keyed = bool(new_scenes) and all(s.get("key") for s in new_scenes)
+        first_sheet = next((s["sheet"] for s in list(new_scenes) + list(old_scenes) if s.get("sheet")), "")
+        _fill_sheets(old_scenes, first_sheet)
+        _fill_sheets(new_scenes, first_sheet)
+        if keyed:
+            pairs, deleted = self._match_by_key(old_scenes, new_scenes)
+        else:
+            pairs, deleted = self._match_by_content(old_scenes, new_scenes)
+
+        used_ids = set()
+        for old, new in pairs:
+            if old is None:
+                continue
+            new["id"] = old["id"]
+            used_ids.add(old["id"])
+
+        for old, new in pairs:
+            if old is None:
+                new["change"] = "inserted"
+                new["requeue"] = list(STAGE_FIELDS.keys())
+                new["id"] = self._new_id(new, keyed, used_ids)
+                used_ids.add(new["id"])
+            else:
+                changed = _changed_fields(old, new)
+                new["changed_fields"] = changed
+                new["requeue"] = _requeue_for(changed)
+                if new["requeue"]:
+                    new["change"] = "modified"
+                else:
+                    new["change"] = "retimed" if changed else "unchanged"
+            new["status"] = "pending" if new["requeue"] else new["change"]
+
+        return deleted
+
+    def _new_id(self, scene, keyed, used_ids):
+        base = f"scene_{scene['key']}" if keyed else f"scene_{_fingerprint(scene)[:10]}"
+        candidate = base
+        n = 2
+        # Duplicate rows (same prompt + content) still need distinct ids
+        while candidate in used_ids:
+            candidate = f"{base}_{n}"
+            n += 1
+        return candidate
+
+    def _match_by_key(self, old_scenes, new_scenes):
+        old_by_key = {_scene_key(s): s for s in old_scenes if s.get("key")}
+        pairs = [(old_by_key.pop(_scene_key(s), None), s) for s in new_scenes]
+        return pairs, list(old_by_key.values())
+
+    def _match_by_content(self, old_scenes, new_scenes):
+        # Align rows like a text diff: equal runs are unchanged, replaced runs are paired
+        # positionally as modified, and any surplus becomes inserts/deletes.
+        old_fps = [_fingerprint(s) for s in old_scenes]
+        new_fps = [_fingerprint(s) for s in new_scenes]
+        matcher = difflib.SequenceMatcher(None, old_fps, new_fps, autojunk=False)
+
+        pairs = []
+        deleted = []
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            olds = old_scenes[i1:i2]
+            news = new_scenes[j1:j2]
+            if tag == "equal" or tag == "replace":
+                common = min(len(olds), len(news))
+                pairs.extend(zip(olds[:common], news[:common]))
+                pairs.extend((None, s) for s in news[common:])
+                deleted.extend(olds[common:])
+            elif tag == "insert":
+                pairs.extend((None, s) for s in news)
+            elif tag == "delete":
+                deleted.extend(olds)
+
+        order = {id(s): i for i, s in enumerate(new_scenes)}
+        pairs.sort(key=lambda p: order[id(p[1])])
+        return pairs, deleted
+
+    def reimport(self, storyboard_id, scenes, save=True):
+        """
+        Diffs freshly parsed scenes against the last import of the same storyboard
+        and (by default) stores them as the new snapshot.
+        """
+        old_scenes = self.load_snapshot(storyboard_id)
+        deleted = self.diff(old_scenes, scenes)
+
+        summary = {"unchanged": 0, "modified": 0, "retimed": 0, "inserted": 0, "deleted": len(deleted)}
+        for s in scenes:
+            summary[s["change"]] += 1
+
+        if save:
+            self.save_snapshot(storyboard_id, [
+                {k: s.get(k) for k in ("id", "key", "index", "timecode", "content", "prompt", "sheet") if s.get(k) is not None}
+                for s in scenes
+            ])
+
+        return {
+            "storyboard_id": storyboard_id,
+            "scenes": scenes,
+            "deleted": [{"id": s["id"], "index": s.get("index")} for s in deleted],
+            "requeue": [s["id"] for s in scenes if s["requeue"]],
+            "summary": summary
+        }
+
+storyboard_diff = StoryboardDiff()
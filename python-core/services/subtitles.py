@@ -0,0 +1,236 @@
+
+import os
+import re
+import subprocess
+import unicodedata
+
+from services.chunked_encoder import CHUNK_START
+
+# "off", "burn" (rendered into the frames by the final encode) or "soft" (mov_text track + .vtt sidecar)
+SUBTITLE_MODE = os.getenv("SUBTITLE_MODE", "off")
+SUBTITLE_MODES = ("off", "burn", "soft")
+# "target": the translated narration (timed on the TTS track); "source": the transcript's own words
+SUBTITLE_LANGS = ("target", "source")
+SUBTITLE_FONT = os.getenv("SUBTITLE_FONT", "Noto Sans CJK KR")
+SUBTITLE_FONTS_DIR = os.getenv("SUBTITLE_FONTS_DIR", "")
+# Longest cue in display columns (CJK characters count 2), i.e. two lines on a 9:16 frame
+SUBTITLE_MAX_COLUMNS = int(os.getenv("SUBTITLE_MAX_COLUMNS", "50"))
+# Pause between source words that always starts a new cue
+SUBTITLE_MAX_GAP = 0.7
+
+SENTENCE_END = re.compile(r"(?<=[.!?。！？…])\s+|(?<=[。！？])|\n+")
+CLAUSE_END = re.compile(r"(?<=[,，、;；:：])\s*")
+
+def _is_wide(ch):
+    return unicodedata.east_asian_width(ch) in ("W", "F")
+
+def display_width(text):
+    return sum(2 if _is_wide(ch) else 1 for ch in text)
+
+def _unspaced(ch):
+    # Japanese/Chinese run words together; Hangul is wide too but space-separated
+    return _is_wide(ch) and not ("\uac00" <= ch <= "\ud7af" or "\u1100" <= ch <= "\u11ff" or "\u3130" <= ch <= "\u318f")
+
+def join_text(left, right):
+    """Joins two pieces of text with a space, except between characters of unspaced scripts."""
+    if not left:
+        return right
+    if not right:
+        return left
+    if _unspaced(left[-1]) and _unspaced(right[0]):
+        return left + right
+    return f"{left} {right}"
+
+def _hard_split(text, width):
+    parts, current = [], ""
+    for ch in text:
+        if current and display_width(current + ch) > width:
+            parts.append(current)
+            current = ""
+        current += ch
+    if current:
+        parts.append(current)
+    return parts
+
+def _pack(pieces, width):
+    """Greedy packing of pieces into strings of at most width columns."""
+    cues, current = [], ""
+    for piece in pieces:
+        candidate = join_text(current, piece)
+        if display_width(candidate) <= width:
+            current = candidate
+            continue
+        if current:
+            cues.append(current)
+        if display_width(piece) <= width:
+            current = piece
+        else:
+            *full, current = _hard_split(piece, width)
+            cues.extend(full)
+    if current:
+        cues.append(current)
+    return cues
+
+def split_cues(text, max_columns=SUBTITLE_MAX_COLUMNS):
+    """Sentence, then clause, then word (or character, for unspaced scripts) boundaries."""
+    cues = []
+    for sentence in SENTENCE_END.split(text or ""):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if display_width(sentence) <= max_columns:
+            cues.append(sentence)
+            continue
+        # Whole clauses where they fit, so cues break at commas before they break mid-phrase
+        pieces = []
+        for clause in CLAUSE_END.split(sentence):
+            clause = clause.strip()
+            if display_width(clause) <= max_columns:
+                pieces.append(clause)
+            else:
+                pieces.extend(clause.split())
+        cues.extend(_pack([p for p in pieces if p], max_columns))
+    return cues
+
+def cues_from_text(text, start, end, max_columns=SUBTITLE_MAX_COLUMNS):
+    """
+    Translated narration over [start, end] of the dubbed track. TTS reads at an even pace, so each
+    cue gets time in proportion to its length (display columns approximate syllables across scripts).
+    """
+    lines = split_cues(text, max_columns)
+    weights = [max(1, display_width(re.sub(r"\s+", "", line))) for line in lines]
+    total = sum(weights)
+    cues, t = [], float(start)
+    for line, weight in zip(lines, weights):
+        duration = (end - start) * weight / total
+        cues.append({"start": round(t, 3), "end": round(t + duration, 3), "text": line})
+        t += duration
+    return cues
+
+def cues_from_words(words, max_columns=SUBTITLE_MAX_COLUMNS, max_gap=SUBTITLE_MAX_GAP, time_scale=1.0):
+    """
+    Source-language cues straight from word timestamps: a new cue at sentence ends, long pauses
+    or max_columns. time_scale maps source time onto the output (the sync step's setpts factor).
+    """
+    cues, current = [], None
+    for w in words:
+        token = (w.get("word") or "").strip()
+        if not token:
+            continue
+        if current and (w["start"] - current["end"] > max_gap
+                        or display_width(join_text(current["text"], token)) > max_columns):
+            cues.append(current)
+            current = None
+        if current is None:
+            current = {"start": w["start"], "end": w["end"], "text": token}
+        else:
+            current["text"] = join_text(current["text"], token)
+            current["end"] = w["end"]
+        if token[-1] in ".!?。！？":
+            cues.append(current)
+            current = None
+    if current:
+        cues.append(current)
+    return [{"start": round(c["start"] * time_scale, 3), "end": round(c["end"] * time_scale, 3), "text": c["text"]}
+            for c in cues]
+
+def _ass_time(seconds):
+    cs = int(round(seconds * 100))
+    h, rem = divmod(cs, 360000)
+    m, rem = divmod(rem, 6000)
+    s, cs = divmod(rem, 100)
+    return f"{h}:{m:02d}:{s:02d}.{cs:02d}"
+
+def _vtt_time(seconds):
+    ms = int(round(seconds * 1000))
+    h, rem = divmod(ms, 3600000)
+    m, rem = divmod(rem, 60000)
+    s, ms = divmod(rem, 1000)
+    return f"{h:02d}:{m:02d}:{s:02d}.{ms:03d}"
+
+def _wrap(text, columns):
+    """Explicit line breaks: libass can't wrap unspaced CJK text on its own."""
+    lines, current = [], ""
+    for piece in (text.split() if " " in text else _hard_split(text, columns)):
+        candidate = join_text(current, piece)
+        if current and display_width(candidate) > columns:
+            lines.append(current)
+            current = piece
+        else:
+            current = candidate
+    if current:
+        lines.append(current)
+    return lines
+
+def write_ass(cues, path, width, height, font=SUBTITLE_FONT):
+    """One ASS file per output geometry, so font size and margins are in that frame's pixels."""
+    size = round(min(width, height) * 0.06)
+    # Shorts players put their UI over the bottom of a portrait frame
+    margin_v = round(height * (0.18 if height > width else 0.06))
+    columns = max(10, int(width * 0.9 / (size * 0.55)))
+    lines = [
+        "[Script Info]",
+        "ScriptType: v4.00+",
+        f"PlayResX: {width}",
+        f"PlayResY: {height}",
+        "WrapStyle: 2",
+        "ScaledBorderAndShadow: yes",
+        "",
+        "[V4+ Styles]",
+        "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, "
+        "Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, "
+        "Alignment, MarginL, MarginR, MarginV, Encoding",
+        f"Style: Default,{font},{size},&H00FFFFFF,&H000000FF,&H00000000,&H80000000,"
+        f"-1,0,0,0,100,100,0,0,1,{max(2, size // 14)},1,2,{round(width * 0.05)},{round(width * 0.05)},{margin_v},1",
+        "",
+        "[Events]",
+        "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text",
+    ]
+    for cue in cues:
+        # Braces start ASS override blocks
+        text = cue["text"].replace("{", "(").replace("}", ")")
+        text = r"\N".join(_wrap(text, columns))
+        lines.append(f"Dialogue: 0,{_ass_time(cue['start'])},{_ass_time(cue['end'])},Default,,0,0,0,,{text}")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    return path
+
+def write_vtt(cues, path):
+    lines = ["WEBVTT", ""]
+    for i, cue in enumerate(cues, 1):
+        lines.extend([str(i), f"{_vtt_time(cue['start'])} --> {_vtt_time(cue['end'])}", cue["text"], ""])
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+    return path
+
+def _filter_path(path):
+    # Filter option values: ':' separates options and '\' escapes (Windows drive letters)
+    return path.replace("\\", "/").replace(":", "\\:").replace("'", "")
+
+def burn_chain(in_label, out_label, ass_path, chunked=False):
+    """
+    [in_label] with the ASS track rendered on top. Chunked renders restart timestamps at 0 in
+    every segment, so the chunk's start time is added back for libass and removed afterwards.
+    """
+    fonts = f":fontsdir='{_filter_path(SUBTITLE_FONTS_DIR)}'" if SUBTITLE_FONTS_DIR else ""
+    burn = f"ass=filename='{_filter_path(ass_path)}'{fonts}"
+    if chunked:
+        burn = f"setpts=PTS+{CHUNK_START}/TB,{burn},setpts=PTS-STARTPTS"
+    return f"[{in_label}]{burn}[{out_label}]"
+
+def probe_size(video_path, ffmpeg_path="ffmpeg"):
+    ffprobe = ffmpeg_path.replace('ffmpeg.exe', 'ffprobe.exe').replace('ffmpeg', 'ffprobe')
+    result = subprocess.run([ffprobe, '-v', 'error', '-select_streams', 'v:0',
+                             '-show_entries', 'stream=width,height', '-of', 'csv=p=0', video_path],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
+    width, height = result.stdout.strip().split(",")[:2]
+    return int(width), int(height)
+
+def mux_command(video_path, subtitle_path, output_path, ffmpeg_path="ffmpeg", language=None):
+    """Soft subtitles: adds a mov_text track to a finished MP4 with every other stream copied."""
+    cmd = [ffmpeg_path, '-y', '-v', 'error', '-i', video_path, '-i', subtitle_path,
+           '-map', '0', '-map', '1:0', '-c', 'copy', '-c:s', 'mov_text']
+    if language:
+        cmd.extend(['-metadata:s:s:0', f'language={language}'])
+    cmd.extend(['-movflags', '+faststart', output_path])
+    return cmd
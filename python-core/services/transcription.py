@@ -0,0 +1,260 @@
+
+import os
+import struct
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from services.ai_handler import ai_handler
+from services.subtitles import join_text
+
+# Whisper rejects uploads above 25 MB; chunks are sized well below it after encoding
+MAX_CHUNK_SECONDS = float(os.getenv("TRANSCRIBE_MAX_CHUNK_SECONDS", "600"))
+MIN_CHUNK_SECONDS = float(os.getenv("TRANSCRIBE_MIN_CHUNK_SECONDS", "120"))
+TRANSCRIBE_CONCURRENCY = int(os.getenv("TRANSCRIBE_CONCURRENCY", "4"))
+
+# Chunk encodings accepted by the Whisper endpoint
+CHUNK_CODECS = {
+    "opus": {"ext": ".ogg", "args": ['-c:a', 'libopus', '-b:a', '24k', '-application', 'voip']},
+    "flac": {"ext": ".flac", "args": ['-c:a', 'flac', '-compression_level', '5']},
+}
+
+class Transcript:
+    """Merged transcript. Mirrors the verbose_json fields the pipeline reads."""
+    def __init__(self, text="", words=None, segments=None, language=None, duration=0.0):
+        self.text = text
+        self.words = words or []
+        self.segments = segments or []
+        self.language = language
+        self.duration = duration
+
+    def to_dict(self):
+        return {
+            "text": self.text,
+            "words": self.words,
+            "segments": self.segments,
+            "language": self.language,
+            "duration": self.duration
+        }
+
+def _field(obj, name, default=None):
+    # SDK objects expose attributes, cached/stub results are plain dicts
+    if isinstance(obj, dict):
+        return obj.get(name, default)
+    return getattr(obj, name, default)
+
+def read_wav_header(wav_path):
+    """
+    Returns (sample_rate, channels, bits, data_offset, n_frames) by walking RIFF chunks,
+    so the sample data can be memory-mapped instead of read.
+    """
+    with open(wav_path, "rb") as f:
+        riff, _, wave_id = struct.unpack("<4sI4s", f.read(12))
+        if riff != b"RIFF" or wave_id != b"WAVE":
+            raise ValueError(f"Not a RIFF/WAVE file: {wav_path}")
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"No data chunk in {wav_path}")
+            chunk_id, size = struct.unpack("<4sI", header)
+            if chunk_id == b"fmt ":
+                audio_format, channels, sample_rate, _, block_align, bits = struct.unpack("<HHIIHH", f.read(16))
+                f.seek(size - 16 + (size & 1), 1)
+                fmt = (audio_format, channels, sample_rate, block_align, bits)
+            elif chunk_id == b"data":
+                if fmt is None:
+                    raise ValueError(f"data chunk before fmt chunk in {wav_path}")
+                audio_format, channels, sample_rate, block_align, bits = fmt
+                if audio_format != 1 or bits != 16:
+                    raise ValueError(f"Expected 16-bit PCM WAV, got format={audio_format} bits={bits}")
+                offset = f.tell()
+                # Streamed WAVs may carry a placeholder size; trust the file length instead
+                available = os.path.getsize(wav_path) - offset
+                data_size = min(size, available) if size else available
+                return sample_rate, channels, bits, offset, data_size // block_align
+            else:
+                f.seek(size + (size & 1), 1)
+
+def frame_db(pcm, frame_len):
+    """RMS energy (dBFS) per whole frame of mono s16le PCM; a trailing partial frame is ignored."""
+    import numpy as np
+
+    samples = np.frombuffer(pcm, dtype="<i2")
+    usable = (len(samples) // frame_len) * frame_len
+    frames = samples[:usable].astype(np.float32).reshape(-1, frame_len) / 32768.0
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-9))
+
+def find_silences(db, frame_s, threshold_db=-40.0, min_silence_s=0.3):
+    """Returns [(start_s, end_s)] runs where energy stays below threshold_db."""
+    import numpy as np
+
+    if len(db) == 0:
+        return []
+    quiet = (db < threshold_db).astype(np.int8)
+    # Run boundaries via diff on a zero-padded mask
+    edges = np.diff(np.concatenate(([0], quiet, [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    min_frames = int(min_silence_s / frame_s)
+    keep = (ends - starts) >= min_frames
+    return [(float(s * frame_s), float(e * frame_s)) for s, e in zip(starts[keep], ends[keep])]
+
+def plan_chunks(duration, silences, max_chunk_s=MAX_CHUNK_SECONDS, min_chunk_s=MIN_CHUNK_SECONDS):
+    """
+    Greedy split: each chunk ends at the middle of the latest silence that keeps it
+    under max_chunk_s (but not shorter than min_chunk_s); hard cut if there is none.
+    """
+    mids = [(s + e) / 2 for s, e in silences]
+    chunks = []
+    start = 0.0
+    while duration - start > max_chunk_s:
+        limit = start + max_chunk_s
+        candidates = [m for m in mids if start + min_chunk_s <= m <= limit]
+        cut = candidates[-1] if candidates else limit
+        chunks.append((start, cut))
+        start = cut
+    chunks.append((start, duration))
+    return chunks
+
+def iter_wav_pcm(wav_path, block_seconds=60):
+    """Yields raw PCM blocks from a memory-mapped 16-bit WAV (same shape as a pipe stream)."""
+    import numpy as np
+
+    sample_rate, channels, _, offset, n_frames = read_wav_header(wav_path)
+    samples = np.memmap(wav_path, dtype="<i2", mode="r", offset=offset, shape=(n_frames * channels,))
+    block_len = int(sample_rate * block_seconds) * channels
+    for start in range(0, len(samples), block_len):
+        yield samples[start:start + block_len].tobytes()
+
+class ChunkedTranscriber:
+    """
+    Long-audio STT: silence-aware split -> compact encode -> concurrent Whisper calls -> merged timestamps.
+    Consumes 16 kHz mono s16le PCM as a stream: chunks are cut and uploaded while
+    extraction is still running, and nothing touches disk unless a cache WAV is requested.
+    """
+    def __init__(self, ffmpeg_path="ffmpeg", codec="opus", concurrency=TRANSCRIBE_CONCURRENCY):
+        self.ffmpeg_path = ffmpeg_path
+        self.codec = codec
+        self.concurrency = concurrency
+
+    def encode_pcm(self, pcm, sample_rate=16000):
+        """Encodes a PCM chunk in memory (stdin -> stdout), returns the compressed bytes."""
+        fmt = "ogg" if self.codec == "opus" else self.codec
+        cmd = [
+            self.ffmpeg_path, '-v', 'error',
+            '-f', 's16le', '-ar', str(sample_rate), '-ac', '1', '-i', 'pipe:0',
+            *CHUNK_CODECS[self.codec]["args"],
+            '-f', fmt, 'pipe:1'
+        ]
+        result = subprocess.run(cmd, input=pcm, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+        return result.stdout
+
+    def transcribe(self, wav_path, api_key=None):
+        """Transcribes an existing WAV file (e.g. a cached extraction)."""
+        sample_rate, channels = read_wav_header(wav_path)[:2]
+        if channels != 1:
+            raise ValueError(f"Expected mono WAV for transcription, got {channels} channels")
+        return self.transcribe_stream(iter_wav_pcm(wav_path), api_key=api_key, sample_rate=sample_rate)
+
+    def transcribe_stream(self, pcm_stream, api_key=None, sample_rate=16000, cache_wav_path=None,
+                          threshold_db=-40.0, min_silence_s=0.3, frame_ms=20):
+        """
+        pcm_stream: iterable of mono s16le byte blocks (ffmpeg stdout or iter_wav_pcm).
+        cache_wav_path: optionally tee the PCM into a WAV file while consuming it.
+        """
+        import numpy as np
+
+        frame_len = int(sample_rate * frame_ms / 1000)
+        frame_bytes = frame_len * 2
+        frame_s = frame_ms / 1000.0
+        max_bytes = int(MAX_CHUNK_SECONDS * sample_rate) * 2
+
+        ext = CHUNK_CODECS[self.codec]["ext"]
+        pool = ThreadPoolExecutor(max_workers=max(1, self.concurrency))
+        futures = []
+        chunks = []
+
+        def upload(i, pcm):
+            data = self.encode_pcm(pcm, sample_rate)
+            return ai_handler.transcribe((f"chunk_{i:04d}{ext}", data), api_key=api_key)
+
+        def submit(pcm, offset):
+            chunks.append((offset, offset + len(pcm) / 2 / sample_rate))
+            futures.append(pool.submit(upload, len(futures), bytes(pcm)))
+
+        cache = None
+        if cache_wav_path:
+            import wave
+            cache = wave.open(cache_wav_path, "wb")
+            cache.setnchannels(1)
+            cache.setsampwidth(2)
+            cache.setframerate(sample_rate)
+
+        buffer = bytearray()   # PCM since the last cut
+        db = np.zeros(0, dtype=np.float32)  # envelope of the whole frames in buffer
+        offset = 0.0
+        total_bytes = 0
+        try:
+            for block in pcm_stream:
+                if not block:
+                    continue
+                if cache:
+                    cache.writeframes(block)
+                total_bytes += len(block)
+                analyzed = (len(buffer) // frame_bytes) * frame_bytes
+                buffer.extend(block)
+                whole = (len(buffer) // frame_bytes) * frame_bytes
+                if whole > analyzed:
+                    db = np.concatenate([db, frame_db(bytes(buffer[analyzed:whole]), frame_len)])
+
+                while len(buffer) >= max_bytes:
+                    # Cut at the latest silence between MIN and MAX chunk length, else hard cut at MAX
+                    buffered_s = len(buffer) / 2 / sample_rate
+                    silences = find_silences(db, frame_s, threshold_db, min_silence_s)
+                    cut_s = plan_chunks(buffered_s, silences)[0][1]
+                    cut_frames = int(cut_s / frame_s)
+                    cut_bytes = cut_frames * frame_bytes
+                    submit(buffer[:cut_bytes], offset)
+                    offset += cut_bytes / 2 / sample_rate
+                    del buffer[:cut_bytes]
+                    db = db[cut_frames:]
+
+            if buffer:
+                submit(buffer, offset)
+            results = [f.result() for f in futures]
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+            if cache:
+                cache.close()
+
+        duration = total_bytes / 2 / sample_rate
+        print(f"[Transcribe] {duration:.1f}s audio -> {len(chunks)} chunk(s) ({self.codec})")
+        return self.merge(results, chunks, duration)
+
+    def merge(self, results, chunks, duration):
+        """Concatenates chunk transcripts, shifting word/segment timestamps by chunk offset."""
+        text, words, segments = "", [], []
+        language = None
+        for result, (offset, _) in zip(results, chunks):
+            # Script-aware: Japanese/Chinese chunks continue without an inserted space
+            text = join_text(text, (_field(result, "text") or "").strip())
+            language = language or _field(result, "language")
+            for w in _field(result, "words") or []:
+                words.append({
+                    "word": _field(w, "word"),
+                    "start": round(_field(w, "start", 0.0) + offset, 3),
+                    "end": round(_field(w, "end", 0.0) + offset, 3)
+                })
+            for seg in _field(result, "segments") or []:
+                segments.append({
+                    "id": len(segments),
+                    "text": _field(seg, "text"),
+                    "start": round(_field(seg, "start", 0.0) + offset, 3),
+                    "end": round(_field(seg, "end", 0.0) + offset, 3)
+                })
+        return Transcript(text, words, segments, language, duration)
+
+from services.ffmpeg_handler import ffmpeg_handler
+
+chunked_transcriber = ChunkedTranscriber(ffmpeg_path=ffmpeg_handler.ffmpeg_path)
@@ -0,0 +1,112 @@
+
+import os
+import re
+import subprocess
+
+from services.ffmpeg_handler import ffmpeg_handler
+from services.sync_logic import sync_logic
+
+# "sync": trim only the silence that keeps the TTS longer than the video (default)
+# "all":  trim leading/trailing silence down to TTS_TRIM_PAD_MS regardless of the video
+# "off":  analyse and report only
+TTS_TRIM_MODE = os.getenv("TTS_TRIM_MODE", "sync")
+# Speech is anything within TTS_SPEECH_RANGE_DB of the loudest frame (and above the floor)
+TTS_SPEECH_RANGE_DB = float(os.getenv("TTS_SPEECH_RANGE_DB", "40"))
+TTS_SILENCE_FLOOR_DB = float(os.getenv("TTS_SILENCE_FLOOR_DB", "-55"))
+# Silence kept around the speech so onsets/decays aren't clipped
+TTS_TRIM_PAD_S = float(os.getenv("TTS_TRIM_PAD_MS", "80")) / 1000
+ANALYSIS_RATE = 16000
+FRAME_MS = 10
+# Shorter trims aren't worth a remux
+MIN_TRIM_S = 0.05
+
+def speech_bounds(pcm, sample_rate=ANALYSIS_RATE, frame_ms=FRAME_MS):
+    """
+    Speech start/end and voiced seconds of mono s16le PCM (bytes or int16 array), from a
+    vectorized per-frame RMS envelope. Returns (start_s, end_s, voiced_s, duration_s).
+    """
+    import numpy as np
+
+    samples = np.frombuffer(pcm, dtype="<i2") if isinstance(pcm, (bytes, bytearray)) else np.asarray(pcm)
+    duration = len(samples) / sample_rate
+    frame_len = max(1, sample_rate * frame_ms // 1000)
+    usable = len(samples) // frame_len * frame_len
+    if usable == 0:
+        return 0.0, duration, 0.0, duration
+    frames = samples[:usable].astype(np.float32).reshape(-1, frame_len) / 32768.0
+    db = 10 * np.log10(np.maximum(np.mean(frames * frames, axis=1), 1e-12))
+    threshold = max(TTS_SILENCE_FLOOR_DB, float(db.max()) - TTS_SPEECH_RANGE_DB)
+    voiced = np.flatnonzero(db > threshold)
+    if len(voiced) == 0:
+        return 0.0, duration, 0.0, duration
+    frame_s = frame_len / sample_rate
+    return float(voiced[0] * frame_s), float((voiced[-1] + 1) * frame_s), float(len(voiced) * frame_s), duration
+
+def count_units(text):
+    """Words for space-separated text; characters for unspaced scripts (ja/zh), where words aren't delimited."""
+    text = (text or "").strip()
+    if " " in text:
+        return len(text.split()), "words"
+    return len(re.sub(r"\s|[^\w]", "", text)), "chars"
+
+def plan_trim(duration, start, end, t_video=None, mode=None):
+    """
+    Seconds to cut from the head and tail. In "sync" mode only the excess over the video is
+    cut (tail first, then head), so audio that already fits is never made shorter than it.
+    """
+    mode = mode or TTS_TRIM_MODE
+    head = max(0.0, start - TTS_TRIM_PAD_S)
+    tail = max(0.0, duration - end - TTS_TRIM_PAD_S)
+    if mode == "off":
+        return 0.0, 0.0
+    if mode == "sync":
+        excess = duration - t_video if t_video else 0.0
+        if excess <= 0:
+            return 0.0, 0.0
+        tail = min(tail, excess)
+        head = min(head, excess - tail)
+    head = head if head >= MIN_TRIM_S else 0.0
+    tail = tail if tail >= MIN_TRIM_S else 0.0
+    return round(head, 3), round(tail, 3)
+
+def trim_command(input_path, output_path, start, duration, ffmpeg_path="ffmpeg"):
+    # Stream copy: MP3 cuts land on 26 ms frame boundaries, well inside the kept padding
+    return [ffmpeg_path, '-y', '-v', 'error', '-ss', f"{start:.3f}", '-i', input_path,
+            '-t', f"{duration:.3f}", '-map', '0:a:0', '-c', 'copy', output_path]
+
+def analyze_and_trim(audio_path, text, t_video=None, ffmpeg_path=None, mode=None):
+    """
+    Decodes the TTS output to PCM, finds where speech starts and ends, trims the silence the
+    sync step would otherwise have to pad the video for (in place), and reports speech rate.
+    """
+    ffmpeg_path = ffmpeg_path or ffmpeg_handler.ffmpeg_path
+    pcm = b"".join(ffmpeg_handler.stream_audio(audio_path, sample_rate=ANALYSIS_RATE))
+    start, end, voiced, duration = speech_bounds(pcm, ANALYSIS_RATE)
+    head, tail = plan_trim(duration, start, end, t_video, mode)
+
+    trimmed = duration - head - tail
+    if head or tail:
+        stem, ext = os.path.splitext(audio_path)
+        tmp_path = f"{stem}.trim{ext}"
+        subprocess.run(trim_command(audio_path, tmp_path, head, trimmed, ffmpeg_path), check=True)
+        os.replace(tmp_path, audio_path)
+
+    units, unit = count_units(text)
+    speech = max(end - start, 1e-6)
+    report = {
+        "duration_before": round(duration, 3),
+        "duration_after": round(trimmed, 3),
+        "trimmed_head": head,
+        "trimmed_tail": tail,
+        "speech_start": round(start, 3),
+        "speech_end": round(end, 3),
+        "voiced_seconds": round(voiced, 3),
+        "rate_unit": unit,
+        # How fast the narration is spoken vs. how fast it would have to be to fit the video
+        "rate": round(units / speech, 2),
+        "rate_to_fit_video": round(units / t_video, 2) if t_video else None,
+    }
+    if t_video:
+        report["sync_before"] = sync_logic.plan(t_video, duration)[0]
+        report["sync_after"] = sync_logic.plan(t_video, trimmed)[0]
+    return report
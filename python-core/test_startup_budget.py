@@ -0,0 +1,42 @@
+
+import sys
+import os
+
+# Add python-core to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.startup_profiler import profile_imports, direct_imports
+
+# Import-time budget for `import main` (pm2 watch restarts the API on every file change)
+STARTUP_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "1500"))
+
+# Heavy SDKs that must stay deferred until first use
+DEFERRED_MODULES = ["openai", "elevenlabs", "ffmpeg", "pandas", "openpyxl", "uvicorn", "numpy"]
+
+def check_startup_budget():
+    """Imports main in a fresh interpreter; raises AssertionError when over budget. Returns the profile."""
+    profile = profile_imports("main")
+    loaded = {m["name"] for m in profile["modules"]}
+
+    eager = [name for name in DEFERRED_MODULES if name in loaded]
+    assert not eager, f"Deferred SDKs imported at startup: {eager}"
+
+    assert profile["total_ms"] <= STARTUP_BUDGET_MS, (
+        f"Startup import time {profile['total_ms']:.0f} ms exceeds budget {STARTUP_BUDGET_MS:.0f} ms. "
+        f"Heaviest direct imports: "
+        + ", ".join(f"{m['name']}={m['cumulative_ms']:.0f}ms" for m in
+                    sorted(direct_imports(profile), key=lambda m: m["cumulative_ms"], reverse=True)[:5])
+    )
+    return profile
+
+def test_startup_budget():
+    check_startup_budget()
+
+if __name__ == "__main__":
+    print("[-] Checking API startup budget...")
+    try:
+        profile = check_startup_budget()
+        print(f"[+] Startup import time {profile['total_ms']:.0f} ms (budget {STARTUP_BUDGET_MS:.0f} ms)")
+    except AssertionError as e:
+        print(f"[!] {e}")
+        sys.exit(1)
@@ -0,0 +1,47 @@
+import sys
+import os
+import tempfile
+
+# Add python-core to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from services.excel_parser import iter_storyboard
+from services.storyboard_diff import StoryboardDiff
+
+STORYBOARD_CSV = "ID,Timecode,Content,Whisk Prompt\n1,00:00,Hello,a cat\n2,00:05,World,a dog\n"
+
+def _write_storyboard(directory):
+    path = os.path.join(directory, "episode.csv")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(STORYBOARD_CSV)
+    return path
+
+def test_reimport_with_sheets_keeps_ids():
+    """Importing the same file with and without an explicit sheet list must not re-key any scene."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = _write_storyboard(tmp)
+        diff = StoryboardDiff(snapshot_dir=tmp)
+        first = diff.reimport("episode", list(iter_storyboard(path)))
+        second = diff.reimport("episode", list(iter_storyboard(path, sheets=["episode"])))
+        assert second["summary"]["unchanged"] == 2, second["summary"]
+        assert second["summary"]["inserted"] == 0 and second["summary"]["deleted"] == 0, second["summary"]
+        assert [s["id"] for s in second["scenes"]] == [s["id"] for s in first["scenes"]]
+
+def test_legacy_snapshot_without_sheet():
+    """Snapshots written before scenes always carried their sheet match the first tab."""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = _write_storyboard(tmp)
+        diff = StoryboardDiff(snapshot_dir=tmp)
+        diff.save_snapshot("episode", [
+            {"id": f"scene_{s['key']}", "key": s["key"], "index": s["index"],
+             "timecode": s["timecode"], "content": s["content"], "prompt": s["prompt"]}
+            for s in iter_storyboard(path)
+        ])
+        result = diff.reimport("episode", list(iter_storyboard(path, sheets=["episode"])))
+        assert result["summary"]["unchanged"] == 2, result["summary"]
+        assert not result["requeue"], result["requeue"]
+
+if __name__ == "__main__":
+    for test in (test_reimport_with_sheets_keeps_ids, test_legacy_snapshot_without_sheet):
+        test()
+        print(f"[+] {test.__name__}")